@@ -4,10 +4,14 @@ from oci.monitoring import MonitoringClient
 from oci.monitoring.models import SummarizeMetricsDataDetails
 from oci.exceptions import ServiceError
 
-import argparse, time
+import argparse
 from datetime import datetime, timedelta
 import logging
 
+# Local - batched metric queries
+from oci_metric_batch import MetricBatcher
+from oci_metric_stats import SeriesStats
+
 # Create a default config using DEFAULT profile in default location
 # Refer to
 # https://docs.cloud.oracle.com/en-us/iaas/Content/API/Concepts/sdkconfig.htm#SDK_and_CLI_Configuration_File
@@ -50,6 +54,7 @@ config = config.from_file(profile_name=profile)
 # Set up OCI clients
 database_client = DatabaseClient(config)
 monitoring_client = MonitoringClient(config)
+metric_batcher = MetricBatcher(monitoring_client)
 
 # Main Flow - start with Infra OCID to get name
 # Script pulls Infra Detail, VM Cluster Detail (storage info)
@@ -113,45 +118,46 @@ try:
         limit=100
     ).data # List of DatabaseSummary
 
+    # Storage in use / Metric / XX day average of average storage used
+    # StorageUsed[1d]{resourceId_database =~ "DB OCID|DB OCID..."}.mean() - all DBs in one batched query
+    end_time = datetime.now()
+    start_time = end_time - timedelta(days = days_to_average)
+    storage_series = metric_batcher.fetch(
+        compartment_id=comp_ocid,
+        namespace="oci_database",
+        metric="StorageUsed",
+        interval="1d",
+        statistic="mean",
+        start_time=start_time,
+        end_time=end_time,
+        dimension="resourceId_database",
+        resource_ids=[db.id for db in databases],
+        resolution="6h"
+    )
+
+    # Average every returned series at once (one row per series)
+    series_keys = [(db_id, ts) for db_id, db_series in storage_series.items() for ts in db_series]
+    storage_means = SeriesStats.from_metric_data([ts for _, ts in series_keys]).mean()
+    storage_by_db = {}
+    for (db_id, ts), storage_used in zip(series_keys, storage_means.tolist()):
+        storage_by_db.setdefault(db_id, []).append(storage_used)
+
     for i,db in enumerate(databases,start=1):
         # DB Details
-
-        # Storage in use / Metric / XX day average of average storage used
-        # StorageUsed[1d]{resourceId_database = "DB OCID"}.mean()
-        end_time = datetime.now()
-        start_time = end_time - timedelta(days = days_to_average)
-        summarize_metrics_data_response = monitoring_client.summarize_metrics_data(
-            compartment_id=comp_ocid,
-            summarize_metrics_data_details=SummarizeMetricsDataDetails(
-                namespace="oci_database",
-                #query=f'StorageAllocatedByTablespace[1d]{{resourceId_database ="{db.id}" }}.mean()',
-                query=f'StorageUsed[1d]{{resourceId_database ="{db.id}" }}.mean()',
-                start_time=f"{start_time.isoformat()}Z",
-                end_time=f"{end_time.isoformat()}Z",
-                resolution="6h")
-        ).data
-
-        # Add and average the datapoints - probably a better way to do this...
         print(f"{i}: DB: {db.db_unique_name}, Status: {db.lifecycle_state }")
 
-        if summarize_metrics_data_response:
+        db_storage = storage_by_db.get(db.id.lower())
+        if db_storage:
             print(f'{i} DB: {db.db_unique_name}')
-            for j,ts in enumerate(summarize_metrics_data_response):
-                sum = 0
-                for dp in ts.aggregated_datapoints:
-                    sum = sum + dp.value
-                storage_used = sum / len(ts.aggregated_datapoints)
-                
+            for storage_used in db_storage:
                 # Decrement from total
                 remaining_rack_usable_storage = remaining_rack_usable_storage - storage_used
-                
+
                 # Print summary
                 print(f'    Storage Used GB: {storage_used:.2f}')
         else:
             print(f"    No Metrics for DB: {db.db_unique_name}")
-        
-        # Sleep a moment to give API some rest
-        time.sleep(.5)
+
     # Print Remaining Storage (Decrement)
     print(f"Remaining Unused Storage GB: {remaining_rack_usable_storage:.2f}")
 
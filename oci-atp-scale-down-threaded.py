@@ -9,277 +9,35 @@
 # Generic Imports
 import argparse
 import logging    # Python Logging
-from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import wait
-import time
 import datetime
 import json
 
 # OCI Imports
 from oci import config
-from oci import database
-from oci import identity
 from oci.auth.signers import InstancePrincipalsSecurityTokenSigner
-from oci.database.models import UpdateAutonomousDatabaseDetails
-from oci.resource_search import ResourceSearchClient
-from oci.resource_search.models import StructuredSearchDetails, ResourceSummary
-from oci.exceptions import ServiceError
 from oci.exceptions import ConfigFileNotFound
 
-import oci
-
-# Constants
-DEFAULT_SCHEDULE = "0,0,0,0,0,0,0,*,*,*,*,*,*,*,*,*,*,0,0,0,0,0,0,0"
-
-# Helper function
-def wait_for_available(db_id: str, start:bool):
-
-    # Get updated
-    db = database_client.get_autonomous_database(
-        autonomous_database_id=db_id
-    ).data
-
-    if start:
-        if db.lifecycle_state == "STOPPED":
-            # Start first
-            logger.debug(f'{"DRYRUN: " if dryrun else ""}Starting Autonomous DB: {db.display_name}')
-            if dryrun:
-                return
-            database_client.start_autonomous_database(db.id)
-
-    if dryrun:
-        logger.debug("Not waiting for AVAILABLE")
-        return
-    # Waiting for AVAILABLE
-    get_db_response = database_client.get_autonomous_database(db.id)
-    oci.wait_until(database_client, get_db_response, 'lifecycle_state', 'AVAILABLE')
-
-    logger.debug(f"Autonomous DB: {db.display_name} AVAILABLE")
-
-# Helper function
-def return_to_initial(db_id: str, initial:str):
-
-    # Get updated
-    db = database_client.get_autonomous_database(
-        autonomous_database_id=db_id
-    ).data
-
-    # Stop the DB if it was already stopped
-    if initial == "STOPPED" and db.lifecycle_state == "AVAILABLE":
-        logger.info(f'{"DRYRUN: " if dryrun else ""}Stopping Autonomous DB: {db.display_name}')
-        if dryrun:
-            return
-        database_client.stop_autonomous_database(db.id)
-
-    logger.debug(f"Kicked off STOP Autonomous for DB: {db.display_name} (Not Waiting)")
-
-# Threaded function
-def database_work(db_id: str):
-
-    # Get reference
-    db = database_client.get_autonomous_database(
-        autonomous_database_id=db_id
-        ).data
-    
-    # Get Initial Lifecycle to return to afterwards
-    db_initial_lifecycle_state = db.lifecycle_state
-    
-    # Return Val
-    did_work = {}
-    did_work["Detail"] = {"Name": f"{db.display_name}", "OCID": f"{db.id}", "Original CPU": f"{db.compute_model}", "License": f"{db.license_model}"}
-
-    # Now try it
-    try:
-        # Show before
-        logger.info(f"----{db_id}----Examine ({db.display_name})----------")
-        logger.info(f'CPU Model: {db.compute_model} Dedicated: {db.is_dedicated} DG Role: {db.role}')
-        logger.info(f"Storage Name: {db.display_name} DB TB: {db.data_storage_size_in_tbs}")
-        logger.info(f"License Model: {db.license_model} Edition: {db.database_edition} ")
-        logger.info(f"----{db_id}----Start ({db.display_name})----------")
-
-        if db.is_dedicated:
-            logger.debug("Don't operate on dedicated")
-            did_work["No-op"] = {"Dedicated": True}
-            return did_work
-
-        if db.role == "STANDBY":
-            logger.debug("Don't operate on anything but primary")
-            did_work["No-op"] = {"Role": f"{db.role}"}
-            return did_work
-
-        if db.is_free_tier:
-            logger.debug("Don't operate on free ATP")
-            did_work["No-op"] = {"Free": f"{db.is_free_tier}"}
-            return did_work
-        
-        if db.is_dev_tier:
-            logger.debug("Don't operate on Developer ATP")
-            did_work["No-op"] = {"Dev": f"{db.is_dev_tier}"}
-            return did_work        
-
-        if db.lifecycle_state == "UNAVAILABLE":
-            logger.debug("Don't operate on UNAVAILABLE DBs")
-            did_work["No-op"] = {"Lifecycle": f"{db.lifecycle_state}"}
-
-            return did_work
-
-        # Compute Model - to ECPU if necessary, otherwise check backup retention and adjust
-        logger.debug(f'CPU Model: {db.compute_model} Count: {db.compute_count if db.compute_model == "OCPU" else db.compute_count}')
-        if db.compute_model == "OCPU":
-
-            # Actual Conversion
-            logger.info(f'>>>{"DRYRUN: " if dryrun else ""}Converting ECPU  with {backup_retention} days retention for Autonomous DB: {db.display_name}')
-
-            wait_for_available(db_id=db.id, start=True)
-
-            if not dryrun:
-                database_client.update_autonomous_database(
-                    autonomous_database_id=db.id,
-                    update_autonomous_database_details=UpdateAutonomousDatabaseDetails(
-                        backup_retention_period_in_days=backup_retention,
-                        compute_model="ECPU"
-                        )
-                )
-            # Waiting for AVAILABLE
-            wait_for_available(db_id=db.id, start=False)
-
-            did_work["ECPU"] = {"Convert": True, "Retention": backup_retention}
-
-            logger.debug(f'{"DRYRUN: " if dryrun else ""}Converted ECPU Autonomous DB: {db.display_name}')
-
-        elif db.backup_retention_period_in_days > backup_retention:
-            logger.info(f'>>>{"DRYRUN: " if dryrun else ""}Update Backup retention DB: {db.display_name} to configured {backup_retention} days')
-            wait_for_available(db_id=db.id, start=True)
-
-            if not dryrun:
-                database_client.update_autonomous_database(
-                    autonomous_database_id=db.id,
-                    update_autonomous_database_details=UpdateAutonomousDatabaseDetails(
-                        backup_retention_period_in_days=backup_retention
-                    )
-                )
-
-            did_work["Backups"] = {"Retention": backup_retention}
-
-            # Waiting for AVAILABLE
-            wait_for_available(db_id=db.id, start=False)
-
-            logger.debug(f'{"DRYRUN: " if dryrun else ""}Updated License DB: {db.display_name} to BYOL / SE')
-
-            
-        # Storage - scale to GB
-        logger.debug(f"Storage Name: {db.display_name} DB TB: {db.data_storage_size_in_tbs} Actual: {db.actual_used_data_storage_size_in_tbs} Allocated: {db.allocated_storage_size_in_tbs}")
-        if not db.data_storage_size_in_tbs:
-            logger.debug(f"Storage in GB Model - no action")
-        else:
-            # Figure out storage
-            # Existing TB * 1024 (conversion) * 2 (allow extra)
-            new_storage_gb = int(db.allocated_storage_size_in_tbs * 1024 * 2)
-            new_storage_gb = 20 if new_storage_gb < 20 else new_storage_gb
-            logger.info(f'>>>{"DRYRUN: " if dryrun else ""}Scale Storage DB: {db.display_name} from {db.data_storage_size_in_tbs} TB to {new_storage_gb} GB (auto-scale)')
-
-            # Waiting for AVAILABLE
-            wait_for_available(db_id=db.id, start=True)
-
-            # Actual scaling (2 ECPU, auto-scale, Storage auto-scale)
-            if not dryrun:
-                database_client.update_autonomous_database(
-                    autonomous_database_id=db.id,
-                    update_autonomous_database_details=UpdateAutonomousDatabaseDetails(
-                        is_auto_scaling_for_storage_enabled=True,
-                        data_storage_size_in_gbs=new_storage_gb,
-                        compute_count=2.0,
-                        is_auto_scaling_enabled=True
-
-                    )
-                )
-            did_work["Scale"] = {"convert": True, "GB": new_storage_gb}
-
-            # Waiting for AVAILABLE
-            wait_for_available(db_id=db.id, start=False)
-
-            logger.debug(f'{"DRYRUN: " if dryrun else ""}Scale Storage DB: {db.display_name} completed')
-
-        # License Model - BYOL and SE
-        if db.license_model == "LICENSE_INCLUDED":
-            logger.info(f'>>>{"DRYRUN: " if dryrun else ""}Update License DB: {db.display_name} to BYOL / SE')
-
-            wait_for_available(db_id=db.id, start=True)
-
-            if not dryrun:
-                database_client.update_autonomous_database(
-                    autonomous_database_id=db.id,
-                    update_autonomous_database_details=UpdateAutonomousDatabaseDetails(
-                        license_model="BRING_YOUR_OWN_LICENSE",
-                        database_edition="STANDARD_EDITION"
-                    )
-                )
-
-            did_work["License"] = {"BYOL": True, "SE": True}
-
-            # Waiting for AVAILABLE
-            wait_for_available(db_id=db.id, start=False)
-
-            logger.debug(f'{"DRYRUN: " if dryrun else ""}Updated License DB: {db.display_name} to BYOL / SE')
-
-        # Tagging - require Schedule Tag
-
-        current_tags = db.defined_tags
-        if "Schedule" in current_tags:
-            logger.debug(f'Current Schedule: {current_tags["Schedule"]}')
-            # Check tag for all 1
-            schedule_tag = current_tags["Schedule"]
-            if 'AnyDay' in schedule_tag:
-                logger.debug(f'AnyDay tag: {schedule_tag["AnyDay"]}')
-                if "0" in schedule_tag["AnyDay"]:
-                    logger.debug("Compliant - will stop")
-                else:
-                    logger.info(f'>>>{"DRYRUN: " if dryrun else ""}Not compliant({schedule_tag["AnyDay"]}) - will not stop - fixing')
-                    current_tags["Schedule"] = {"AnyDay" : DEFAULT_SCHEDULE}
-
-                    # Start and wait if needed
-                    wait_for_available(db_id=db.id, start=True)
-
-                    if not dryrun:
-                        database_client.update_autonomous_database(
-                            autonomous_database_id=db.id,
-                            update_autonomous_database_details=UpdateAutonomousDatabaseDetails(
-                                defined_tags=current_tags
-                            )
-                        )
-                    wait_for_available(db_id=db.id, start=False)
-                    did_work["Tag"] = {"default": True}
-
-        else:
-            # Add default tag to defined tags
-            current_tags["Schedule"] = {"AnyDay" : DEFAULT_SCHEDULE}
-
-            logger.info(f'>>>{"DRYRUN: " if dryrun else ""}Updating Tags DB: {db.display_name} to Schedule / AnyDay Default')
-
-            # Start and wait if needed
-            wait_for_available(db_id=db.id, start=True)
-
-            if not dryrun:
-                database_client.update_autonomous_database(
-                    autonomous_database_id=db.id,
-                    update_autonomous_database_details=UpdateAutonomousDatabaseDetails(
-                        defined_tags=current_tags
-                    )
-                )
-            did_work["Tag"] = {"default": True}
-            wait_for_available(db_id=db.id, start=False)
-            logger.debug(f'{"DRYRUN: " if dryrun else ""}Updated Tags DB: {db.display_name} to Schedule / AnyDay Default')
-
-        # Return to initial state
-        return_to_initial(db_id=db.id,initial=db_initial_lifecycle_state)
-
-        logger.debug(f"----{db_id}----Complete ({db.display_name})----------")
-    except ServiceError as exc:
-        logger.error(f"Failed to complete action for DB: {db.display_name} \nReason: {exc}")
-        did_work["Error"] = {"Exception": exc.message}
-    
-    return did_work    
-    # End main function
+# Local - desired-state reconciler, wave rollout, region fan-out and run journal
+from oci_adb_reconciler import DEFAULT_SCHEDULE, plan_summary
+from oci_wave_rollout import DEFAULT_CANARY, DEFAULT_COMPARTMENT_CAP, DEFAULT_ERROR_RATE
+from oci_region_fanout import RegionClients, RegionFanout
+from oci_adb_fleet import reconcile_region, merge_regions, write_savings
+from oci_search_cache import SearchCache, cache_filename
+from oci_rate_limiter import RateLimiter
+from oci_fleet_trace import FleetTracer
+from oci_fleet_journal import FleetJournal, journal_filename
+
+# Constants - target for every ATP / AJD (override with -s spec.json)
+ATP_SPEC = {
+    "compute_model": "ECPU",
+    "max_compute_count": 2.0,
+    "storage_factor": 2.0,
+    "storage_auto_scaling": True,
+    "auto_scaling": True,
+    "license_model": "BRING_YOUR_OWN_LICENSE",
+    "database_edition": "STANDARD_EDITION",
+    "schedule": DEFAULT_SCHEDULE,
+}
 
 # Only if called in Main
 if __name__ == "__main__":
@@ -290,9 +48,18 @@ if __name__ == "__main__":
     parser.add_argument("-ip", "--instanceprincipal", help="Use Instance Principal Auth - negates --profile", action="store_true")
     parser.add_argument("-ipr", "--region", help="Use Instance Principal with alt region")
     parser.add_argument("--dryrun", help="Dry Run - no action", action="store_true")
-    parser.add_argument("-t", "--threads", help="Concurrent Threads (def=5)", type=int, default=5)
+    parser.add_argument("-t", "--threads", help="Concurrent Threads, shared by all regions (def=5)", type=int, default=5)
+    parser.add_argument("-ar", "--allregions", help="Every subscribed region at once, one report", action="store_true")
     parser.add_argument("-r", "--retention", help="Days of backup retention (def=14)", type=int, default=14)
     parser.add_argument("-w", "--writejson", help="output json", action="store_true")
+    parser.add_argument("-s", "--spec", help="JSON file with target spec keys (see oci_adb_reconciler.py) to override the defaults")
+    parser.add_argument("-rz", "--rightsize", help="Size compute / storage from this many days of metrics (e.g. 14) and write a savings report", type=int)
+    parser.add_argument("-cn", "--canary", help=f"DBs changed (and checked) before any others, 0 for none (def={DEFAULT_CANARY})", type=int, default=DEFAULT_CANARY)
+    parser.add_argument("-cc", "--compartmentcap", help=f"Max DBs in flight per compartment, 0 for no cap (def={DEFAULT_COMPARTMENT_CAP})", type=int, default=DEFAULT_COMPARTMENT_CAP)
+    parser.add_argument("-er", "--errorrate", help=f"Stop starting DBs at this error rate (def={DEFAULT_ERROR_RATE})", type=float, default=DEFAULT_ERROR_RATE)
+    parser.add_argument("-tr", "--trace", help="Write a Chrome trace of every DB step and log p50 / p95 per step", action="store_true")
+    parser.add_argument("--refresh", help="Search again instead of using a recent search snapshot from any script", action="store_true")
+    parser.add_argument("--restart", help="Start over instead of resuming an unfinished run from the journal", action="store_true")
 
     args = parser.parse_args()
     verbose = args.verbose
@@ -301,8 +68,17 @@ if __name__ == "__main__":
     region = args.region
     dryrun = args.dryrun
     threads = args.threads
+    all_regions = args.allregions
+    refresh = args.refresh
+    trace = args.trace
     backup_retention = args.retention
     output_json = args.writejson
+    spec_file = args.spec
+    rightsize_days = args.rightsize
+    canary = args.canary
+    compartment_cap = args.compartmentcap
+    error_rate = args.errorrate
+    restart = args.restart
 
     # Logging Setup
     logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
@@ -310,7 +86,9 @@ if __name__ == "__main__":
     if verbose:
         logger.setLevel(logging.DEBUG)
 
-    # Client creation
+    # Client creation - per region on first use, every call through the shared rate limiter (which counts calls for -tr)
+    tracer = FleetTracer() if trace else None
+    limiter = RateLimiter(tracer=tracer)
     if use_instance_principals:
         logger.info(f"Using Instance Principal Authentication")
 
@@ -319,20 +97,18 @@ if __name__ == "__main__":
         if region:
             config_ip={"region": region}
             logger.info(f"Changing region to {region}")
-        database_client = database.DatabaseClient(config=config_ip, signer=signer, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
-        search_client = ResourceSearchClient(config=config_ip, signer=signer)
+        clients = RegionClients(config_ip, signer, limiter)
     else:
         # Use a profile (must be defined)
         try:
             logger.info(f"Using Profile Authentication: {profile}")
             config = config.from_file(profile_name=profile)
-
-            # Create the OCI Client to use
-            database_client = database.DatabaseClient(config, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
-            search_client = ResourceSearchClient(config)
+            clients = RegionClients(config, limiter=limiter)
         except ConfigFileNotFound as exc:
             logger.fatal(f"Unable to use Profile Authentication: {exc}")
             exit(1)
+    regions = clients.subscribed_regions() if all_regions else [clients.region]
+    cache = SearchCache(cache_filename(clients.tenancy_id), refresh=refresh)
 
     # Main routine
         
@@ -345,35 +121,59 @@ if __name__ == "__main__":
     # 4) Tags for AnyDay are there and not 1,1,1
 
 
-    # Get ATP (Search)
-    atp_db = search_client.search_resources(
-        search_details=StructuredSearchDetails(
-            type = "Structured",
-            query='query autonomousdatabase resources return allAdditionalFields where (workloadType="ATP") || (workloadType="JSON")'
-        ),
-        limit=1000
-    ).data
-
-    # Build a list of IDs
-    db_ocids = []
-    for i,db_it in enumerate(atp_db.items, start=1):
-        db_ocids.append(db_it.identifier)
+    # Journal - a crashed / interrupted run is resumed: DONE DBs are skipped, the rest pick up where they were
+    # One journal for all regions - OCIDs are unique across regions
+    journal = None
+    if not dryrun:
+        job = f'atp-scale-down{"-all-regions" if all_regions else f"-{region}" if region else ""}'
+        journal = FleetJournal(journal_filename(job), job, restart=restart)
+    completed = journal.completed if journal else set()
+
+    # Target spec - script defaults, retention from -r, then anything in -s
+    spec = dict(ATP_SPEC, backup_retention_days=backup_retention)
+    if spec_file:
+        with open(spec_file) as specfile:
+            spec.update(json.load(specfile))
+    logger.info(f"Target spec: {spec}")
+
+    # Per region: search (every page, sharded by compartment when large) streamed into full details,
+    # then plan and apply the spec in canary / waves (not for a dry run).  All regions at once with -ar,
+    # sharing the -t threads for the API calls between waits (and splitting them for the searches)
+    rollout_options = dict(canary=canary, compartment_cap=compartment_cap, error_rate=error_rate)
+    fanout = RegionFanout(regions, budget=threads)
+    by_region = fanout.run(lambda region_name, executor: reconcile_region(
+        clients, region_name, 'query autonomousdatabase resources return allAdditionalFields where (workloadType="ATP") || (workloadType="JSON")', spec, executor,
+        threads=max(threads // len(regions), 1), dryrun=dryrun, journal=journal, rightsize_days=rightsize_days,
+        rollout_options=rollout_options, cache=cache, tracer=tracer))
+    results, savings, tripped = merge_regions(by_region)
+    if rightsize_days:
+        write_savings(savings)
+    limiter.log_summary()
+    if tracer:
+        tracer.log_summary()
+        tracer.write(f'oci-atp-scale-down-trace-{datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")}.json')
+    if dryrun:
+        logger.info(f"DRYRUN plan:\n{plan_summary(results)}")
+    for failed_region, exc in fanout.errors.items():
+        logger.error(f"Region {failed_region} not done: {exc!r}")
+    if journal:
+        logger.info(f"Skipped {len(completed)} DBs already done in this run")
+        # A stopped rollout (or failed region) stays open - the rerun (after fixing the cause) resumes with the rest
+        if not tripped and not fanout.errors:
+            journal.finish()
 
-    with ThreadPoolExecutor(max_workers = threads, thread_name_prefix="thread") as executor:
-        results = executor.map(database_work, db_ocids)
-        logger.info(f"Kicked off {threads} threads for parallel execution - adjust as necessary")
-    
     # Write to file if desired, else just print
     if output_json:
         datestring = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")
         filename = f'oci-atp-scale-down-{datestring}.json'
+        # From the journal (includes DBs done before a resume), one result at a time
         with open(filename,"w") as outfile:
-
-            for result in results:
-                outfile.write(json.dumps(result, indent=2))
+            outfile.write("[\n")
+            for i, result in enumerate(journal.results() if journal else results):
+                outfile.write((",\n" if i else "") + json.dumps(result, indent=2))
+            outfile.write("\n]\n")
 
         logging.info(f"Script complete - wrote JSON to {filename}.")
     else:
         for result in results:
             logger.debug(f"Result: {result}")
-
@@ -20,12 +20,14 @@ from oci.core import BlockstorageClient
 from oci.core.models import UpdateVolumeDetails, DetachedVolumeAutotunePolicy, PerformanceBasedAutotunePolicy, BootVolume, Volume
 from oci.auth.signers import InstancePrincipalsSecurityTokenSigner
 from oci.resource_search import ResourceSearchClient
-from oci.resource_search.models import StructuredSearchDetails, ResourceSummary
 from oci.exceptions import ServiceError
 from oci.exceptions import ConfigFileNotFound
 
 import oci
 
+# Local - search snapshots shared with the other fleet scripts
+from oci_search_cache import SearchCache, cache_filename
+
 # Constants
 DEFAULT_SCHEDULE = "0,0,0,0,0,0,0,*,*,*,*,*,*,*,*,*,*,0,0,0,0,0,0,0"
 
@@ -165,6 +167,7 @@ if __name__ == "__main__":
     parser.add_argument("-t", "--threads", help="Concurrent Threads (def=5)", type=int, default=5)
     parser.add_argument("-r", "--retention", help="Days of backup retention (def=14)", type=int, default=14)
     parser.add_argument("-w", "--writejson", help="output json", action="store_true")
+    parser.add_argument("--refresh", help="Search again instead of using a recent search snapshot from any script", action="store_true")
 
     args = parser.parse_args()
     verbose = args.verbose
@@ -175,6 +178,7 @@ if __name__ == "__main__":
     threads = args.threads
     backup_retention = args.retention
     output_json = args.writejson
+    refresh = args.refresh
 
     # Logging Setup
     logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
@@ -195,6 +199,7 @@ if __name__ == "__main__":
             logger.info(f"Changing region to {region}")
         volume_client = BlockstorageClient(config=config_ip, signer=signer, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
         search_client = ResourceSearchClient(config=config_ip, signer=signer)
+        tenancy_id = signer.tenancy_id
     else:
         # Use a profile (must be defined)
         try:
@@ -204,6 +209,7 @@ if __name__ == "__main__":
             # Create the OCI Client to use
             volume_client = BlockstorageClient(config, retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
             search_client = ResourceSearchClient(config)
+            tenancy_id = config["tenancy"]
         except ConfigFileNotFound as exc:
             logger.fatal(f"Unable to use Profile Authentication: {exc}")
             exit(1)
@@ -244,17 +250,13 @@ if __name__ == "__main__":
     #         logger.info(f"Kicked off {threads} threads for parallel execution - adjust as necessary")
 
 
-    backups = search_client.search_resources(
-        search_details=StructuredSearchDetails(
-            type = "Structured",
-            query='query bootvolumebackup,volumebackup resources'
-        ),
-        limit=1000
-    ).data
+    # Every page, or a recent snapshot of the same search
+    cache = SearchCache(cache_filename(tenancy_id), refresh=refresh)
+    backups = cache.search(search_client, 'query bootvolumebackup,volumebackup resources')
 
     # Build a list of backup IDs
     backup_ocids = []
-    for i,v in enumerate(backups.items, start=1):
+    for i,v in enumerate(backups, start=1):
         backup_ocids.append(v.identifier)
     
     # for v in backup_ocids:
@@ -10,9 +10,16 @@ import logging
 import json
 import datetime
 
+# Local - streaming report output
+from oci_report_writer import ReportWriter, report_filename, FORMATS
+
 # Constant - Number of resources search can handle per query
 BATCH_SIZE = 50
 
+# Columns for streamed (ndjson/csv/parquet) output - one row per resource / service / SKU / period
+REPORT_FIELDS = ["type", "identifier", "resource_name", "app_name", "service", "sku_name",
+                 "start", "end", "amount", "unit", "currency"]
+
 # This variation of the script is designed to take a specific tag NS/Key/Value and do the following:
 # 1) Get all cost data by tag filter and services needed (compute, boot, block, backups, file store, bucket)
 # 2) Augment the data using Search Result - name of resource
@@ -29,6 +36,8 @@ parser.add_argument("-sd", "--startdate", help="Start Date YYYY-MM-DD")
 parser.add_argument("-ed", "--enddate", help="Start Date YYYY-MM-DD (give next day to include previous day)")
 parser.add_argument("-r", "--range", help="Predefined Range: Only MTD Supported")
 parser.add_argument("-g", "--granularity", help="DAILY or MONTHLY", default="DAILY")
+parser.add_argument("-f", "--format", help="Output format: json (nested, default) or streamed rows", choices=["json"] + FORMATS, default="json")
+parser.add_argument("-z", "--compress", help="Compression for streamed output (gzip/bz2/xz, or parquet codec)")
 
 args = parser.parse_args()
 verbose = args.verbose
@@ -37,6 +46,8 @@ granularity = args.granularity
 tag_ns = args.tagns
 tag_key = args.tagkey
 tag_values = args.tagvalues
+output_format = args.format
+compression = args.compress
 if args.range:
     range = args.range
     # Process as MTD for example (hard code)
@@ -128,65 +139,16 @@ usage_summary = usage_client.request_summarized_usages(
 ).data
 logging.debug(f'Usage Report: {usage_summary}')
 
-# Empty list of all OCIDs we need to get resource name details for.
-ocid_list = []
-
-# Iterate results and augment, add to results
-for i,cost_detail in enumerate(cost_summary.items, start=1):
-
-    if cost_detail.resource_name:
-        logging.info(f"Resource Cost: {cost_detail.resource_name}")
-    # Run Search to get details for resource
-    search_query_details = StructuredSearchDetails(
-        type = "Structured",
-        query=f'query all resources where identifier="{cost_detail.resource_id}"'
-    )
-
-    # Make results with just cost (fill in rest later)
-    # Only do it if cost is there
-    if cost_detail.computed_amount:
-        # Now Loop through results and if we match, then only append cost
-        found = False
-        for resource in results:
-            if resource["identifier"] == cost_detail.resource_id:
-                # Append the cost part only
-                resource["cost"].append({"start":str(cost_detail.time_usage_started),"end":str(cost_detail.time_usage_ended), "service_sku_name": f"{cost_detail.service}/{cost_detail.sku_name}", "cost":f"{cost_detail.computed_amount:.2f}"})
-                found = True
-        if not found:
-            newjson = {"resource_name":"Deleted Resource","app_name":"Deleted Resource",\
-            "identifier":cost_detail.resource_id,"cost":[{"start":str(cost_detail.time_usage_started), \
-            "end":str(cost_detail.time_usage_ended), "service_sku_name": f"{cost_detail.service}/{cost_detail.sku_name}", "cost":f"{cost_detail.computed_amount:.2f}"}],\
-            "usage":[]}
-            results.append(newjson)
-        
-        # Building OCID List
-        ocid_list.append(f'identifier=="{cost_detail.resource_id}"')
-
-    else:
-        logging.warning(f"Skipping {cost_detail.resource_id} as cost is None.")
-
-# Iterate Usage results add to results
-for usage_detail in usage_summary.items:
+# Distinct OCIDs we need to get resource name details for.
+ocid_list = list(dict.fromkeys(cost_detail.resource_id for cost_detail in cost_summary.items if cost_detail.computed_amount))
 
-    logging.debug(f"Resource Usage: {usage_detail}")
-
-    # Only add usage if it is there
-    if usage_detail.computed_quantity:
-        # Loop through and find our resource
-        for resource in results:
-            if resource["identifier"] == usage_detail.resource_id:
-                # We can add it to our result
-                resource["usage"].append({"start":str(usage_detail.time_usage_started), \
-"end":str(usage_detail.time_usage_ended), "service_sku_name": f"{usage_detail.service}/{usage_detail.sku_name}",\
-"usage":f"{usage_detail.computed_quantity:.2f}", "units": usage_detail.unit})
-
-    else:
-        logging.warning(f"Skipping {usage_detail.resource_id} as usage is None.")
+# Resource details by OCID (name, app tag) - anything not found by search has been deleted
+resource_details = {}
 
 # Run query in batches, augment results, and reset list
 internal_list = []
 for i,ocid in enumerate(ocid_list,start=1):
-    internal_list.append(ocid)
+    internal_list.append(f'identifier=="{ocid}"')
     if len(internal_list) == BATCH_SIZE or i == len(ocid_list):
 
         # This part is an iteration to build OCID list for the resource query
@@ -206,22 +168,87 @@ for i,ocid in enumerate(ocid_list,start=1):
 
         # Process results
         for search_result in search_results.items:
-            # Loop through results 
-            for resource in results:
-                if resource["identifier"] == search_result.identifier:
-                    # Add result details
-                    resource["resource_name"] = search_result.display_name
-                    resource["app_name"] = search_result.defined_tags[tag_ns][tag_key]
+            resource_details[search_result.identifier] = {
+                "resource_name": search_result.display_name,
+                "app_name": search_result.defined_tags.get(tag_ns, {}).get(tag_key)
+            }
         # Reset Internal OCID List
         internal_list = []
-# ### End of main loop
-
-logging.debug(f"Cost Summary: {results}")
+# ### End of search loop
 
-# Write to file
+deleted_resource = {"resource_name": "Deleted Resource", "app_name": "Deleted Resource"}
 datestring = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")
-filename = f'cost2-data-{"-".join(tag_values)}-{granularity}-{datestring}.json'
-with open(filename,"w") as outfile:
-    outfile.write(json.dumps(results, indent=2))
+basename = f'cost2-data-{"-".join(tag_values)}-{granularity}-{datestring}'
+
+if output_format == "json":
+    # Nested JSON (original format) - one entry per resource
+    results = {}
+
+    # Iterate results and augment, add to results
+    for cost_detail in cost_summary.items:
+
+        if cost_detail.resource_name:
+            logging.info(f"Resource Cost: {cost_detail.resource_name}")
+
+        # Only do it if cost is there
+        if cost_detail.computed_amount:
+            if cost_detail.resource_id not in results:
+                details = resource_details.get(cost_detail.resource_id, deleted_resource)
+                results[cost_detail.resource_id] = {"resource_name": details["resource_name"], "app_name": details["app_name"],
+                                                    "identifier": cost_detail.resource_id, "cost": [], "usage": []}
+            # Append the cost part only
+            results[cost_detail.resource_id]["cost"].append({"start":str(cost_detail.time_usage_started),"end":str(cost_detail.time_usage_ended), "service_sku_name": f"{cost_detail.service}/{cost_detail.sku_name}", "cost":f"{cost_detail.computed_amount:.2f}"})
+        else:
+            logging.warning(f"Skipping {cost_detail.resource_id} as cost is None.")
+
+    # Iterate Usage results add to results
+    for usage_detail in usage_summary.items:
+
+        logging.debug(f"Resource Usage: {usage_detail}")
+
+        # Only add usage if it is there
+        if usage_detail.computed_quantity:
+            # Find our resource
+            if usage_detail.resource_id in results:
+                # We can add it to our result
+                results[usage_detail.resource_id]["usage"].append({"start":str(usage_detail.time_usage_started), \
+"end":str(usage_detail.time_usage_ended), "service_sku_name": f"{usage_detail.service}/{usage_detail.sku_name}",\
+"usage":f"{usage_detail.computed_quantity:.2f}", "units": usage_detail.unit})
 
-logging.info(f"Script complete - write JSON to {filename}.")
\ No newline at end of file
+        else:
+            logging.warning(f"Skipping {usage_detail.resource_id} as usage is None.")
+
+    logging.debug(f"Cost Summary: {results}")
+
+    # Write to file
+    filename = f'{basename}.json'
+    with open(filename,"w") as outfile:
+        outfile.write(json.dumps(list(results.values()), indent=2))
+
+else:
+    # Streamed rows - numeric amounts, written as they are produced
+    filename = report_filename(basename, output_format, compression)
+    with ReportWriter(filename, format=output_format, fields=REPORT_FIELDS, compression=compression) as writer:
+        for cost_detail in cost_summary.items:
+            if not cost_detail.computed_amount:
+                logging.warning(f"Skipping {cost_detail.resource_id} as cost is None.")
+                continue
+            details = resource_details.get(cost_detail.resource_id, deleted_resource)
+            writer.write({"type": "cost", "identifier": cost_detail.resource_id,
+                          "resource_name": details["resource_name"], "app_name": details["app_name"],
+                          "service": cost_detail.service, "sku_name": cost_detail.sku_name,
+                          "start": cost_detail.time_usage_started, "end": cost_detail.time_usage_ended,
+                          "amount": float(cost_detail.computed_amount), "unit": None, "currency": cost_detail.currency})
+        for usage_detail in usage_summary.items:
+            if not usage_detail.computed_quantity:
+                logging.warning(f"Skipping {usage_detail.resource_id} as usage is None.")
+                continue
+            details = resource_details.get(usage_detail.resource_id, deleted_resource)
+            writer.write({"type": "usage", "identifier": usage_detail.resource_id,
+                          "resource_name": details["resource_name"], "app_name": details["app_name"],
+                          "service": usage_detail.service, "sku_name": usage_detail.sku_name,
+                          "start": usage_detail.time_usage_started, "end": usage_detail.time_usage_ended,
+                          "amount": float(usage_detail.computed_quantity), "unit": usage_detail.unit, "currency": None})
+    logging.info(f"Streamed {writer.rows_written} rows")
+
+logging.info(f"Script complete - wrote {output_format} to {filename}.")
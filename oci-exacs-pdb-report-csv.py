@@ -2,28 +2,39 @@ from oci import config
 from oci.database import DatabaseClient
 from oci.monitoring import MonitoringClient
 from oci.database_management import DbManagementClient
-from oci.database_management.models import DatabaseParametersCollection
-from oci.monitoring.models import SummarizeMetricsDataDetails
 from oci.exceptions import ServiceError
 
 import argparse, time
 from datetime import datetime, timedelta
 import logging
-import csv
 import os
 
+# Local - batched metric queries
+from oci_metric_batch import MetricBatcher
+from oci_metric_stats import mean_by_resource
+from oci_rate_limiter import RateLimiter, RateLimitedClient
+from oci_exacs_inventory import PdbInventory
+from oci_report_writer import ReportWriter
+
+# Constants
+REPORT_FIELDS = ["VMC_OCID","VMC_NAME","CDB_OCID","CDB_NAME","CDB_LIFECYCLE","STORAGE_CDB","MIN_CPU_CDB","PDB_OCID","PDB_NAME","PDB_STORAGE","MIN_CPU_PDB"]
+
 # Main Routine
 parser = argparse.ArgumentParser()
 parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
 parser.add_argument("-pr", "--profile", help="Config Profile, named", default="DEFAULT")
 parser.add_argument("-c", "--compartmentocid", help="Database Compartment OCID", required=True)
 parser.add_argument("-d", "--daystoaverage", help="Days of data to analyze storage usage for", type=int, default=30)
+parser.add_argument("-t", "--threads", help="Concurrent PDB workers (def=8)", type=int, default=8)
+parser.add_argument("-rs", "--resume", help="Report file of an interrupted run to finish (uses its .partial)")
 
 args = parser.parse_args()
 verbose = args.verbose
 profile = args.profile
 comp_ocid = args.compartmentocid
 days_to_average = args.daystoaverage
+threads = args.threads
+resume_file = args.resume
 
 # If required, verbose
 if verbose:
@@ -35,35 +46,31 @@ print(f'Using {days_to_average} days of data to analyze storage')
 # Initialize service client with default config file
 config = config.from_file(profile_name=profile)
 
-# Set up OCI clients
-database_client = DatabaseClient(config)
-monitoring_client = MonitoringClient(config)
-dbm_client = DbManagementClient(config)
+# Set up OCI clients - calls are paced by one shared limiter (backs off on 429s)
+limiter = RateLimiter()
+database_client = RateLimitedClient(DatabaseClient(config), limiter)
+monitoring_client = RateLimitedClient(MonitoringClient(config), limiter)
+dbm_client = RateLimitedClient(DbManagementClient(config), limiter)
+metric_batcher = MetricBatcher(monitoring_client)
+inventory = PdbInventory(database_client, dbm_client, threads=threads)
 
 # Main Flow - start with Infra OCID to get name
 # Script pulls Infra Detail, VM Cluster Detail (storage info)
 # Then loops over all DBs and pulls details on storage used
 
-# Define file name(s)
-output_file_name = f'pdb-report-{time.strftime("%Y%m%d-%H%M%S")}-{comp_ocid}.csv'
-temp_file_name = f'/tmp/{output_file_name}'
+# Define file name(s) - rows go to <file>.partial as they complete, renamed to <file> at the end
+# If a run dies, re-run with -rs <file> to keep the rows already written and do only the rest
+output_file_name = resume_file or f'pdb-report-{time.strftime("%Y%m%d-%H%M%S")}-{comp_ocid}.csv'
 
 # Open the file for writing
-with open(temp_file_name, 'w', newline='') as csvfile:
-    # Set up CSV
-    csv_writer = csv.writer(csvfile, delimiter='^',
-                            quotechar='"', quoting=csv.QUOTE_MINIMAL)
-    csv_writer.writerow(["VMC_OCID","VMC_NAME","CDB_OCID","CDB_NAME","CDB_LIFECYCLE","STORAGE_CDB","MIN_CPU_CDB","PDB_OCID","PDB_NAME","PDB_STORAGE","MIN_CPU_PDB"])
-
+with ReportWriter(output_file_name, format="csv", fields=REPORT_FIELDS, delimiter="|", atomic=True,
+                  resume_key="PDB_OCID", flush_rows=1) as writer:
     # Get Infra
     try:
 
         # For each database in cluster, get min_cpu_count and storage used
         # Cloud VM Cluster
-        databases = database_client.list_pluggable_databases(
-            compartment_id=comp_ocid, 
-            limit=100
-        ).data # List of DatabaseSummary
+        databases = inventory.list_pdbs(comp_ocid) # All pages - List of PluggableDatabaseSummary
 
         # # Get all VM Clusters
         # vm_clusters = database_client.list_cloud_vm_clusters(
@@ -81,117 +88,41 @@ with open(temp_file_name, 'w', newline='') as csvfile:
             #     limit=100
             # ).data # List of DatabaseSummary
 
-        for pdb in databases:
-            # CDB Details
-            cdb = database_client.get_database(
-                database_id=pdb. container_database_id
-            ).data
-            # VMC Details
-            vm_cluster = database_client.get_cloud_vm_cluster(
-                cloud_vm_cluster_id=cdb.vm_cluster_id
-            ).data
-       
-            print(f"VMC: {vm_cluster.display_name} DB: {cdb.db_unique_name}, Status: {cdb.lifecycle_state} RO: {pdb.open_mode}")
-
-            # CDB Storage
-            # Storage in use / Metric / XX day average of average storage used
-            # StorageUsed[1d]{resourceId_database = "DB OCID"}.mean()
-            end_time = datetime.now()
-            start_time = end_time - timedelta(days = days_to_average)
-            cdb_summarize_metrics_data_response = monitoring_client.summarize_metrics_data(
-                compartment_id=comp_ocid,
-                summarize_metrics_data_details=SummarizeMetricsDataDetails(
-                    namespace="oracle_oci_database",
-                    query=f'StorageUsed[12h]{{resourceId="{cdb.id}" }}.max()',
-                    start_time=f"{start_time.isoformat()}Z",
-                    end_time=f"{end_time.isoformat()}Z"
-                )
-            ).data
-
-            # PDB Storage
-            # Storage in use / Metric / XX day average of average storage used
-            # StorageUsed[1d]{resourceId_database = "DB OCID"}.mean()
-            end_time = datetime.now()
-            start_time = end_time - timedelta(days = days_to_average)
-            pdb_summarize_metrics_data_response = monitoring_client.summarize_metrics_data(
-                compartment_id=comp_ocid,
-                summarize_metrics_data_details=SummarizeMetricsDataDetails(
-                    namespace="oracle_oci_database",
-                    query=f'StorageUsed[12h]{{resourceId="{pdb.id}" }}.max()',
-                    start_time=f"{start_time.isoformat()}Z",
-                    end_time=f"{end_time.isoformat()}Z"
-                )
-            ).data
-
-            #print(f"Output PDB: {pdb_summarize_metrics_data_response}")
-            pdb_cpu_count = None
-            cdb_cpu_count = None
-            error = ""
-            try:
-                # Get PDB Param from DBM
-                dbm_parameter_response = dbm_client.list_database_parameters(
-                    managed_database_id=pdb.id,
-                    name="cpu_min_count"
-                ).data
-                pdb_cpu_count = float(dbm_parameter_response.items[0].value) if dbm_parameter_response and len(dbm_parameter_response.items) > 0 else None
-                print(f"   Type: {dbm_parameter_response.database_type} CPU_MIN_Count: {dbm_parameter_response.items[0].value}")
-            except ServiceError as exc:
-                print(f"   Failed to get details: {exc.status}, {exc.message}")
-                error += exc.message
-            except IndexError as exc:
-                print(f"   Failed to get details: {exc}")
-            try:
-                # Get CDB Param from DBM
-                dbm_parameter_response = dbm_client.list_database_parameters(
-                    managed_database_id=cdb.id,
-                    name="cpu_min_count"
-                ).data
-                cdb_cpu_count = float(dbm_parameter_response.items[0].value) if dbm_parameter_response and len(dbm_parameter_response.items) > 0 else None
-                print(f"   Type: {dbm_parameter_response.database_type} CPU_MIN_Count: {dbm_parameter_response.items[0].value}")
-            except ServiceError as exc:
-                print(f"   Failed to get details: {exc.status}, {exc.message}")
-                error += exc.message
-            except IndexError as exc:
-                print(f"   Failed to get details: {exc}")
-            # Add and average the datapoints - probably a better way to do this...
-
-            cdb_storage_used = -1
-            if cdb_summarize_metrics_data_response:
-                sum = 0
-                for dp in cdb_summarize_metrics_data_response[0].aggregated_datapoints:
-                    sum = sum + dp.value
-                cdb_storage_used = sum / len(cdb_summarize_metrics_data_response[0].aggregated_datapoints)
-
-                #storage_used = summarize_metrics_data_response[0].aggregated_datapoints[0].value
-                print(f'   Storage (CDB {cdb.db_unique_name}): {cdb_storage_used:.2f}')
-            pdb_storage_used = -1
-            if pdb_summarize_metrics_data_response:
-                sum = 0
-                for dp in pdb_summarize_metrics_data_response[0].aggregated_datapoints:
-                    sum = sum + dp.value
-                pdb_storage_used = sum / len(pdb_summarize_metrics_data_response[0].aggregated_datapoints)
-
-                #storage_used = summarize_metrics_data_response[0].aggregated_datapoints[0].value
-                print(f'   Storage (PDB {pdb.pdb_name}): {pdb_storage_used:.2f}')
-            # Sleep a moment to give API some rest
-            time.sleep(.2)
-            # Write row to CSV
-            #csv_writer.writerow([vm_cluster.id,vm_cluster.display_name,cdb.id,cdb.db_unique_name,cdb.lifecycle_state,f"{storage_used:.2f}",cdb_cpu_count if cdb_cpu_count else "n/a",pdb.id,pdb.pdb_name,pdb_cpu_count if pdb_cpu_count else "n/a",error])
-            csv_writer.writerow([vm_cluster.id,vm_cluster.display_name,cdb.id,cdb.db_unique_name,cdb.lifecycle_state,f"{cdb_storage_used:.2f}",cdb_cpu_count if cdb_cpu_count else "n/a",pdb.id,pdb.pdb_name,f"{pdb_storage_used:.2f}",pdb_cpu_count if pdb_cpu_count else "n/a"])
+        # CDB and PDB Storage
+        # StorageUsed[12h].max() for every CDB and PDB in the compartment - one query, split by resourceId
+        end_time = datetime.now()
+        start_time = end_time - timedelta(days = days_to_average)
+        storage_series = metric_batcher.fetch(
+            compartment_id=comp_ocid,
+            namespace="oracle_oci_database",
+            metric="StorageUsed",
+            interval="12h",
+            statistic="max",
+            start_time=start_time,
+            end_time=end_time,
+            dimension="resourceId"
+        )
+        # Average every series at once - {resource OCID: mean} (first series per resource, as before)
+        storage_used_by_id = mean_by_resource(storage_series)
+
+        # One row per PDB - each CDB / VM cluster fetched once, DBM calls in a bounded pool
+        todo = [pdb for pdb in databases if pdb.id not in writer.resumed]
+        for row in inventory.rows(comp_ocid, storage_used_by_id, pdbs=todo):
+            print(f"VMC: {row['VMC_NAME']} DB: {row['CDB_NAME']}, Status: {row['CDB_LIFECYCLE']} RO: {row['PDB_OPEN_MODE']}")
+            print(f"   CPU_MIN_Count: CDB {row['MIN_CPU_CDB']} PDB {row['MIN_CPU_PDB']}")
+            print(f"   Storage (CDB {row['CDB_NAME']}): {row['STORAGE_CDB']:.2f} (PDB {row['PDB_NAME']}): {row['PDB_STORAGE']:.2f}")
+            # Write row to CSV (flushed immediately)
+            writer.write({**row, "STORAGE_CDB": f"{row['STORAGE_CDB']:.2f}", "MIN_CPU_CDB": row["MIN_CPU_CDB"] if row["MIN_CPU_CDB"] else "n/a",
+                          "PDB_STORAGE": f"{row['PDB_STORAGE']:.2f}", "MIN_CPU_PDB": row["MIN_CPU_PDB"] if row["MIN_CPU_PDB"] else "n/a"})
+
+        # Leave the report partial so -rs picks up the PDBs that failed
+        if inventory.failed:
+            print(f"Failed to get details for {len(inventory.failed)} PDB(s) - re-run with -rs {output_file_name}")
+            writer.close(complete=False)
 
     except ServiceError as exc:
         print(f"Failed to get details: {exc}")
-        
+        writer.close(complete=False)
 
-# Re-open /tmp output &
-# Open the file for writing
-with open(temp_file_name, 'r', newline='') as csvfile_read:
-    with open(output_file_name, 'w', newline='') as newfile_write:
-        file = csvfile_read.readlines()
-        for line in file:
-            newfile_write.write(str.replace(line,'^',' | '))
-    newfile_write.close
-csvfile_read.close
-
-# Delete temp file
-os.remove(temp_file_name)           
+print(f"Wrote {writer.rows_written} rows to {writer.filename if os.path.isfile(writer.filename) else writer.path}")
+limiter.log_summary()
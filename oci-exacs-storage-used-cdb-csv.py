@@ -3,27 +3,36 @@ from oci.database import DatabaseClient
 from oci.monitoring import MonitoringClient
 from oci.database_management import DbManagementClient
 from oci.database_management.models import DatabaseParametersCollection
-from oci.monitoring.models import SummarizeMetricsDataDetails
 from oci.exceptions import ServiceError
 
 import argparse, time
 from datetime import datetime, timedelta
 import logging
-import csv
 import os
 
+# Local - batched metric queries
+from oci_metric_batch import MetricBatcher
+from oci_metric_stats import mean_by_resource
+from oci_rate_limiter import RateLimiter, RateLimitedClient
+from oci_report_writer import ReportWriter
+
+# Constants
+REPORT_FIELDS = ["VMC_OCID","VMC_NAME","CDB_OCID","CDB_NAME","CDB_LIFECYCLE","STORAGE_CDB","MIN_CPU_CDB"]
+
 # Main Routine
 parser = argparse.ArgumentParser()
 parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
 parser.add_argument("-pr", "--profile", help="Config Profile, named", default="DEFAULT")
 parser.add_argument("-c", "--compartmentocid", help="Database Compartment OCID", required=True)
 parser.add_argument("-d", "--daystoaverage", help="Days of data to analyze storage usage for", type=int, default=30)
+parser.add_argument("-rs", "--resume", help="Report file of an interrupted run to finish (uses its .partial)")
 
 args = parser.parse_args()
 verbose = args.verbose
 profile = args.profile
 comp_ocid = args.compartmentocid
 days_to_average = args.daystoaverage
+resume_file = args.resume
 
 # If required, verbose
 if verbose:
@@ -35,24 +44,24 @@ print(f'Using {days_to_average} days of data to analyze storage')
 # Initialize service client with default config file
 config = config.from_file(profile_name=profile)
 
-# Set up OCI clients
-database_client = DatabaseClient(config)
-monitoring_client = MonitoringClient(config)
-dbm_client = DbManagementClient(config)
+# Set up OCI clients - calls are paced by one shared limiter (backs off on 429s)
+limiter = RateLimiter()
+database_client = RateLimitedClient(DatabaseClient(config), limiter)
+monitoring_client = RateLimitedClient(MonitoringClient(config), limiter)
+dbm_client = RateLimitedClient(DbManagementClient(config), limiter)
+metric_batcher = MetricBatcher(monitoring_client)
 
 # Main Flow - start with Infra OCID to get name
 # Script pulls Infra Detail, VM Cluster Detail (storage info)
 # Then loops over all DBs and pulls details on storage used
 
-# Define file name(s)
-output_file_name = f'storage-used-{time.strftime("%Y%m%d-%H%M%S")}-{comp_ocid}.csv'
-temp_file_name = f'/tmp/{output_file_name}'
+# Define file name(s) - rows go to <file>.partial as they complete, renamed to <file> at the end
+# If a run dies, re-run with -rs <file> to keep the rows already written and do only the rest
+output_file_name = resume_file or f'storage-used-{time.strftime("%Y%m%d-%H%M%S")}-{comp_ocid}.csv'
 
 # Open the file for writing
-with open(temp_file_name, 'w', newline='') as csvfile:
-    # Set up CSV
-    csv_writer = csv.writer(csvfile, delimiter='^',
-                            quotechar='"', quoting=csv.QUOTE_MINIMAL)
+with ReportWriter(output_file_name, format="csv", fields=REPORT_FIELDS, delimiter="|", atomic=True,
+                  resume_key="CDB_OCID", flush_rows=1) as writer:
     # Get Infra
     try:
 
@@ -61,6 +70,24 @@ with open(temp_file_name, 'w', newline='') as csvfile:
             compartment_id=comp_ocid
         ).data # List of CloudVmClusterSummary - but only need first one of them
 
+        # Storage in use / Metric / XX day average of average storage used
+        # StorageUsed[1d].mean() for every DB in the compartment - one query, split by resourceId_database
+        end_time = datetime.now()
+        start_time = end_time - timedelta(days = days_to_average)
+        storage_series = metric_batcher.fetch(
+            compartment_id=comp_ocid,
+            namespace="oci_database",
+            metric="StorageUsed",
+            interval="1d",
+            statistic="mean",
+            start_time=start_time,
+            end_time=end_time,
+            dimension="resourceId_database",
+            resolution="6h"
+        )
+        # Average every series at once - {database OCID: mean} (first series per database, as before)
+        storage_used_by_id = mean_by_resource(storage_series)
+
         # For each cluster, get DB
         for cluster in vm_clusters:
 
@@ -73,24 +100,11 @@ with open(temp_file_name, 'w', newline='') as csvfile:
             ).data # List of DatabaseSummary
 
             for db in databases:
+                if db.id in writer.resumed:
+                    continue
                 # DB Details
                 print(f"VMC: {cluster.display_name} DB: {db.db_unique_name}, Status: {db.lifecycle_state}")
 
-                # Storage in use / Metric / XX day average of average storage used
-                # StorageUsed[1d]{resourceId_database = "DB OCID"}.mean()
-                end_time = datetime.now()
-                start_time = end_time - timedelta(days = days_to_average)
-                summarize_metrics_data_response = monitoring_client.summarize_metrics_data(
-                    compartment_id=comp_ocid,
-                    summarize_metrics_data_details=SummarizeMetricsDataDetails(
-                        namespace="oci_database",
-                        #query=f'StorageAllocatedByTablespace[1d]{{resourceId_database ="{db.id}" }}.mean()',
-                        query=f'StorageUsed[1d]{{resourceId_database ="{db.id}" }}.mean()',
-                        start_time=f"{start_time.isoformat()}Z",
-                        end_time=f"{end_time.isoformat()}Z",
-                        resolution="6h")
-                ).data
-                
                 cpu_count = None
                 try:
                     # Get Param from DBM
@@ -103,34 +117,17 @@ with open(temp_file_name, 'w', newline='') as csvfile:
                 except ServiceError as exc:
                     print(f"   Failed to get details: {exc.status}, {exc.message}")
 
-                # Add and average the datapoints - probably a better way to do this...
-
-                if summarize_metrics_data_response:
-                    sum = 0
-                    for dp in summarize_metrics_data_response[0].aggregated_datapoints:
-                        sum = sum + dp.value
-                    storage_used = sum / len(summarize_metrics_data_response[0].aggregated_datapoints)
+                storage_used = storage_used_by_id.get(db.id.lower())
+                if storage_used is not None:
 
                     #storage_used = summarize_metrics_data_response[0].aggregated_datapoints[0].value
                     print(f'   {storage_used:.2f}')
-                    csv_writer.writerow([cluster.id,cluster.display_name,db.id,db.db_unique_name,db.lifecycle_state,f"{storage_used:.2f}",cpu_count if cpu_count else "n/a"])
-                else:
-                    csv_writer.writerow([cluster.id,cluster.display_name,db.id,db.db_unique_name,db.lifecycle_state,-1,cpu_count if cpu_count else "n/a"])
-                # Sleep a moment to give API some rest
-                time.sleep(.5)
+                writer.write(dict(zip(REPORT_FIELDS, [cluster.id,cluster.display_name,db.id,db.db_unique_name,db.lifecycle_state,
+                                                      f"{storage_used:.2f}" if storage_used is not None else -1,cpu_count if cpu_count else "n/a"])))
 
     except ServiceError as exc:
         print(f"Failed to get details: {exc}")
+        writer.close(complete=False)
 
-# Re-open /tmp output &
-# Open the file for writing
-with open(temp_file_name, 'r', newline='') as csvfile_read:
-    with open(output_file_name, 'w', newline='') as newfile_write:
-        file = csvfile_read.readlines()
-        for line in file:
-            newfile_write.write(str.replace(line,'^',' | '))
-    newfile_write.close
-csvfile_read.close
-
-# Delete temp file
-os.remove(temp_file_name)           
+print(f"Wrote {writer.rows_written} rows to {writer.filename if os.path.isfile(writer.filename) else writer.path}")
+limiter.log_summary()
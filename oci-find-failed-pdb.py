@@ -5,9 +5,12 @@ from oci.secrets import SecretsClient
 from oci.monitoring.models import SummarizeMetricsDataDetails
 from oci.exceptions import ServiceError
 
-import argparse, time
+import argparse
 import logging
 
+# Local - adaptive call rate instead of a fixed sleep
+from oci_rate_limiter import RateLimiter, RateLimitedClient
+
 
 # Logging
 logging.basicConfig
@@ -37,8 +40,9 @@ config = config.from_file(profile_name=profile)
 logger.info(f'Connecting to OCI {config["tenancy"]}.')
 
 
-# Set up OCI clients
-database_client = DatabaseClient(config)
+# Set up OCI clients - calls are paced by the limiter (backs off on 429s)
+limiter = RateLimiter()
+database_client = RateLimitedClient(DatabaseClient(config), limiter)
 monitoring_client = MonitoringClient(config)
 secrets_client = SecretsClient(config)
 
@@ -75,8 +79,5 @@ try:
                 logger.warning("----------------")
                 logger.warning(f"Failed PDB: {pdb.pdb_name} / {pdb.lifecycle_state} \n  CDB: {cdb.db_unique_name}  \n  CDB Lifecycle: {cdb.lifecycle_state}\n  PDB Lifecycle: {pdb.lifecycle_details}")
 
-            # Sleep a moment to give API some rest
-            time.sleep(.5)
-
 except ServiceError as exc:
     print(f"Failed to get details: {exc}")
@@ -15,7 +15,6 @@ from oci import retry
 # OCI Clients and models (import as necessary)
 from oci.core import VirtualNetworkClient
 from oci.resource_search import ResourceSearchClient
-from oci.resource_search.models import StructuredSearchDetails
 
 # Additional imports
 import argparse   # Argument Parsing
@@ -24,6 +23,10 @@ import datetime
 from datetime import timezone
 from concurrent.futures import ThreadPoolExecutor, Future
 
+# Local - adaptive call rate per service / operation, shared by all threads, and search snapshots
+from oci_rate_limiter import RateLimiter, RateLimitedClient
+from oci_search_cache import SearchCache, cache_filename
+
 # Callback
 def thread_completion_callback(future: Future):
     try:
@@ -89,6 +92,7 @@ if __name__ == "__main__":
     parser.add_argument("-ip", "--instanceprincipal", help="Use Instance Principal Auth - negates --profile", action="store_true")
     parser.add_argument("-ipr", "--region", help="Use Instance Principal with alt region")
     parser.add_argument("-t", "--threads", help="Concurrent Threads (def=5)", type=int, default=5)
+    parser.add_argument("--refresh", help="Search again instead of using a recent search snapshot from any script", action="store_true")
 
     args = parser.parse_args()
     verbose = args.verbose  # Boolean
@@ -96,6 +100,7 @@ if __name__ == "__main__":
     use_instance_principals = args.instanceprincipal # Attempt to use instance principals (OCI VM)
     region = args.region # Region to use with Instance Principal, if not default
     threads = args.threads
+    refresh = args.refresh
 
     # Logging Setup
     logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
@@ -121,6 +126,7 @@ if __name__ == "__main__":
             # Example of client
             vcn_client = VirtualNetworkClient(config=config_ip, signer=signer, retry_strategy=retry.DEFAULT_RETRY_STRATEGY)
             search_client = ResourceSearchClient(config=config_ip, signer=signer)
+            tenancy_id = signer.tenancy_id
 
         # Connect to OCI with DEFAULT or defined profile
         else:
@@ -131,24 +137,25 @@ if __name__ == "__main__":
             # Create the OCI Client to use
             vcn_client = VirtualNetworkClient(config, retry_strategy=retry.DEFAULT_RETRY_STRATEGY)
             search_client = ResourceSearchClient(config)
+            tenancy_id = config["tenancy"]
 
     except ClientError as ex:
         logger.critical(f"Failed to connect to OCI: {ex}")
 
+    # Every client call goes through the shared limiter - it backs off on 429s, so --threads can stay high
+    limiter = RateLimiter()
+    vcn_client = RateLimitedClient(vcn_client, limiter)
+    search_client = RateLimitedClient(search_client, limiter)
+
     # PHASE 3 - Main Script Execution (threaded)
 
-    # Get Resource List via Search
-    all_vcns = search_client.search_resources(
-        search_details=StructuredSearchDetails(
-            type = "Structured",
-            query='query vcn resources sorted by timeCreated asc'
-        ),
-        limit=1000
-    ).data
+    # Get Resource List via Search - every page, or a recent snapshot of the same search
+    cache = SearchCache(cache_filename(tenancy_id), refresh=refresh)
+    all_vcns = cache.search(search_client, 'query vcn resources sorted by timeCreated asc')
 
     # Build a list of OCIDs to operate on
     vcn_ocids = []
-    for i,it in enumerate(all_vcns.items, start=1):
+    for i,it in enumerate(all_vcns, start=1):
         vcn_ocids.append(it.identifier)
 
     # Thread Pool with execution based on incoming list of OCIDs
@@ -165,4 +172,5 @@ if __name__ == "__main__":
     #     if res:
     #         logger.info(f"Result: {res}")
     #     else:
-    #         logger.debug(f"Result: {res}")
\ No newline at end of file
+    #         logger.debug(f"Result: {res}")
+    limiter.log_summary()
@@ -24,6 +24,9 @@ import argparse   # Argument Parsing
 import logging    # Python Logging
 from concurrent.futures import ThreadPoolExecutor, Future
 
+# Local - adaptive call rate per service / operation, shared by all threads
+from oci_rate_limiter import RateLimiter, RateLimitedClient
+
 global total
 total = 0
 
@@ -112,6 +115,11 @@ if __name__ == "__main__":
     except ClientError as ex:
         logger.critical(f"Failed to connect to OCI: {ex}")
 
+    # Every client call goes through the shared limiter - it backs off on 429s, so --threads can stay high
+    limiter = RateLimiter()
+    vcn_client = RateLimitedClient(vcn_client, limiter)
+    identity_client = RateLimitedClient(identity_client, limiter)
+
     # PHASE 3 - Main Script Execution (threaded)
 
     comp_list = []
@@ -145,4 +153,5 @@ if __name__ == "__main__":
             # future.add_done_callback(print)
             future.add_done_callback(finish)
 
+    limiter.log_summary()
     logger.info(f"Finished - {total} results")
\ No newline at end of file
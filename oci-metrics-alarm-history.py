@@ -1,12 +1,17 @@
 from oci import config
 from oci.monitoring import MonitoringClient
-from oci.monitoring.models import SummarizeMetricsDataDetails
 from oci.exceptions import ServiceError
 
 import argparse
 from datetime import datetime, timedelta
 import logging
 
+import numpy as np
+
+# Local - chunked, concurrent metric queries
+from oci_monitoring_query import MonitoringQuery
+from oci_metric_cache import MetricCache, cache_filename
+
 # Main Routine
 parser = argparse.ArgumentParser()
 parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
@@ -17,6 +22,8 @@ parser.add_argument("-r", "--resourcegroup", help="Resource Group")
 parser.add_argument("-d", "--days", help="Days of data to analyze", default=3)
 parser.add_argument("-q", "--query", help="Full metric query", required=True)
 parser.add_argument("-t", "--threshold", help="Numeric threshold when crossed (will check value", required=True)
+parser.add_argument("-th", "--threads", help="Concurrent metric queries (def=4)", type=int, default=4)
+parser.add_argument("-ca", "--cache", help="Use local metric cache (shared with oci_alarm_backtest.py)", action="store_true")
 
 args = parser.parse_args()
 verbose = args.verbose
@@ -27,6 +34,8 @@ query = args.query
 threshold = args.threshold
 namespace = args.namespace
 resource_group = args.resourcegroup
+threads = args.threads
+use_cache = args.cache
 
 # If required, verbose
 if verbose:
@@ -41,6 +50,9 @@ config = config.from_file(profile_name=profile)
 
 # Set up OCI clients
 monitoring_client = MonitoringClient(config)
+monitoring_query = MonitoringQuery(monitoring_client, threads=threads)
+if use_cache:
+    monitoring_query = MetricCache(monitoring_query, cache_filename(config["tenancy"]))
 
 # Get Infra
 try:
@@ -48,40 +60,30 @@ try:
     end_time = datetime.now()
     start_time = end_time - timedelta(days = int(days))
     
-    # Define query
-    query = SummarizeMetricsDataDetails(
-            namespace=namespace,
-            query=query,
-            start_time=f"{start_time.isoformat()}Z",
-            end_time=f"{end_time.isoformat()}Z"
-            )
-    if resource_group:
-        query.resource_group = resource_group
-
-    print(f"Metrics Query: {query}")
-
-    # Query already created above - run it
-    summarize_metrics_data_response = monitoring_client.summarize_metrics_data(
+    # Run query - window is split into chunks and run concurrently
+    print(f"Metrics Query: {namespace} / {query} / {resource_group} / {start_time} - {end_time}")
+    metric_series = monitoring_query.run(
         compartment_id=comp_ocid,
-        summarize_metrics_data_details=query
-    ).data
+        namespace=namespace,
+        query=query,
+        start_time=start_time,
+        end_time=end_time,
+        resource_group=resource_group
+    )
 
     # Print count
-    print(f"Metrics Result Size: {len(summarize_metrics_data_response)}")
-
-    over = False
-    for i,metric in enumerate(summarize_metrics_data_response):
+    print(f"Metrics Result Size: {len(metric_series)}")
 
-        for dp in metric.aggregated_datapoints:
+    for i,metric in enumerate(metric_series):
 
-            if not over and dp.value > float(threshold):
-                over = True
-                print(f'\x1b[1;31mHost {metric.dimensions["resourceName"]} File System {metric.dimensions["fileSystemName"]} exceeded threshold ( t: {threshold} / val: {dp.value} ) at {dp.timestamp}\x1b[0m')
-            elif over and dp.value <= float(threshold):
-                over=False
-                print(f'Host {metric.dimensions["resourceName"]} File System {metric.dimensions["fileSystemName"]} went below threshold ( t: {threshold} / val: {dp.value} ) at {dp.timestamp}')
-        # End interating data points
-        over = False
+        # Crossings: +1 where the series goes over the threshold, -1 where it comes back under
+        over = metric.values > float(threshold)
+        crossings = np.diff(np.r_[False, over].astype(np.int8))
+        for j in np.flatnonzero(crossings):
+            if crossings[j] > 0:
+                print(f'\x1b[1;31mHost {metric.dimensions["resourceName"]} File System {metric.dimensions["fileSystemName"]} exceeded threshold ( t: {threshold} / val: {metric.values[j]} ) at {metric.timestamps[j]}\x1b[0m')
+            else:
+                print(f'Host {metric.dimensions["resourceName"]} File System {metric.dimensions["fileSystemName"]} went below threshold ( t: {threshold} / val: {metric.values[j]} ) at {metric.timestamps[j]}')
     # End loop    
 
 except ServiceError as exc:
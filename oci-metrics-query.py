@@ -1,12 +1,23 @@
 from oci import config
 from oci.monitoring import MonitoringClient
-from oci.monitoring.models import SummarizeMetricsDataDetails
 from oci.exceptions import ServiceError
-import math
 
 import argparse
+from contextlib import ExitStack
 from datetime import datetime, timedelta
 import logging
+import os
+import tempfile
+
+import numpy as np
+
+# Local - chunked, concurrent metric queries
+from oci_monitoring_query import MonitoringQuery
+from oci_metric_cache import MetricCache, cache_filename
+from oci_metric_sweep import MetricSweep
+from oci_metric_stats import RunningStats
+from oci_metric_export import OpenMetricsWriter, ParquetPartitionWriter, push_openmetrics
+from oci_rate_limiter import RateLimiter, RateLimitedClient
 
 # Main Routine
 parser = argparse.ArgumentParser()
@@ -20,6 +31,12 @@ parser.add_argument("-n", "--namespace", help="Metrics Namespace", required=True
 parser.add_argument("-r", "--resourcegroup", help="Resource Group")
 parser.add_argument("-t", "--threshold", help="Numeric threshold when crossed (will check value", required=True, type=float)
 parser.add_argument("-dim", "--dimensions", help="Dimensions to Print", required=False, default=[], nargs='+')
+parser.add_argument("-th", "--threads", help="Concurrent metric queries (def=4)", type=int, default=4)
+parser.add_argument("-sw", "--sweep", help="Sweep the compartment subtree in all subscribed regions", action="store_true")
+parser.add_argument("-om", "--openmetrics", help="Also export series to this OpenMetrics text file")
+parser.add_argument("-pu", "--pushurl", help="POST the OpenMetrics file to this import URL (without -om a temp file is used)")
+parser.add_argument("-pq", "--parquetdir", help="Also export series to Parquet under this dir (namespace=/date= partitions)")
+parser.add_argument("-ca", "--cache", help="Use local metric cache (only fetch intervals not already cached)", action="store_true")
 
 args = parser.parse_args()
 verbose = args.verbose
@@ -32,6 +49,17 @@ threshold = args.threshold
 namespace = args.namespace
 resource_group = args.resourcegroup
 dimensions = args.dimensions
+threads = args.threads
+use_cache = args.cache
+sweep = args.sweep
+openmetrics_file = args.openmetrics
+push_url = args.pushurl
+parquet_dir = args.parquetdir
+push_only = push_url and not openmetrics_file
+if push_only:
+    # Nothing to keep locally - export to a temp file just for the push
+    handle, openmetrics_file = tempfile.mkstemp(prefix="oci-metrics-", suffix=".om")
+    os.close(handle)
 
 # If required, verbose
 if verbose:
@@ -44,8 +72,16 @@ print(f'Threshold: {threshold} {type(threshold)}')
 # Initialize service client with default config file
 config = config.from_file(profile_name=profile)
 
-# Set up OCI clients
-monitoring_client = MonitoringClient(config)
+# Set up OCI clients - chunk and sweep calls are paced by one shared limiter (backs off on 429s)
+limiter = RateLimiter()
+monitoring_client = RateLimitedClient(MonitoringClient(config), limiter)
+monitoring_query = MonitoringQuery(monitoring_client, threads=threads)
+if sweep:
+    # Region x compartment fan-out, one client per region (the metric cache covers one region, so not used)
+    monitoring_query = MetricSweep(config, threads=threads, limiter=limiter)
+elif use_cache:
+    monitoring_query = MetricCache(monitoring_query, cache_filename(config["tenancy"]))
+    print(f"Using metric cache {monitoring_query.filename}")
 
 # Get Infra
 try:
@@ -56,43 +92,55 @@ try:
     # Operation
     #fs_string = "/*ora002|/*ora003|/*ora004|/*ora005|/*ora006|/*ora007|/*ora008|/*ora009"
     
-    # Define query
-    query = SummarizeMetricsDataDetails(
+    # Run query - window is split into chunks and run concurrently
+    print(f"Metrics Query: {namespace} / {query} / {resource_group} / {start_time} - {end_time}")
+    # Stream chunks into the exporters and the running statistics as they arrive - whole series are never held
+    stats = RunningStats(threshold)
+    writers = []
+    with ExitStack() as stack:
+        if openmetrics_file:
+            openmetrics = stack.enter_context(OpenMetricsWriter(openmetrics_file))
+            writers.append(openmetrics)
+        if parquet_dir:
+            parquet = stack.enter_context(ParquetPartitionWriter(parquet_dir))
+            writers.append(parquet)
+        for series_list in monitoring_query.stream(
+            comp_ocid,
             namespace=namespace,
-            #query=f'FileSystemUtilization[6h]{{fileSystemName {op} "{fs_string}"}}.mean()',
             query=query,
-            start_time=f"{start_time.isoformat()}Z",
-            end_time=f"{end_time.isoformat()}Z"
-            )
-    if resource_group:
-        query.resource_group = resource_group
-    print(f"Metrics Query: {query}")
-
-    # Query already created above - run it
-    summarize_metrics_data_response = monitoring_client.summarize_metrics_data(
-        compartment_id=comp_ocid,
-        summarize_metrics_data_details=query
-    ).data
+            start_time=start_time,
+            end_time=end_time,
+            resource_group=resource_group
+        ):
+            stats.add(series_list)
+            for series in series_list:
+                for writer in writers:
+                    writer.write_series(series)
 
     # Print count
-    print(f"Metrics Result: {len(summarize_metrics_data_response)}")
-
-    for i,metric in enumerate(summarize_metrics_data_response):
-        to_print = False
-        sum = 0
-        for dp in metric.aggregated_datapoints:
-            sum += dp.value
-            if dp.value == 1:
-                to_print = True
-        average = sum / len(metric.aggregated_datapoints)
-        #print (f"Average: {average} {type(average)}")
-        #if math.isclose(average > threshold) :
-        if average > threshold:
-            print(f'{i}: Metric: {metric.name}', end=" ")
-            for dim in dimensions:
-
-                print(f'{dim}: {metric.dimensions[dim]}',end=" ")
-            print(f'Average%: {average:.2f}')
+    print(f"Metrics Result: {len(stats)}")
+
+    if openmetrics_file:
+        print(f"OpenMetrics: {openmetrics.samples_written} samples to {openmetrics_file}")
+        if push_url:
+            print(f"OpenMetrics push to {push_url}: HTTP {push_openmetrics(openmetrics_file, push_url)}")
+            if push_only:
+                os.remove(openmetrics_file)
+    if parquet_dir:
+        print(f"Parquet: {parquet.rows_written} rows under {parquet_dir}")
+
+    # Averages and breach counts for every series at once (empty series average to NaN and never match)
+    averages = stats.mean()
+    breaches = stats.breaches()
+
+    for i in np.flatnonzero(averages > threshold):
+        metric = stats.series[i]
+        average = averages[i]
+        print(f'{i}: Metric: {metric.name}', end=" ")
+        for dim in dimensions:
+
+            print(f'{dim}: {metric.dimensions[dim]}',end=" ")
+        print(f'Average%: {average:.2f} Breaches: {breaches[i]}/{stats.counts[i]}')
         # Use colored text - red for >90 and yellow >75
         # if average > 90:
         #     print(f'\x1b[1;31m{i}: Host: {metric.dimensions["resourceName"]} Filesystem: {metric.dimensions["fileSystemName"]} Avg FS Usage%: {average:.2f} \x1b[0m')
@@ -23,6 +23,9 @@ import logging    # Python Logging
 from concurrent.futures import ThreadPoolExecutor, Future
 from concurrent import futures
 
+# Local - adaptive call rate per service / operation, shared by all threads
+from oci_rate_limiter import RateLimiter, RateLimitedClient
+
 global total
 total = 0
 
@@ -109,6 +112,11 @@ if __name__ == "__main__":
     except ClientError as ex:
         logger.critical(f"Failed to connect to OCI: {ex}")
 
+    # Every client call goes through the shared limiter - it backs off on 429s, so --threads can stay high
+    limiter = RateLimiter()
+    database_client = RateLimitedClient(database_client, limiter)
+    search_client = RateLimitedClient(search_client, limiter)
+
     # Create any necessary Clients
     db_client = DatabaseClient(config)
 
@@ -164,4 +172,5 @@ if __name__ == "__main__":
                 logger.info(f"Result: {future.result()}")
             except ServiceError as ex:
                 logger.error(f"ERROR: {ex.message}")
+    limiter.log_summary()
     logger.info(f"Finished submitting all for parallel execution")
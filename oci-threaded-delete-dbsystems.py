@@ -10,18 +10,23 @@
 from oci import config
 from oci.exceptions import ClientError,ServiceError
 from oci.auth.signers import InstancePrincipalsSecurityTokenSigner
-from oci import retry
 
 # OCI Clients and models (import as necessary)
 from oci.database import DatabaseClient
 from oci.resource_search import ResourceSearchClient
-from oci.resource_search.models import StructuredSearchDetails
 
 # Additional imports
 import argparse   # Argument Parsing
 import logging    # Python Logging
 from concurrent.futures import ThreadPoolExecutor, Future
 from concurrent import futures
+import datetime
+import json
+
+# Local - run journal (resume after a crash), region fan-out with clients through one adaptive call rate
+from oci_fleet_journal import FleetJournal, journal_filename, IN_FLIGHT
+from oci_region_fanout import RegionClients, RegionFanout
+from oci_search_cache import SearchCache, cache_filename
 
 global total
 total = 0
@@ -35,7 +40,7 @@ def finish(future: Future):
     pass
 
 # Threaded function
-def work_function_dbsystem(ocid: str):
+def work_function_dbsystem(database_client: DatabaseClient, ocid: str, region: str):
     # ADB Example - allow exceptions 
     # try:
     database = database_client.get_db_system(
@@ -45,18 +50,79 @@ def work_function_dbsystem(ocid: str):
     logger.info(f"DB System Name: {database.display_name}")
     logger.info(f"DB OCID: {ocid}")
 
+    # Resumed run - the terminate went through before the crash, don't send it again
+    if journal.state(ocid) == IN_FLIGHT and database.lifecycle_state in ("TERMINATING", "TERMINATED"):
+        logger.info(f"Already {database.lifecycle_state}: {ocid}")
+        journal.done(ocid, {"Name": database.display_name, "OCID": ocid, "Region": region, "Terminated": True})
+        return database.display_name
+
     # Delete it
+    journal.in_flight(ocid, {"step": "terminate"})
     try:
         database_client.terminate_db_system(
             db_system_id=ocid
         )
         logger.info(f"Termination: {ocid}")
+        journal.done(ocid, {"Name": database.display_name, "OCID": ocid, "Region": region, "Terminated": True})
     except ServiceError as ex:
         logger.error(f"Failed to call OCI.  Target Service/Operation: {ex.target_service}/{ex.operation_name} Code: {ex.code}")
         logger.debug(f"Full Exception Detail: {ex}")
+        journal.failed(ocid, {"Name": database.display_name, "OCID": ocid, "Region": region, "Error": ex.code})
     
     return database.display_name
 
+# Per-region function - search, then the deletes on the executor shared by all regions
+def delete_region(region: str, executor: ThreadPoolExecutor) -> int:
+    database_client = clients.client(DatabaseClient, region)
+
+    # 2 examples for getting a list for threading
+    # 1) Resource Search, create list of OCIDs
+    # Get Resource List via Search - every page, or a recent snapshot of the same search
+    base_dbs = cache.search(clients.client(ResourceSearchClient, region), 'query dbsystem resources')
+
+    # Build a list of OCIDs to operate on
+    db_ocids = []
+    for i,db_it in enumerate(base_dbs, start=1):
+        if db_it.identifier in completed:
+            continue
+        if journal.state(db_it.identifier) is None:
+            journal.planned(db_it.identifier)
+        db_ocids.append(db_it.identifier)
+    logger.info(f"{region}: {len(db_ocids)} DB Systems to process")
+
+    # 2) Use pagination and list_call_get_all_results, then pass actual objects as work items
+    # Get all compartments (we don't know the depth of any), tenancy level
+    # Using the paging API
+    # paginated_response = pagination.list_call_get_all_results(
+    #     identity_client.list_compartments,
+    #     tenancy_ocid,
+    #     access_level="ACCESSIBLE",
+    #     sort_order="ASC",
+    #     compartment_id_in_subtree=True,
+    #     lifecycle_state="ACTIVE",
+    #     limit=1000)
+    # comp_list.extend(paginated_response.data)
+
+    # Execution based on incoming list of OCIDs
+    results = [executor.submit(work_function_dbsystem, database_client, ocid, region) for ocid in db_ocids]
+
+    # Thread Pool with execution based on incoming list of Compartments
+    # with ThreadPoolExecutor(max_workers = threads, thread_name_prefix="thread") as executor:
+    #     results = [executor.submit(work_function, c) for c in comp_list]
+    #     logger.info(f"Kicked off {threads} threads for parallel execution - adjust as necessary")
+
+    # # Add callbacks to report
+    # for future in results:
+    #     # future.add_done_callback(print)
+    #     future.add_done_callback(finish)
+
+    for future in futures.as_completed(results):
+        try:
+            logger.info(f"Result: {future.result()}")
+        except ServiceError as ex:
+            logger.error(f"ERROR: {ex.message}")
+    return len(db_ocids)
+
 # Only if called in Main
 if __name__ == "__main__":
 
@@ -66,7 +132,11 @@ if __name__ == "__main__":
     parser.add_argument("-pr", "--profile", help="Named Config Profile, from OCI Config", default="DEFAULT")
     parser.add_argument("-ip", "--instanceprincipal", help="Use Instance Principal Auth - negates --profile", action="store_true")
     parser.add_argument("-r", "--region", help="Use Instance Principal with alt region")
-    parser.add_argument("-t", "--threads", help="Concurrent Threads (def=5)", type=int, default=5)
+    parser.add_argument("-t", "--threads", help="Concurrent Threads, shared by all regions (def=5)", type=int, default=5)
+    parser.add_argument("-ar", "--allregions", help="Every subscribed region at once, one journal / report", action="store_true")
+    parser.add_argument("-w", "--writejson", help="output json (from the journal)", action="store_true")
+    parser.add_argument("--refresh", help="Search again instead of using a recent search snapshot from any script", action="store_true")
+    parser.add_argument("--restart", help="Start over instead of resuming an unfinished run from the journal", action="store_true")
 
     args = parser.parse_args()
     verbose = args.verbose  # Boolean
@@ -74,6 +144,10 @@ if __name__ == "__main__":
     use_instance_principals = args.instanceprincipal # Attempt to use instance principals (OCI VM)
     region = args.region # Region to use with Instance Principal, if not default
     threads = args.threads
+    all_regions = args.allregions
+    output_json = args.writejson
+    restart = args.restart
+    refresh = args.refresh
 
     # Logging Setup
     logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
@@ -83,7 +157,7 @@ if __name__ == "__main__":
 
     logger.info(f'Using profile {profile} with Logging level {"DEBUG" if verbose else "INFO"}')
 
-    # PHASE 2 - Creation of OCI Client(s) 
+    # PHASE 2 - Creation of OCI Client(s) - per region on first use, every call through the shared rate limiter
     try:
 
     # Client creation
@@ -96,9 +170,7 @@ if __name__ == "__main__":
                 config_ip={"region": region}
                 logger.info(f"Changing region to {region}")
 
-            # Example of client
-            database_client = DatabaseClient(config=config_ip, signer=signer, retry_strategy=retry.DEFAULT_RETRY_STRATEGY)
-            search_client = ResourceSearchClient(config=config_ip, signer=signer)
+            clients = RegionClients(config_ip, signer)
 
         # Connect to OCI with DEFAULT or defined profile
         else:
@@ -109,66 +181,38 @@ if __name__ == "__main__":
                 config["region"] = region
                 logger.info(f"Changing region to {region}")
 
-            # Create the OCI Client to use
-            database_client = DatabaseClient(config, retry_strategy=retry.DEFAULT_RETRY_STRATEGY)
-            search_client = ResourceSearchClient(config)
+            clients = RegionClients(config)
 
     except ClientError as ex:
         logger.critical(f"Failed to connect to OCI: {ex}")
 
-    # Create any necessary Clients
-    db_client = DatabaseClient(config)
-
     # PHASE 3 - Main Script Execution (threaded)
-
-    # 2 examples for getting a list for threading
-    # 1) Resource Search, create list of OCIDs
-    # Get Resource List via Search
-    base_dbs = search_client.search_resources(
-        search_details=StructuredSearchDetails(
-            type = "Structured",
-            query='query dbsystem resources'
-        ),
-        limit=1000
-    ).data
-
-    # Build a list of OCIDs to operate on
-    db_ocids = []
-    for i,db_it in enumerate(base_dbs.items, start=1):
-        db_ocids.append(db_it.identifier)
-
-    # 2) Use pagination and list_call_get_all_results, then pass actual objects as work items
-    # Get all compartments (we don't know the depth of any), tenancy level
-    # Using the paging API
-    # paginated_response = pagination.list_call_get_all_results(
-    #     identity_client.list_compartments,
-    #     tenancy_ocid,
-    #     access_level="ACCESSIBLE",
-    #     sort_order="ASC",
-    #     compartment_id_in_subtree=True,
-    #     lifecycle_state="ACTIVE",
-    #     limit=1000)
-    # comp_list.extend(paginated_response.data)
-
-    # Thread Pool with execution based on incoming list of OCIDs
-    with ThreadPoolExecutor(max_workers = threads, thread_name_prefix="thread") as executor:
-        results = [executor.submit(work_function_dbsystem, ocid) for ocid in db_ocids]
-        logger.info(f"Kicked off {threads} threads for parallel execution - adjust as necessary")
-
-    # Thread Pool with execution based on incoming list of Compartments
-    # with ThreadPoolExecutor(max_workers = threads, thread_name_prefix="thread") as executor:
-    #     results = [executor.submit(work_function, c) for c in comp_list]
-    #     logger.info(f"Kicked off {threads} threads for parallel execution - adjust as necessary")
-
-        # # Add callbacks to report
-        # for future in results:
-        #     # future.add_done_callback(print)
-        #     future.add_done_callback(finish)
-    
-
-        for future in futures.as_completed(results):
-            try:
-                logger.info(f"Result: {future.result()}")
-            except ServiceError as ex:
-                logger.error(f"ERROR: {ex.message}")
-    logger.info(f"Finished submitting all for parallel execution for {len(db_ocids)} DB Systems")
+    cache = SearchCache(cache_filename(clients.tenancy_id), refresh=refresh)
+
+    # Journal - a crashed / interrupted run is resumed and skips DB Systems already done
+    job = f'delete-dbsystems{"-all-regions" if all_regions else f"-{region}" if region else ""}'
+    journal = FleetJournal(journal_filename(job), job, restart=restart)
+    completed = journal.completed
+    logger.info(f"{len(completed)} DB Systems already done")
+
+    # Every region at once with -ar - the -t threads are shared by all of them
+    regions = clients.subscribed_regions() if all_regions else [clients.region]
+    fanout = RegionFanout(regions, budget=threads)
+    processed = fanout.run(delete_region)
+    logger.info(f"Finished {sum(processed.values())} DB Systems in {len(processed)} region(s)")
+    clients.limiter.log_summary()
+    for failed_region, exc in fanout.errors.items():
+        logger.error(f"Region {failed_region} not done: {exc!r}")
+    if not fanout.errors:
+        journal.finish()
+
+    # Write to file if desired - streamed from the journal
+    if output_json:
+        datestring = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")
+        filename = f'oci-delete-dbsystems-{datestring}.json'
+        with open(filename,"w") as outfile:
+            outfile.write("[\n")
+            for i, result in enumerate(journal.results()):
+                outfile.write((",\n" if i else "") + json.dumps(result, indent=2))
+            outfile.write("\n]\n")
+        logger.info(f"Script complete - wrote JSON to {filename}.")
@@ -0,0 +1,105 @@
+# OCI Autonomous Database Fleet Run
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# One region of an ADB fleet script: discover, (right-size,) plan and apply the spec.
+#
+# The ATP / ADW / ADB scripts only differ in their query, spec and report name, so the pipeline
+# they share lives here and runs once per region (oci_region_fanout.py runs all regions at once):
+#   FleetDiscovery stream -> load_databases -> RightSizer (optional) -> Reconciler with a
+#   WaveRollout and a LifecycleWaiter for the region
+# The API work of every region goes through the executor it is given (the global budget).
+# merge_regions() puts the per-region results back together for one report.  With a tracer
+# (oci_fleet_trace.py) every step of every DB is a span, grouped by region.
+
+# Usage:
+#   clients = RegionClients(config, signer)
+#   fanout = RegionFanout(clients.subscribed_regions(), budget=threads)
+#   by_region = fanout.run(lambda region, executor: reconcile_region(clients, region, query, spec, executor))
+#   results, savings, tripped = merge_regions(by_region)
+
+import datetime
+import logging
+from concurrent.futures import Executor
+
+from oci.database import DatabaseClient
+from oci.identity import IdentityClient
+from oci.monitoring import MonitoringClient
+from oci.resource_search import ResourceSearchClient
+
+# Local
+from oci_adb_reconciler import Reconciler, load_databases, healthy
+from oci_adb_rightsizing import RightSizer, REPORT_FIELDS, savings_summary
+from oci_fleet_discovery import FleetDiscovery
+from oci_fleet_journal import FleetJournal
+from oci_fleet_trace import FleetTracer, NO_TRACE
+from oci_lifecycle_waiter import LifecycleWaiter
+from oci_metric_batch import MetricBatcher
+from oci_region_fanout import RegionClients
+from oci_report_writer import ReportWriter
+from oci_search_cache import SearchCache
+from oci_wave_rollout import WaveRollout
+
+logger = logging.getLogger('oci-adb-fleet')
+
+# Constants
+SAVINGS_FIELDS = ["REGION"] + REPORT_FIELDS
+
+
+def reconcile_region(clients: RegionClients, region: str, query: str, spec: dict, executor: Executor = None,
+                     threads: int = 5, dryrun: bool = False, journal: FleetJournal = None,
+                     rightsize_days: int = None, rollout_options: dict = None, cache: SearchCache = None,
+                     tracer: FleetTracer = None) -> dict:
+    """{"results": [...], "savings": [...], "rollout": WaveRollout or None} for the ADBs of one region
+
+    DBs the journal has as DONE are skipped.  rollout_options are WaveRollout arguments
+    (None = every DB at once) - there is no rollout for a dry run.  With a cache, a fresh search
+    snapshot of the query (from any script) is used instead of searching."""
+    database_client = clients.client(DatabaseClient, region)
+    search_client = clients.client(ResourceSearchClient, region)
+    completed = journal.completed if journal else set()
+    tracer = (tracer or NO_TRACE).group(region)
+
+    # Every search page, sharded by compartment when large, streamed straight into the work
+    discovery = FleetDiscovery(search_client, clients.client(IdentityClient, region), threads, cache=cache, tracer=tracer)
+    found = (item for item in discovery.stream(query, clients.tenancy_id) if item.identifier not in completed)
+
+    # Full details with one list per compartment
+    databases = load_databases(database_client, found, threads, tracer)
+    targets = {}
+    savings = []
+    if rightsize_days:
+        # Needs the whole region first - one batched metric pull and vectorized targets for every DB
+        databases = list(databases)
+        sizer = RightSizer(MetricBatcher(clients.client(MonitoringClient, region)), days=rightsize_days)
+        targets = sizer.targets(databases, spec)
+        savings = [dict(REGION=region, **row) for row in sizer.savings(databases, targets, spec)]
+
+    rollout = WaveRollout(**rollout_options, healthy=healthy) if rollout_options is not None and not dryrun else None
+    with LifecycleWaiter(search_client, lambda i: database_client.get_autonomous_database(autonomous_database_id=i).data,
+                         tracer=tracer) as waiter:
+        reconciler = Reconciler(database_client, waiter, spec, dryrun=dryrun, journal=journal, targets=targets,
+                                region=region, tracer=tracer)
+        results = reconciler.run(databases, threads, rollout, executor)
+    logger.info(f"{region}: {len(results)} DBs, waiter used {waiter.searches} searches and {waiter.gets} GETs")
+    if rollout and rollout.tripped:
+        logger.error(f"{region}: rollout stopped ({rollout.tripped}) - {rollout.held} DBs not changed")
+    return {"results": results, "savings": savings, "rollout": rollout}
+
+
+def merge_regions(by_region: dict) -> tuple:
+    """(results, savings rows, {region: reason} of tripped rollouts) over all regions"""
+    results = [r for region in by_region.values() for r in region["results"]]
+    savings = [s for region in by_region.values() for s in region["savings"]]
+    tripped = {name: region["rollout"].tripped for name, region in by_region.items()
+               if region["rollout"] and region["rollout"].tripped}
+    return results, savings, tripped
+
+
+def write_savings(savings: list) -> str:
+    """Right-sizing savings CSV for all regions - returns the filename"""
+    filename = f'oci-adb-rightsizing-{datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")}.csv'
+    with ReportWriter(filename, format="csv", fields=SAVINGS_FIELDS) as writer:
+        writer.write_rows(savings)
+    logger.info(f"Right-sizing {savings_summary(savings)} - details in {filename}")
+    return filename
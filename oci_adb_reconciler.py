@@ -0,0 +1,408 @@
+# OCI Autonomous Database Reconciler
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Brings Autonomous Databases to a declarative target spec with as few update calls as possible.
+#
+# The fleet scripts used to run one update_autonomous_database (and one wait) per setting.  Here:
+# 1) desired_changes() diffs a DB against the spec - only fields that differ are changed
+# 2) plan_calls() packs those fields into the fewest update calls.  Fields the API will not take
+#    in the same call (see CONFLICTS) go into separate calls, and the ECPU conversion goes first
+# 3) Reconciler.reconcile() starts the DB if needed, runs the calls, and waits for AVAILABLE after
+#    each (shared LifecycleWaiter).  After each call the plan is made again from the fresh DB, so
+#    e.g. the ECPU count is worked out from the converted DB.  A field is never sent twice.
+# 4) A stopped DB is stopped again at the end
+# 5) With a FleetJournal, every step is journaled - a rerun skips DONE DBs (the caller filters
+#    them) and resumes the rest, including returning a DB to the state it had before the crash
+# 6) With a WaveRollout (oci_wave_rollout.py), DBs start as a canary and then in waves, and a DB
+#    is only healthy if it has no error and nothing of the spec is left to change.  DBs that got no
+#    update call (skipped, already compliant) are neither - they do not count as canaries
+# 7) With a tracer (oci_fleet_trace.py), the get / start / update / wait / restore-state steps of
+#    every DB are timed spans
+#
+# load_databases() gets the whole fleet with one paginated list per compartment, so a dry run
+# (plan only) of hundreds of DBs takes seconds.  It takes the streamed search results of
+# oci_fleet_discovery.py, so DBs are reconciled while discovery is still running.
+
+# Spec keys (None or missing = leave alone):
+#   compute_model           "ECPU"
+#   max_compute_count       scale compute down to this if above
+#   compute_count           exact compute target (per DB, from oci_adb_rightsizing.py) - replaces max_compute_count
+#   backup_retention_days   lower backup retention to this if above
+#   storage_factor          TB-model storage -> GB model at allocated TB * 1024 * factor (min 20 GB)
+#   storage_gb              GB storage target (per DB, from oci_adb_rightsizing.py) - TB model converts to it,
+#                           GB model scales down to it - replaces storage_factor
+#   storage_workloads       db_workload values storage_factor / storage_gb apply to (None = all)
+#   storage_auto_scaling    is_auto_scaling_for_storage_enabled
+#   auto_scaling            is_auto_scaling_enabled (compute)
+#   license_model           e.g. "BRING_YOUR_OWN_LICENSE"
+#   database_edition        e.g. "STANDARD_EDITION" (sent with license_model)
+#   schedule                Schedule.AnyDay tag value when the tag is missing or never stops the DB
+
+# Usage:
+#   reconciler = Reconciler(database_client, waiter, spec, dryrun=False)
+#   databases = load_databases(database_client, discovery.stream(query, tenancy_id))
+#   results = reconciler.run(databases, threads=5, rollout=WaveRollout(healthy=healthy))
+
+import logging
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from oci import pagination
+from oci.database import DatabaseClient
+from oci.database.models import UpdateAutonomousDatabaseDetails
+from oci.exceptions import ServiceError
+
+# Local
+from oci_lifecycle_waiter import LifecycleWaiter, drive
+from oci_fleet_trace import NO_TRACE
+from oci_fleet_journal import FleetJournal, IN_FLIGHT, DONE, FAILED
+from oci_wave_rollout import WaveRollout
+
+logger = logging.getLogger('oci-adb-reconciler')
+
+# Constants
+DEFAULT_SCHEDULE = "0,0,0,0,0,0,0,*,*,*,*,*,*,*,*,*,*,0,0,0,0,0,0,0"
+MIN_STORAGE_GB = 20
+OCPU_TO_ECPU = 4
+
+DEFAULT_SPEC = {
+    "compute_model": "ECPU",
+    "max_compute_count": 2.0,
+    "backup_retention_days": 14,
+    "storage_factor": 2.0,
+    "storage_workloads": None,
+    "storage_auto_scaling": True,
+    "auto_scaling": True,
+    "license_model": "BRING_YOUR_OWN_LICENSE",
+    "database_edition": "STANDARD_EDITION",
+    "schedule": DEFAULT_SCHEDULE,
+}
+
+# Order fields are placed into calls
+FIELD_ORDER = ["compute_model", "backup_retention_period_in_days", "defined_tags", "is_auto_scaling_enabled",
+               "is_auto_scaling_for_storage_enabled", "compute_count", "data_storage_size_in_gbs",
+               "license_model", "database_edition"]
+
+# "Cannot be updated in parallel with" notes from UpdateAutonomousDatabaseDetails
+CONFLICTS = {
+    "compute_model": {"compute_count", "data_storage_size_in_gbs", "license_model", "database_edition"},
+    "license_model": {"compute_model", "compute_count", "data_storage_size_in_gbs"},
+    "database_edition": {"compute_model", "compute_count", "data_storage_size_in_gbs"},
+    "compute_count": {"compute_model", "license_model", "database_edition"},
+    "data_storage_size_in_gbs": {"compute_model", "license_model", "database_edition"},
+}
+
+# Must be in a later call than these
+AFTER = {
+    "compute_count": {"compute_model"},
+    "data_storage_size_in_gbs": {"compute_model"},
+    "license_model": {"compute_model"},
+    "database_edition": {"compute_model"},
+}
+
+
+def skip_reason(db) -> dict:
+    """Why a DB is left alone (None if it is in scope)"""
+    if db.is_dedicated:
+        return {"Dedicated": True}
+    if db.role in ("STANDBY", "BACKUP_COPY") or db.lifecycle_state == "STANDBY":
+        return {"Role": f"{db.role}"}
+    if db.is_free_tier:
+        return {"Free": f"{db.is_free_tier}"}
+    if db.is_dev_tier:
+        return {"Dev": f"{db.is_dev_tier}"}
+    if db.lifecycle_state in ("UNAVAILABLE", "TERMINATED", "TERMINATING"):
+        return {"Lifecycle": f"{db.lifecycle_state}"}
+    return None
+
+
+def desired_changes(db, spec: dict) -> dict:
+    """field -> target value for every field of db that differs from spec"""
+    changes = {}
+    converting = spec.get("compute_model") and db.compute_model != spec["compute_model"]
+    if converting:
+        changes["compute_model"] = spec["compute_model"]
+
+    if (spec.get("compute_count") or spec.get("max_compute_count")) and db.compute_count:
+        # Count after the ECPU conversion (re-planned from the real value once it is done)
+        count = db.compute_count * OCPU_TO_ECPU if converting and db.compute_model == "OCPU" else db.compute_count
+        if spec.get("compute_count"):
+            if count != spec["compute_count"]:
+                changes["compute_count"] = float(spec["compute_count"])
+        elif count > spec["max_compute_count"]:
+            changes["compute_count"] = float(spec["max_compute_count"])
+
+    if spec.get("backup_retention_days") and (db.backup_retention_period_in_days or 0) > spec["backup_retention_days"]:
+        changes["backup_retention_period_in_days"] = spec["backup_retention_days"]
+
+    workloads = spec.get("storage_workloads")
+    if not workloads or db.db_workload in workloads:
+        if spec.get("storage_gb"):
+            # Sized from usage - only goes down (growth is left to auto scaling), TB model converts at
+            # no more than its current size
+            target = max(MIN_STORAGE_GB, int(spec["storage_gb"]))
+            if db.data_storage_size_in_tbs:
+                changes["data_storage_size_in_gbs"] = min(target, int(db.data_storage_size_in_tbs * 1024))
+            elif (db.data_storage_size_in_gbs or 0) > target:
+                changes["data_storage_size_in_gbs"] = target
+        elif spec.get("storage_factor") and db.data_storage_size_in_tbs:
+            # TB model -> GB model, sized from what is allocated
+            changes["data_storage_size_in_gbs"] = max(MIN_STORAGE_GB, int(db.allocated_storage_size_in_tbs * 1024 * spec["storage_factor"]))
+
+    if spec.get("storage_auto_scaling") is not None and db.is_auto_scaling_for_storage_enabled != spec["storage_auto_scaling"]:
+        changes["is_auto_scaling_for_storage_enabled"] = spec["storage_auto_scaling"]
+    if spec.get("auto_scaling") is not None and db.is_auto_scaling_enabled != spec["auto_scaling"]:
+        changes["is_auto_scaling_enabled"] = spec["auto_scaling"]
+
+    if spec.get("license_model") and db.license_model != spec["license_model"]:
+        changes["license_model"] = spec["license_model"]
+        if spec.get("database_edition"):
+            changes["database_edition"] = spec["database_edition"]
+
+    if spec.get("schedule"):
+        # Schedule tag is compliant if AnyDay stops the DB at some hour (or only other keys are used)
+        tags = db.defined_tags or {}
+        schedule_tag = tags.get("Schedule")
+        if schedule_tag is None or ("AnyDay" in schedule_tag and "0" not in schedule_tag["AnyDay"]):
+            changes["defined_tags"] = {**tags, "Schedule": {"AnyDay": spec["schedule"]}}
+    return changes
+
+
+def plan_calls(changes: dict) -> list:
+    """Pack changed fields into the fewest update calls - list of {field: value} in execution order"""
+    calls = []
+    placed = {}
+    for field in FIELD_ORDER:
+        if field not in changes:
+            continue
+        earliest = max((placed[f] + 1 for f in AFTER.get(field, ()) if f in placed), default=0)
+        conflicts = CONFLICTS.get(field, set())
+        index = next((i for i in range(earliest, len(calls)) if not conflicts & calls[i].keys()), len(calls))
+        if index == len(calls):
+            calls.append({})
+        calls[index][field] = changes[field]
+        placed[field] = index
+    return calls
+
+
+def plan(db, spec: dict, applied: set = frozenset()) -> list:
+    """Update calls that bring db to spec, leaving out fields already sent"""
+    changes = {k: v for k, v in desired_changes(db, spec).items() if k not in applied}
+    return plan_calls(changes)
+
+
+def describe(db, calls: list) -> list:
+    """Readable plan - one {field: [current, target]} per call"""
+    described = []
+    for call in calls:
+        fields = {}
+        for field, value in call.items():
+            if field == "defined_tags":
+                fields["Schedule.AnyDay"] = [((db.defined_tags or {}).get("Schedule") or {}).get("AnyDay"), value["Schedule"]["AnyDay"]]
+            elif field == "compute_count" and db.compute_model == "OCPU":
+                fields[field] = [db.compute_count * OCPU_TO_ECPU, value]     # in ECPU, after the conversion
+            else:
+                fields[field] = [getattr(db, field, None), value]
+        described.append(fields)
+    return described
+
+
+def _list_by_id(database_client: DatabaseClient, compartment_id: str, tracer=NO_TRACE) -> dict:
+    with tracer.span(compartment_id, "get"):
+        return {db.id: db for db in pagination.list_call_get_all_results(
+            database_client.list_autonomous_databases,
+            compartment_id=compartment_id
+        ).data}
+
+
+def load_databases(database_client: DatabaseClient, search_items, threads: int = 5, tracer=None):
+    """Generator of full details for searched ADBs - one paginated list per compartment instead of a GET per DB
+
+    search_items can be a stream (FleetDiscovery.stream): each compartment is listed when its first
+    ADB shows up, and DBs are yielded as soon as their compartment list is back."""
+    listings = {}       # compartment -> Future of {id: db}
+    waiting = {}        # compartment -> search items waiting for that list
+    loaded = 0
+
+    def ready(block: bool):
+        for compartment_id in [c for c in waiting if block or listings[c].done()]:
+            by_id = listings[compartment_id].result()
+            for item in waiting.pop(compartment_id):
+                if item.identifier in by_id:
+                    yield by_id[item.identifier]
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="list") as executor:
+        for item in search_items:
+            if item.compartment_id not in listings:
+                listings[item.compartment_id] = executor.submit(_list_by_id, database_client, item.compartment_id,
+                                                                tracer or NO_TRACE)
+            waiting.setdefault(item.compartment_id, []).append(item)
+            for db in ready(block=False):
+                loaded += 1
+                yield db
+        for db in ready(block=True):
+            loaded += 1
+            yield db
+    logger.info(f"Loaded {loaded} ADBs from {len(listings)} compartment(s)")
+
+
+class Reconciler:
+    """Plans and applies spec changes for many ADBs at once (optionally journaled, see oci_fleet_journal.py)"""
+
+    def __init__(self, database_client: DatabaseClient, waiter: LifecycleWaiter, spec: dict, dryrun: bool = False,
+                 journal: FleetJournal = None, targets: dict = None, region: str = None, tracer=None):
+        self.database_client = database_client
+        self.waiter = waiter
+        self.spec = spec
+        self.targets = targets or {}
+        self.region = region
+        self.tracer = tracer or NO_TRACE
+        self.dryrun = dryrun
+        self.journal = journal if not dryrun else None
+
+    def _update(self, db, call: dict):
+        logger.info(f"{db.display_name}: update {', '.join(f'{k}={v}' for k, v in call.items() if k != 'defined_tags')}"
+                    f"{' (+Schedule tag)' if 'defined_tags' in call else ''}")
+        self.database_client.update_autonomous_database(
+            autonomous_database_id=db.id,
+            update_autonomous_database_details=UpdateAutonomousDatabaseDetails(**call)
+        )
+
+    def _detail(self, db) -> dict:
+        detail = {"Name": f"{db.display_name}", "OCID": f"{db.id}"}
+        if self.region:
+            detail["Region"] = self.region
+        return detail
+
+    def _plan(self, db, applied: set = frozenset()) -> list:
+        # Per-DB targets (right-sizing) on top of the fleet spec
+        return plan(db, dict(self.spec, **self.targets.get(db.id, {})), applied)
+
+    def _record(self, db_id: str, state: str, detail: dict):
+        if self.journal:
+            self.journal.record(db_id, state, detail)
+
+    def reconcile(self, db):
+        """Generator (run with drive()) - returns the result dict for one DB"""
+        result = {"Detail": dict(self._detail(db), **{"Original CPU": f"{db.compute_model}", "License": f"{db.license_model}"})}
+        reason = skip_reason(db)
+        if reason:
+            result["No-op"] = reason
+            self._record(db.id, DONE, result)
+            return result
+
+        # A resumed DB may be mid-update or started by the crashed run - its journaled state says what to return to
+        resumed = self.journal.resume_detail(db.id) if self.journal else None
+        initial_state = resumed.get("initial_state", db.lifecycle_state) if resumed else db.lifecycle_state
+        restore = initial_state == "STOPPED" and db.lifecycle_state != "STOPPED"
+        calls = self._plan(db)
+        result["Plan"] = describe(db, calls)
+        if not calls and not restore:
+            result["No-op"] = {"Actions": 0}
+            self._record(db.id, DONE, result)
+            return result
+        logger.info(f'{"DRYRUN: " if self.dryrun else ""}{"RESUME: " if resumed else ""}{db.display_name}: {len(calls)} call(s) {result["Plan"]}')
+        if self.dryrun:
+            return result
+
+        applied = set()
+        result["Calls"] = 0
+        try:
+            self._record(db.id, IN_FLIGHT, {"initial_state": initial_state, "step": "start"})
+            if db.lifecycle_state == "STOPPED":
+                logger.info(f"Starting Autonomous DB: {db.display_name}")
+                with self.tracer.span(db.id, "start", db.display_name):
+                    self.database_client.start_autonomous_database(db.id)
+            if db.lifecycle_state != "AVAILABLE":
+                with self.tracer.span(db.id, "wait", db.display_name, calls=False):
+                    db = yield self.waiter.wait(db.id, "AVAILABLE")
+                calls = self._plan(db)
+
+            while calls:
+                self._record(db.id, IN_FLIGHT, {"initial_state": initial_state, "step": f"update {result['Calls'] + 1}",
+                                                "fields": sorted(calls[0])})
+                with self.tracer.span(db.id, "update", db.display_name):
+                    self._update(db, calls[0])
+                applied.update(calls[0])
+                result["Calls"] += 1
+                with self.tracer.span(db.id, "wait", db.display_name, calls=False):
+                    db = yield self.waiter.wait(db.id, "AVAILABLE")
+                calls = self._plan(db, applied)
+
+            # Every call went through - anything the DB still differs in was not taken by the API
+            remaining = self._plan(db)
+            if remaining:
+                logger.warning(f"{db.display_name}: still differs from the spec after {result['Calls']} call(s)")
+                result["Unconverged"] = describe(db, remaining)
+            # Return to initial state (not waiting)
+            if initial_state == "STOPPED":
+                logger.info(f"Stopping Autonomous DB: {db.display_name}")
+                with self.tracer.span(db.id, "restore-state", db.display_name):
+                    self.database_client.stop_autonomous_database(db.id)
+            logger.info(f"----Complete ({db.display_name}) in {result['Calls']} call(s)----------")
+            self._record(db.id, DONE, result)
+        except ServiceError as exc:
+            logger.error(f"Failed to complete action for DB: {db.display_name} \nReason: {exc}")
+            result["Error"] = {"Exception": exc.message}
+            self._record(db.id, FAILED, result)
+        return result
+
+    def _planned(self, db):
+        if self.journal and self.journal.state(db.id) is None:
+            self.journal.planned(db.id)
+
+    def run(self, databases, threads: int = 5, rollout: WaveRollout = None, executor: ThreadPoolExecutor = None) -> list:
+        """Reconcile every DB concurrently - results in the order DBs were started
+
+        databases can be a generator (load_databases) - each DB starts as soon as it is yielded,
+        or as soon as the rollout has room for it.  A DB that fails with anything but a
+        ServiceError (e.g. a wait timeout) is logged, left IN_FLIGHT in the journal for the next
+        run, and has an Error result.  DBs held back by a tripped rollout have a Held result.
+        With an executor (e.g. shared by all regions, see oci_region_fanout.py) threads is not used."""
+        with nullcontext(executor) if executor else ThreadPoolExecutor(max_workers=threads, thread_name_prefix="thread") as executor:
+            def start(db):
+                self._planned(db)
+                return drive(executor, self.reconcile(db))
+
+            if rollout:
+                work = rollout.run(databases, start, key=lambda db: db.compartment_id)
+            else:
+                work = [(db, start(db)) for db in databases]
+                logger.info(f"Kicked off {len(work)} DBs on {threads} threads")
+            results = []
+            for db, future in work:
+                if future is None:
+                    self._planned(db)
+                    results.append({"Detail": self._detail(db),
+                                    "Held": {"Reason": rollout.tripped}})
+                    continue
+                try:
+                    results.append(future.result())
+                except Exception as exc:
+                    logger.error(f"DB {db.display_name} did not finish: {exc!r}")
+                    results.append({"Detail": self._detail(db), "Error": {"Exception": repr(exc)}})
+            return results
+
+
+def healthy(result: dict):
+    """Rollout health check - no error and nothing left to change (None if no update call was made)"""
+    if "Error" in result or "Unconverged" in result:
+        return False
+    return True if result.get("Calls") else None
+
+
+def plan_summary(results: list) -> str:
+    """One line per changed DB plus totals"""
+    lines = []
+    calls = fields = 0
+    for result in results:
+        for number, call in enumerate(result.get("Plan", []), start=1):
+            changes = ", ".join(f"{k} {v[0]}->{v[1]}" for k, v in call.items())
+            lines.append(f'{result["Detail"]["Name"]:30} call {number}: {changes}')
+            calls += 1
+            fields += len(call)
+    changed = sum(1 for r in results if r.get("Plan"))
+    skipped = sum(1 for r in results if not r.get("Plan"))
+    lines.append(f"{changed} DB(s) to change with {calls} update call(s) for {fields} setting(s), {skipped} skipped")
+    return "\n".join(lines)
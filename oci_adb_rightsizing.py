@@ -0,0 +1,175 @@
+# OCI Autonomous Database Right-Sizing
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Per-DB compute and storage targets for the ADB fleet scripts, from what each DB actually uses.
+#
+# The scripts size every DB the same way (compute_count 2, storage = allocated TB * 1024 * 2)
+# whatever its load.  RightSizer instead:
+# 1) Fetches hourly CpuUtilization and StorageUsed for the whole fleet with batched Monitoring
+#    queries (MetricBatcher - one call per metric per group of DBs of a compartment, at most 50 and
+#    few enough that DBs x hours stays under the datapoint limit of a response)
+# 2) Puts every series in one matrix (SeriesStats) and works out all targets with array operations:
+#      ECPU    = current ECPU * p95 CPU % / 60%, rounded up, at least 2 (and at most max_compute_count)
+#                OCPU DBs that stay OCPU get whole OCPUs, capped at the OCPUs that fit in max_compute_count
+#      storage = peak used (or allocated, if more) GB * 1.25, at least 20 GB and at most the current size
+# 3) Returns them as per-DB spec keys (compute_count, storage_gb) that the reconciler applies on
+#    top of the script spec - DBs without metrics keep the script spec
+# 4) Projects the monthly cost before / after (list prices below) for a savings report
+#
+# Only storage that can go down is changed here - growth is left to storage auto scaling.  TB model
+# DBs are converted to GB sizing at no more than their current size.
+
+# Usage:
+#   sizer = RightSizer(MetricBatcher(monitoring_client), days=14)
+#   targets = sizer.targets(databases, spec)         # {db_id: {"compute_count": 4.0, "storage_gb": 120}}
+#   reconciler = Reconciler(database_client, waiter, spec, targets=targets)
+#   rows = sizer.savings(databases, targets, spec)
+
+import datetime
+import logging
+
+import numpy as np
+
+# Local
+from oci_metric_batch import MetricBatcher, DEFAULT_GROUP_SIZE
+from oci_monitoring_query import MAX_POINTS, POINTS_HEADROOM
+from oci_metric_stats import SeriesStats
+from oci_adb_reconciler import MIN_STORAGE_GB, OCPU_TO_ECPU, desired_changes, skip_reason
+
+logger = logging.getLogger('oci-adb-rightsizing')
+
+# Constants
+NAMESPACE = "oci_autonomous_database"
+CPU_METRIC = "CpuUtilization"              # % of the allocated compute
+STORAGE_METRIC = "StorageUsed"             # GB
+INTERVAL = "1h"
+DEFAULT_DAYS = 14
+HOURS_PER_DAY = 24
+CPU_PERCENTILE = 95
+TARGET_CPU_UTILIZATION = 60.0
+STORAGE_HEADROOM = 1.25
+MIN_ECPU = 2
+HOURS_PER_MONTH = 730
+
+# List prices (USD) - ECPU per hour by license, storage per GB month by workload
+ECPU_HOUR_PRICE = {"LICENSE_INCLUDED": 0.336, "BRING_YOUR_OWN_LICENSE": 0.0807}
+STORAGE_GB_MONTH_PRICE = {"OLTP": 0.1156, "AJD": 0.1156, "APEX": 0.1156, "DW": 0.0244, "LH": 0.0244}
+
+REPORT_FIELDS = ["NAME", "OCID", "WORKLOAD", "CPU_P95", "ECPU_NOW", "ECPU_TARGET", "STORAGE_PEAK_GB",
+                 "STORAGE_NOW_GB", "STORAGE_TARGET_GB", "MONTHLY_NOW", "MONTHLY_AFTER", "MONTHLY_SAVINGS"]
+
+
+def _ecpu(db) -> float:
+    return db.compute_count * OCPU_TO_ECPU if db.compute_model == "OCPU" else db.compute_count
+
+
+def _storage_gb(db) -> float:
+    if db.data_storage_size_in_gbs:
+        return db.data_storage_size_in_gbs
+    return (db.data_storage_size_in_tbs or 0) * 1024
+
+
+class RightSizer:
+    """Fleet-wide CPU / storage percentiles -> per-DB compute and storage targets"""
+
+    def __init__(self, batcher: MetricBatcher, days: int = DEFAULT_DAYS, percentile: float = CPU_PERCENTILE,
+                 target_cpu: float = TARGET_CPU_UTILIZATION, headroom: float = STORAGE_HEADROOM):
+        self.batcher = batcher
+        self.days = days
+        self.percentile = percentile
+        self.target_cpu = target_cpu
+        self.headroom = headroom
+        self.cpu_p95 = {}
+        self.storage_peak = {}
+
+    def _series(self, databases: list, metric: str) -> SeriesStats:
+        """One row per DB (in order) - empty where the DB has no data"""
+        end_time = datetime.datetime.now(datetime.timezone.utc)
+        start_time = end_time - datetime.timedelta(days=self.days)
+        by_compartment = {}
+        for db in databases:
+            by_compartment.setdefault(db.compartment_id, []).append(db.id)
+        # Every DB is one series of days x 24 points - keep a group's response under the datapoint limit
+        group_size = min(DEFAULT_GROUP_SIZE, max(1, int(MAX_POINTS * POINTS_HEADROOM) // (self.days * HOURS_PER_DAY)))
+        by_id = {}
+        for compartment_id, db_ids in by_compartment.items():
+            by_id.update(self.batcher.fetch(compartment_id, NAMESPACE, metric, INTERVAL, "max", start_time, end_time,
+                                            dimension="resourceId", resource_ids=db_ids, group_size=group_size))
+        value_arrays = []
+        for db in databases:
+            points = [dp.value for series in by_id.get(db.id.lower(), []) for dp in series.aggregated_datapoints]
+            value_arrays.append(np.fromiter(points, dtype=np.float64, count=len(points)))
+        return SeriesStats.from_arrays(value_arrays)
+
+    def targets(self, databases: list, spec: dict) -> dict:
+        """{db_id: spec keys} - compute_count in the model the DB ends up in, storage_gb for GB sizing"""
+        databases = [db for db in databases if not skip_reason(db)]
+        if not databases:
+            return {}
+        cpu = self._series(databases, CPU_METRIC).percentile(self.percentile)
+        peak = self._series(databases, STORAGE_METRIC).max()
+
+        converting = spec.get("compute_model") == "ECPU"
+        ocpu = np.array([db.compute_model == "OCPU" and not converting for db in databases])
+        ecpu = np.array([_ecpu(db) or np.nan for db in databases], dtype=np.float64)
+        allocated = np.array([(db.allocated_storage_size_in_tbs or 0) * 1024 for db in databases], dtype=np.float64)
+        current = np.array([_storage_gb(db) or np.inf for db in databases], dtype=np.float64)
+
+        # Compute - enough ECPU to run the p95 hour at the target utilization
+        with np.errstate(invalid="ignore"):
+            needed = np.maximum(np.ceil(ecpu * cpu / self.target_cpu), MIN_ECPU)
+        compute = np.where(ocpu, np.maximum(np.ceil(needed / OCPU_TO_ECPU), 1), needed)
+        if spec.get("max_compute_count"):
+            # The cap is in ECPU - OCPU DBs get the whole OCPUs that fit under it (at least 1)
+            cap = spec["max_compute_count"]
+            compute = np.minimum(compute, np.where(ocpu, max(np.floor(cap / OCPU_TO_ECPU), 1), cap))
+
+        # Storage - peak used (allocated if more) plus headroom, never more than the DB has now
+        storage = np.minimum(np.maximum(np.ceil(np.fmax(peak, allocated) * self.headroom), MIN_STORAGE_GB), current)
+
+        targets = {}
+        for db, cpu_value, compute_value, peak_value, storage_value in zip(databases, cpu, compute, peak, storage):
+            self.cpu_p95[db.id] = None if np.isnan(cpu_value) else float(cpu_value)
+            self.storage_peak[db.id] = None if np.isnan(peak_value) else float(peak_value)
+            target = {}
+            if not np.isnan(compute_value):
+                target["compute_count"] = float(compute_value)
+            if not np.isnan(peak_value):
+                target["storage_gb"] = int(storage_value)
+            if target:
+                targets[db.id] = target
+        logger.info(f"Right-sizing: {len(targets)} of {len(databases)} DBs have metrics for {self.days} days "
+                    f"({self.batcher.calls} monitoring calls)")
+        return targets
+
+    def savings(self, databases: list, targets: dict, spec: dict) -> list:
+        """Report rows with monthly cost now and after the spec and targets are applied"""
+        rows = []
+        for db in (db for db in databases if not skip_reason(db)):
+            # Same changes the reconciler will make
+            changes = desired_changes(db, dict(spec, **targets.get(db.id, {})))
+            model_after = changes.get("compute_model", db.compute_model)
+            count_after = changes.get("compute_count", db.compute_count * OCPU_TO_ECPU
+                                      if db.compute_model == "OCPU" and model_after == "ECPU" else db.compute_count)
+            ecpu_now = _ecpu(db) or 0.0
+            ecpu_after = (count_after or 0.0) * (OCPU_TO_ECPU if model_after == "OCPU" else 1)
+            storage_now = _storage_gb(db)
+            storage_after = changes.get("data_storage_size_in_gbs", storage_now)
+            storage_price = STORAGE_GB_MONTH_PRICE.get(db.db_workload, STORAGE_GB_MONTH_PRICE["OLTP"])
+            now = ecpu_now * ECPU_HOUR_PRICE.get(db.license_model, 0.0) * HOURS_PER_MONTH + storage_now * storage_price
+            after = (ecpu_after * ECPU_HOUR_PRICE.get(changes.get("license_model", db.license_model), 0.0) * HOURS_PER_MONTH
+                     + storage_after * storage_price)
+            rows.append({"NAME": db.display_name, "OCID": db.id, "WORKLOAD": db.db_workload,
+                         "CPU_P95": self.cpu_p95.get(db.id), "ECPU_NOW": ecpu_now, "ECPU_TARGET": ecpu_after,
+                         "STORAGE_PEAK_GB": self.storage_peak.get(db.id), "STORAGE_NOW_GB": storage_now,
+                         "STORAGE_TARGET_GB": storage_after, "MONTHLY_NOW": round(now, 2),
+                         "MONTHLY_AFTER": round(after, 2), "MONTHLY_SAVINGS": round(now - after, 2)})
+        return rows
+
+
+def savings_summary(rows: list) -> str:
+    now = sum(r["MONTHLY_NOW"] for r in rows)
+    after = sum(r["MONTHLY_AFTER"] for r in rows)
+    return (f"{len(rows)} DB(s): ${now:,.2f}/month now, ${after:,.2f}/month after - "
+            f"projected savings ${now - after:,.2f}/month ({(now - after) / now:.0%})" if now else f"{len(rows)} DB(s): no cost")
@@ -0,0 +1,222 @@
+# OCI Alarm Backtest
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Replays candidate alarm definitions over metric history to see how often each would have fired.
+#
+# oci-metrics-alarm-history.py shows crossings for ONE query and ONE threshold.  When tuning an
+# alarm you want to compare many candidates.  Each candidate has:
+#   name, query, threshold, operator (>, >=, <, <=), pending_duration (ISO 8601, e.g. PT5M),
+#   aggregation - "stream" (default, fires per metric stream like an OCI alarm) or
+#                 max / min / mean / sum (streams combined per timestamp before the threshold)
+#   and optionally namespace / resource_group (default from the command line)
+#
+# Series for each distinct query are pulled once (through the local metric cache, see
+# oci_metric_cache.py) and aligned on a common time grid.  All candidates sharing a query are
+# then evaluated together - breach runs are computed once per distinct threshold as one
+# (threshold x stream x time) array, and every pending duration is applied to those runs:
+#   breach runs -> runs longer than the pending duration fire -> firing count and firing time
+#
+# Candidate file (JSON list):
+#   [{"name": "fs-95-5m", "query": "FilesystemUtilization[1m].max()", "threshold": 95, "pending_duration": "PT5M"},
+#    {"name": "fs-90-15m", "query": "FilesystemUtilization[1m].max()", "threshold": 90, "pending_duration": "PT15M"}]
+
+# Usage: python3 oci_alarm_backtest.py -c <compartment> -n <namespace> -a candidates.json [-d 90] [-f csv]
+#        python3 oci_alarm_backtest.py --benchmark
+
+import argparse
+import json
+import logging
+import re
+import time
+import warnings
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Local
+from oci_metric_stats import OPERATORS, align
+from oci_metric_series import MetricSeries, interval_seconds
+from oci_report_writer import ReportWriter, report_filename
+
+logger = logging.getLogger('oci-alarm-backtest')
+
+# Constants
+AGGREGATIONS = {"max": np.fmax.reduce, "min": np.fmin.reduce, "sum": np.nansum, "mean": np.nanmean}
+DURATION_REGEX = r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?'
+MAX_BLOCK_ELEMENTS = 50_000_000        # candidates x streams x points evaluated per block
+
+
+def parse_duration(value) -> int:
+    """Seconds from an alarm pending duration (PT5M, PT1H30M) or a plain number of seconds"""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(DURATION_REGEX, value.strip().upper())
+    if not match:
+        raise ValueError(f"Invalid pending duration {value} (expected ISO 8601, e.g. PT5M)")
+    hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def breach_runs(values: np.ndarray, thresholds: np.ndarray, operators: list) -> list:
+    """Breach runs for each (threshold, operator) over one (streams x points) array
+
+    Returns one (stream index, run length in points) array pair per threshold.  Thresholds are
+    compared in blocks as one (threshold x stream x time) array."""
+    streams, points = values.shape
+    runs = []
+    block = max(1, MAX_BLOCK_ELEMENTS // max(1, streams * points))
+    for begin in range(0, len(thresholds), block):
+        index = np.arange(begin, min(begin + block, len(thresholds)))
+        breach = np.zeros((len(index), streams, points + 2), dtype=np.int8)
+        with np.errstate(invalid="ignore"):
+            for op in set(operators[i] for i in index):
+                selected = np.array([operators[i] == op for i in index])
+                breach[selected, :, 1:-1] = OPERATORS[op](values[None, :, :], thresholds[index][selected, None, None])
+        # Run boundaries: +1 at a run start, -1 one past its end (padding guarantees pairs, in order)
+        edges = np.diff(breach, axis=2)
+        start_k, start_s, start_t = np.nonzero(edges == 1)
+        end_t = np.nonzero(edges == -1)[2]
+        lengths = end_t - start_t
+        bounds = np.searchsorted(start_k, np.arange(len(index) + 1))
+        runs.extend((start_s[a:b], lengths[a:b]) for a, b in zip(bounds[:-1], bounds[1:]))
+    return runs
+
+
+def evaluate(values: np.ndarray, thresholds: np.ndarray, operators: list, pending_points: np.ndarray, step: int) -> list:
+    """Backtest K candidates over one (streams x points) array - returns one result dict per candidate
+
+    A breach run of n points fires if n > pending_points (the breach must still hold once the
+    pending duration has elapsed) and is FIRING for (n - pending_points) intervals.  Candidates
+    that differ only in pending duration share the breach runs of their threshold."""
+    pairs = {}
+    codes = np.fromiter((pairs.setdefault((op, t), len(pairs)) for op, t in zip(operators, thresholds.tolist())),
+                        dtype=np.int64, count=len(operators))
+    runs = breach_runs(values, np.array([t for _, t in pairs]), [op for op, _ in pairs])
+
+    results = []
+    for code, pending in zip(codes.tolist(), pending_points.tolist()):
+        run_streams, lengths = runs[code]
+        firing = lengths[lengths > pending] - pending
+        results.append({"firings": len(firing),
+                        "firing_streams": len(np.unique(run_streams[lengths > pending])),
+                        "firing_seconds": int(firing.sum()) * step,
+                        "longest_seconds": int(firing.max()) * step if len(firing) else 0})
+    return results
+
+
+def backtest(candidates: list, series_by_query: dict) -> list:
+    """Evaluate every candidate - series_by_query maps (namespace, query, resource group) -> [MetricSeries]"""
+    groups = {}
+    for i, candidate in enumerate(candidates):
+        aggregation = candidate.get("aggregation", "stream")
+        if aggregation != "stream" and aggregation not in AGGREGATIONS:
+            raise ValueError(f"{candidate['name']}: unknown aggregation {aggregation}")
+        groups.setdefault((candidate["namespace"], candidate["query"], candidate.get("resource_group"), aggregation), []).append(i)
+
+    results = [None] * len(candidates)
+    for (namespace, query, resource_group, aggregation), members in groups.items():
+        step = interval_seconds(query)
+        grid, values = align(series_by_query.get((namespace, query, resource_group), []), step)
+        if aggregation != "stream" and len(values):
+            # All-NaN timestamps (no stream reported) stay NaN and never breach
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                values = AGGREGATIONS[aggregation](values, axis=0)[None, :]
+        thresholds = np.array([float(candidates[i]["threshold"]) for i in members])
+        operators = [candidates[i].get("operator", ">") for i in members]
+        pending = np.array([int(np.ceil(parse_duration(candidates[i].get("pending_duration")) / step)) for i in members])
+        for i, result in zip(members, evaluate(values, thresholds, operators, pending, step)):
+            candidate = candidates[i]
+            results[i] = {"name": candidate["name"], "query": query, "threshold": float(candidate["threshold"]),
+                          "operator": candidate.get("operator", ">"), "pending_duration": candidate.get("pending_duration", "PT0M"),
+                          "aggregation": aggregation, "streams": len(values), **result}
+    return results
+
+
+def _synthetic(streams: int, points: int, step: int, seed: int = 11) -> list:
+    # Random walks around 60% with spikes - stands in for cached FilesystemUtilization-style series
+    rng = np.random.default_rng(seed)
+    walk = 60 + np.cumsum(rng.normal(0, 0.8, (streams, points)), axis=1).clip(-40, 40)
+    walk += (rng.random((streams, points)) < 0.002) * rng.uniform(10, 40, (streams, points))
+    timestamps = (np.arange(points, dtype=np.int64) * step + 1_700_000_000 // step * step).astype("datetime64[s]")
+    return [MetricSeries("Synthetic", "benchmark", {"resourceName": f"host{i}"}, timestamps, walk[i]) for i in range(streams)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-pr", "--profile", help="Config Profile, named", default="DEFAULT")
+    parser.add_argument("-c", "--compartmentocid", help="Metrics Compartment OCID")
+    parser.add_argument("-n", "--namespace", help="Default Metrics Namespace for candidates")
+    parser.add_argument("-r", "--resourcegroup", help="Default Resource Group for candidates")
+    parser.add_argument("-a", "--alarms", help="JSON file with candidate alarm definitions")
+    parser.add_argument("-d", "--days", help="Days of history to replay (def=90)", type=int, default=90)
+    parser.add_argument("-th", "--threads", help="Concurrent metric queries (def=4)", type=int, default=4)
+    parser.add_argument("-f", "--format", help="Write results to ndjson/csv/parquet instead of printing", choices=["ndjson", "csv", "parquet"])
+    parser.add_argument("--benchmark", help="Backtest 300 candidates over synthetic 90 day series (no OCI calls)", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    if args.benchmark:
+        query = "Synthetic[5m].max()"
+        series_by_query = {("benchmark", query, None): _synthetic(streams=200, points=90 * 288, step=300)}
+        candidates = [{"name": f"t{t}-p{p}", "namespace": "benchmark", "query": query, "threshold": t,
+                       "pending_duration": f"PT{p}M"}
+                      for t in range(70, 100) for p in (0, 5, 10, 15, 30, 45, 60, 90, 120, 240)]
+        start = time.perf_counter()
+        results = backtest(candidates, series_by_query)
+        logger.info(f"Backtested {len(candidates)} candidates x 200 streams x 90 days (5m) in {time.perf_counter() - start:.2f}s")
+    else:
+        if not (args.compartmentocid and args.alarms and args.namespace):
+            parser.error("-c, -n and -a are required (or --benchmark)")
+
+        from oci import config
+        from oci.monitoring import MonitoringClient
+        from oci.retry import DEFAULT_RETRY_STRATEGY
+        from oci.exceptions import ServiceError
+        from oci_monitoring_query import MonitoringQuery
+        from oci_metric_cache import MetricCache, cache_filename
+
+        with open(args.alarms, 'r') as filehandle:
+            candidates = json.load(filehandle)
+        for candidate in candidates:
+            candidate.setdefault("namespace", args.namespace)
+            candidate.setdefault("resource_group", args.resourcegroup)
+
+        config = config.from_file(profile_name=args.profile)
+        monitoring_client = MonitoringClient(config, retry_strategy=DEFAULT_RETRY_STRATEGY)
+        metric_cache = MetricCache(MonitoringQuery(monitoring_client, threads=args.threads), cache_filename(config["tenancy"]))
+
+        # Each distinct query is pulled once, from the cache where already covered
+        end_time = datetime.utcnow()
+        start_time = end_time - timedelta(days=args.days)
+        series_by_query = {}
+        try:
+            for namespace, query, resource_group in {(c["namespace"], c["query"], c.get("resource_group")) for c in candidates}:
+                series_by_query[(namespace, query, resource_group)] = metric_cache.run(
+                    args.compartmentocid, namespace, query, start_time, end_time, resource_group=resource_group)
+        except ServiceError as exc:
+            logger.error(f"Failed to get metrics: {exc}")
+            exit(1)
+        logger.info(f"Metrics: {len(series_by_query)} queries, {metric_cache.calls} API calls")
+
+        start = time.perf_counter()
+        results = backtest(candidates, series_by_query)
+        logger.info(f"Backtested {len(candidates)} candidates in {time.perf_counter() - start:.2f}s")
+
+    if args.format:
+        filename = report_filename(f"alarm-backtest-{datetime.now().strftime('%Y-%m-%d-%H-%M')}", args.format)
+        with ReportWriter(filename, format=args.format) as writer:
+            writer.write_rows(results)
+        logger.info(f"Script complete - wrote {args.format} to {filename}.")
+    else:
+        for row in sorted(results, key=lambda r: -r["firing_seconds"])[:50 if args.benchmark else None]:
+            print(f'{row["name"]}: {row["aggregation"]} {row["operator"]} {row["threshold"]} pending {row["pending_duration"]} - '
+                  f'fired {row["firings"]} time(s) on {row["firing_streams"]}/{row["streams"]} streams, '
+                  f'firing {row["firing_seconds"] / 3600:.1f}h (longest {row["longest_seconds"] / 3600:.1f}h)')
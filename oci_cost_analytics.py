@@ -0,0 +1,381 @@
+# OCI Cost Analytics
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Vectorized analytics over Usage API rows (UsageSummary items or streamed report rows).
+# Rows are loaded once into typed NumPy arrays - string columns (service, SKU, resource, tag)
+# become integer codes plus a category list - and everything after that is array math:
+# group-bys, daily totals, run-rate, month-end forecast and top-N movers.
+#
+# pandas is optional; to_pandas() returns a frame with categorical columns for ad-hoc work.
+
+# Usage:
+#   frame = UsageFrame.from_usage_items(usage_client.request_summarized_usages(...).data.items)
+#   frame.group_sum(["service"])
+#   frame.month_end_forecast()
+#
+# Benchmark (synthetic rows, the same analyses as a Python loop and vectorized):
+#   python3 oci_cost_analytics.py --rows 1000000
+#   1M rows, two group-bys, daily totals, forecast and top movers: ~1.6-2.1s as a loop;
+#   ~0.8s to load 3 category columns plus ~0.08s per vectorized pass.
+#   Loading is bound by reading the SDK objects, so the arrays only pay off when several analyses
+#   share one load (oci_cost_anomaly.py, oci_cost_tag_rollup.py).  A single sum is cheaper as a
+#   loop (~0.2s for service + daily totals alone), which is why oci-cost-report.py keeps one.
+
+import argparse
+import datetime
+import itertools
+import logging
+import time
+from operator import attrgetter
+
+import numpy as np
+
+# Optional
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+logger = logging.getLogger('oci-cost-analytics')
+
+# Columns encoded as categories (codes + labels)
+CATEGORY_COLUMNS = ["service", "sku_name", "resource_id", "compartment_name", "tag"]
+# Group-bys over at most this many key combinations skip the sort
+DENSE_KEYS = 1 << 20
+# date(1970, 1, 1).toordinal()
+EPOCH_ORDINAL = 719163
+
+
+def _encode(values: list):
+    """Encode a list of labels into (int32 codes, list of categories)
+
+    One C-level pass of dict.setdefault maps each row to the row where its label first appears;
+    the first rows (in order) are the categories, and a lookup array turns them into codes."""
+    index = {}
+    first = np.fromiter(map(index.setdefault, values, itertools.count()), dtype=np.int64, count=len(values))
+    lookup = np.empty(len(values), dtype=np.int32)
+    lookup[np.fromiter(index.values(), dtype=np.int64, count=len(index))] = np.arange(len(index), dtype=np.int32)
+    return lookup[first], list(index)
+
+
+def _fixed_offset(values: list):
+    """UTC offset in seconds if every datetime has the same fixed-offset (or no) tzinfo, else None"""
+    zones = set(map(attrgetter("tzinfo"), values))
+    if len(zones) != 1:
+        return None
+    zone = zones.pop()
+    if zone is None:
+        return 0
+    # Zones with DST (zoneinfo, tzlocal) have no offset without a date
+    offset = zone.utcoffset(None)
+    return int(offset.total_seconds()) if offset is not None else None
+
+
+def _to_datetime64(values: list) -> np.ndarray:
+    """Convert datetimes (OCI models) or ISO strings (streamed reports) to datetime64[s] in one go"""
+    if values and isinstance(values[0], datetime.datetime):
+        if None not in values:
+            # OCI returns UTC datetimes - day ordinal and time fields are plain attribute reads,
+            # several times cheaper than timestamp(), which works out the offset for every row
+            offset = _fixed_offset(values)
+            if offset is not None:
+                def field(name: str) -> np.ndarray:
+                    return np.fromiter(map(attrgetter(name), values), dtype=np.int64, count=len(values))
+
+                days = np.fromiter(map(datetime.datetime.toordinal, values), dtype=np.int64, count=len(values))
+                seconds = (days - EPOCH_ORDINAL) * 86400 + field("hour") * 3600 + field("minute") * 60 \
+                    + field("second") - offset
+                return seconds.astype("datetime64[s]")
+            epoch = np.fromiter(map(datetime.datetime.timestamp, values), dtype=np.float64, count=len(values))
+            return epoch.astype(np.int64).astype("datetime64[s]")
+        epoch = np.array([v.timestamp() if v is not None else np.nan for v in values], dtype=np.float64)
+        result = np.full(len(values), np.datetime64("NaT"), dtype="datetime64[s]")
+        valid = ~np.isnan(epoch)
+        result[valid] = epoch[valid].astype(np.int64).astype("datetime64[s]")
+        return result
+    # ISO strings - usage data is UTC, drop the offset (+00:00 / Z) so numpy can parse it.  Daily /
+    # hourly rows repeat the same few strings, so only the distinct ones are parsed
+    codes, labels = _encode(values)
+    parsed = np.array([str(v)[:19] if v is not None else "NaT" for v in labels], dtype="datetime64[s]")
+    return parsed[codes]
+
+
+def _numbers(values: list) -> np.ndarray:
+    # None (no amount / quantity) counts as 0
+    return np.nan_to_num(np.array(values, dtype=np.float64))
+
+
+def _tag_label(tags, tag_key: str = None):
+    # Tag grouping returns tags as a list of Tag (namespace/key/value)
+    for tag in tags or []:
+        if tag_key is None or tag.key == tag_key:
+            return f"{tag.namespace}.{tag.key}={tag.value}" if tag.value is not None else None
+    return None
+
+
+class UsageFrame:
+    """Column-oriented usage/cost rows backed by NumPy arrays"""
+
+    def __init__(self, start, amount, quantity, categories: dict):
+        self.start = start if isinstance(start, np.ndarray) else _to_datetime64(list(start))
+        self.start = self.start.astype("datetime64[s]")
+        self.amount = np.asarray(amount, dtype=np.float64)
+        self.quantity = np.asarray(quantity, dtype=np.float64)
+
+        # name -> (codes, labels)
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.amount)
+
+    # Loaders
+
+    @classmethod
+    def from_usage_items(cls, items, tag_key: str = None, columns: list = None):
+        """Load UsageSummary items (request_summarized_usages(...).data.items)
+
+        columns limits the category columns loaded (def all) - the others are left unset (None)."""
+        items = list(items)
+        columns = CATEGORY_COLUMNS if columns is None else columns
+
+        def column(name: str) -> list:
+            return list(map(attrgetter(name), items))
+
+        categories = {}
+        for name in CATEGORY_COLUMNS:
+            if name not in columns:
+                categories[name] = (np.zeros(len(items), dtype=np.int32), [None])
+            elif name == "tag":
+                tags = column("tags")
+                categories[name] = _encode([_tag_label(t, tag_key) for t in tags] if any(tags) else [None] * len(items))
+            else:
+                categories[name] = _encode(column(name))
+        return cls(_to_datetime64(column("time_usage_started")), _numbers(column("computed_amount")),
+                   _numbers(column("computed_quantity")), categories)
+
+    @classmethod
+    def from_rows(cls, rows, amount_field: str = "amount"):
+        """Load dict rows, such as the NDJSON/CSV rows written by oci_report_writer"""
+        starts = []
+        amounts = []
+        quantities = []
+        labels = {name: [] for name in CATEGORY_COLUMNS}
+        for row in rows:
+            # Streamed tag report has both cost and usage rows
+            row_type = row.get("type", "cost")
+            value = float(row.get(amount_field) or 0.0)
+            starts.append(row.get("start"))
+            amounts.append(value if row_type == "cost" else 0.0)
+            quantities.append(value if row_type == "usage" else 0.0)
+            labels["service"].append(row.get("service"))
+            labels["sku_name"].append(row.get("sku_name"))
+            labels["resource_id"].append(row.get("identifier", row.get("resource_id")))
+            labels["compartment_name"].append(row.get("compartment_name"))
+            labels["tag"].append(row.get("app_name", row.get("tag")))
+        return cls(starts, amounts, quantities, {name: _encode(values) for name, values in labels.items()})
+
+    def to_pandas(self):
+        """DataFrame with categorical string columns (requires pandas)"""
+        if pandas is None:
+            raise ImportError("to_pandas requires pandas (pip3 install pandas)")
+        columns = {"start": self.start, "amount": self.amount, "quantity": self.quantity}
+        for name, (codes, labels) in self.categories.items():
+            columns[name] = pandas.Categorical.from_codes(codes, categories=pandas.Index(labels, dtype=object)) \
+                if None not in labels else pandas.Categorical([labels[c] for c in codes])
+        return pandas.DataFrame(columns)
+
+    # Analytics
+
+    def total(self, column: str = "amount") -> float:
+        return float(getattr(self, column).sum())
+
+    def _group_keys(self, by: list):
+        """Combine category codes for the group-by columns into one dense key per row"""
+        key = np.zeros(len(self), dtype=np.int64)
+        size = 1
+        for name in by:
+            codes, labels = self.categories[name]
+            key = key * len(labels) + codes
+            size *= len(labels)
+        if size > max(len(self), DENSE_KEYS):
+            return np.unique(key, return_inverse=True)
+        # Small key space - bincount finds the keys present without sorting every row
+        unique_keys = np.flatnonzero(np.bincount(key, minlength=size))
+        lookup = np.zeros(size, dtype=np.int64)
+        lookup[unique_keys] = np.arange(len(unique_keys))
+        return unique_keys, lookup[key]
+
+    def _decode_keys(self, unique_keys, by: list) -> list:
+        # Reverse the mixed-radix combination in _group_keys
+        decoded = []
+        remaining = unique_keys.copy()
+        for name in reversed(by):
+            labels = self.categories[name][1]
+            decoded.append([labels[c] for c in remaining % len(labels)])
+            remaining //= len(labels)
+        decoded.reverse()
+        return list(zip(*decoded))
+
+    def group_sum(self, by: list, column: str = "amount", mask=None) -> list:
+        """Sum a column by category columns - returns [(key tuple, total)] sorted by total desc"""
+        values = getattr(self, column)
+        unique_keys, inverse = self._group_keys(by)
+        totals = np.bincount(inverse, weights=values if mask is None else np.where(mask, values, 0.0),
+                             minlength=len(unique_keys))
+        order = np.argsort(-totals)
+        keys = self._decode_keys(unique_keys[order], by)
+        return list(zip(keys, totals[order].tolist()))
+
+    def daily_totals(self, column: str = "amount"):
+        """(days as datetime64[D], totals) for each day between first and last row
+
+        Rows without a start time (NaT) are left out."""
+        days = self.start.astype("datetime64[D]")
+        valid = ~np.isnat(days)
+        if not valid.any():
+            return np.array([], dtype="datetime64[D]"), np.zeros(0)
+        first = days[valid].min()
+        offsets = (days[valid] - first).astype(np.int64)
+        totals = np.bincount(offsets, weights=getattr(self, column)[valid])
+        return first + np.arange(len(totals)), totals
+
+    def daily_run_rate(self, days: int = 7, column: str = "amount") -> float:
+        """Average daily total over the last N days present in the data"""
+        _, totals = self.daily_totals(column)
+        return float(totals[-days:].mean()) if len(totals) else 0.0
+
+    def month_end_forecast(self, run_rate_days: int = 7, column: str = "amount") -> dict:
+        """Month-to-date actual plus run-rate for the remaining days of the latest month"""
+        day_list, totals = self.daily_totals(column)
+        last_day = day_list[-1]
+        month_start = last_day.astype("datetime64[M]").astype("datetime64[D]")
+        month_end = (last_day.astype("datetime64[M]") + 1).astype("datetime64[D]")
+        actual = float(totals[day_list >= month_start].sum())
+        run_rate = float(totals[-run_rate_days:].mean())
+        remaining_days = int((month_end - last_day).astype(np.int64)) - 1
+        return {"month": str(last_day.astype("datetime64[M]")), "actual": actual, "run_rate": run_rate,
+                "remaining_days": remaining_days, "forecast": actual + run_rate * remaining_days}
+
+    def top_movers(self, by: list, n: int = 10, window_days: int = 7, column: str = "amount") -> list:
+        """Groups with the largest change between the last window and the window before it"""
+        days = self.start.astype("datetime64[D]")
+        # NaT compares false, so rows without a start time fall in neither window
+        last = days[~np.isnat(days)].max()
+        recent = days > last - window_days
+        previous = (days > last - 2 * window_days) & ~recent
+        values = getattr(self, column)
+        unique_keys, inverse = self._group_keys(by)
+        recent_totals = np.bincount(inverse, weights=np.where(recent, values, 0.0), minlength=len(unique_keys))
+        previous_totals = np.bincount(inverse, weights=np.where(previous, values, 0.0), minlength=len(unique_keys))
+        delta = recent_totals - previous_totals
+        order = np.argsort(-np.abs(delta))[:n]
+        keys = self._decode_keys(unique_keys[order], by)
+        return [{"key": key, "previous": float(p), "recent": float(r), "change": float(d)}
+                for key, p, r, d in zip(keys, previous_totals[order], recent_totals[order], delta[order])]
+
+
+########################################
+# Benchmark - synthetic rows, loop versus vectorized
+
+class _FakeUsage:
+    __slots__ = ["time_usage_started", "computed_amount", "computed_quantity", "service", "sku_name",
+                 "resource_id", "compartment_name", "tags"]
+
+
+def _synthetic_items(rows: int, resources: int = 5000, days: int = 60) -> list:
+    rng = np.random.default_rng(42)
+    services = ["COMPUTE", "BLOCK_STORAGE", "OBJECT_STORAGE", "DATABASE", "NETWORK"]
+    base = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    day_offsets = rng.integers(0, days, rows)
+    service_idx = rng.integers(0, len(services), rows)
+    resource_idx = rng.integers(0, resources, rows)
+    amounts = rng.gamma(2.0, 3.0, rows)
+    items = []
+    for i in range(rows):
+        item = _FakeUsage()
+        item.time_usage_started = base + datetime.timedelta(days=int(day_offsets[i]))
+        item.computed_amount = float(amounts[i])
+        item.computed_quantity = 1.0
+        item.service = services[service_idx[i]]
+        item.sku_name = f"{item.service} SKU {resource_idx[i] % 7}"
+        item.resource_id = f"ocid1.resource.oc1..{resource_idx[i]}"
+        item.compartment_name = "bench"
+        item.tags = None
+        items.append(item)
+    return items
+
+
+def _loop_analysis(items, n: int = 10, window_days: int = 7):
+    # The same analyses as the vectorized path, the way the cost scripts write them - dicts per row
+    by_service = {}
+    by_service_sku = {}
+    by_day = {}
+    by_resource_day = {}
+    for item in items:
+        amount = item.computed_amount or 0.0
+        by_service[item.service] = by_service.get(item.service, 0.0) + amount
+        key = (item.service, item.sku_name)
+        by_service_sku[key] = by_service_sku.get(key, 0.0) + amount
+        day = item.time_usage_started.date()
+        by_day[day] = by_day.get(day, 0.0) + amount
+        key = (item.resource_id, day)
+        by_resource_day[key] = by_resource_day.get(key, 0.0) + amount
+    service_totals = sorted(by_service.items(), key=lambda kv: -kv[1])
+    service_sku_totals = sorted(by_service_sku.items(), key=lambda kv: -kv[1])
+
+    # Month-end forecast from the daily totals (missing days count as 0)
+    first, last = min(by_day), max(by_day)
+    daily = [by_day.get(first + datetime.timedelta(days=d), 0.0) for d in range((last - first).days + 1)]
+    month_start = last.replace(day=1)
+    actual = sum(v for d, v in by_day.items() if d >= month_start)
+    run_rate = sum(daily[-window_days:]) / len(daily[-window_days:])
+    next_month = (month_start + datetime.timedelta(days=32)).replace(day=1)
+    forecast = actual + run_rate * ((next_month - last).days - 1)
+
+    # Top movers by resource, last window against the one before
+    recent = {}
+    previous = {}
+    for (resource_id, day), amount in by_resource_day.items():
+        age = (last - day).days
+        if age < window_days:
+            recent[resource_id] = recent.get(resource_id, 0.0) + amount
+        elif age < 2 * window_days:
+            previous[resource_id] = previous.get(resource_id, 0.0) + amount
+    movers = sorted(set(recent) | set(previous), key=lambda r: -abs(recent.get(r, 0.0) - previous.get(r, 0.0)))[:n]
+    return service_totals, service_sku_totals, daily, forecast, movers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--rows", help="Synthetic usage rows (def=1000000)", type=int, default=1000000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+
+    logger.info(f"Generating {args.rows} synthetic usage rows")
+    items = _synthetic_items(args.rows)
+
+    start = time.perf_counter()
+    loop_result = _loop_analysis(items)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    frame = UsageFrame.from_usage_items(items, columns=["service", "sku_name", "resource_id"])
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    frame.group_sum(["service"])
+    frame.group_sum(["service", "sku_name"])
+    frame.daily_totals()
+    forecast = frame.month_end_forecast()
+    frame.top_movers(["resource_id"], n=10)
+    analysis_time = time.perf_counter() - start
+
+    if not np.isclose(forecast["forecast"], loop_result[3]):
+        logger.warning(f"Forecasts differ: loop {loop_result[3]:.2f}, vectorized {forecast['forecast']:.2f}")
+    logger.info(f"Python loop (2 group-bys, daily, forecast, movers): {loop_time:.3f}s")
+    logger.info(f"Array load (once):                                  {load_time:.3f}s")
+    logger.info(f"Vectorized (same analyses, per pass):               {analysis_time:.3f}s")
+    logger.info(f"Array load + one vectorized pass:                   {load_time + analysis_time:.3f}s")
+    logger.info(f"Loop / (load + one pass):                           {loop_time / (load_time + analysis_time):.1f}x")
@@ -0,0 +1,229 @@
+# OCI Cost Anomaly Detection
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Flags daily cost spikes per resource, using the streamed output of
+# oci-cost-report-by-tag-per-resource2.py (-f ndjson/csv/parquet, -g DAILY).
+#
+# The daily per-resource series are laid out as one resources x days matrix, and the baseline is
+# computed for every resource at once:
+#   - median: rolling median / MAD of the previous N days (robust, default)
+#   - ewma:   exponentially weighted mean / deviation
+# A day is flagged when all of these hold:
+#   - the baseline is at least --baseline per day, and the resource had cost on at least half of
+#     the baseline days (sparse / new resources have no usable baseline)
+#   - it is more than --threshold deviations above baseline, with the deviation floored at 10% of
+#     the baseline - flat series have a MAD near 0, so any wiggle would score high otherwise
+#   - the increase is at least --minimum in cost and --ratio of the baseline
+# Each spike is attributed to the service/SKU with the most cost on that resource and day.
+
+# Usage:
+#   python3 oci_cost_anomaly.py -i cost2-data-app-DAILY-2024-03-01-10-00.ndjson.gz
+#   python3 oci_cost_anomaly.py --benchmark
+
+import argparse
+import logging
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Local
+from oci_cost_analytics import UsageFrame
+from oci_report_writer import ReportWriter, read_rows, report_filename
+
+logger = logging.getLogger('oci-cost-anomaly')
+
+# Constants
+DEFAULT_WINDOW = 14
+DEFAULT_THRESHOLD = 4.0
+DEFAULT_MINIMUM = 10.0    # cost per day
+DEFAULT_RATIO = 0.5       # of the baseline
+DEFAULT_BASELINE = 1.0    # cost per day
+SPREAD_FLOOR = 0.1        # deviation floor, fraction of the baseline
+ACTIVE_DAYS = 0.5         # fraction of the baseline days with cost
+MAD_SCALE = 1.4826   # MAD -> standard deviation for normal data
+CHUNK_ROWS = 8192    # resources per block for the rolling median (bounds memory)
+
+
+def daily_matrix(frame: UsageFrame):
+    """Dense resources x days cost matrix - returns (matrix, first day, resource labels)"""
+    codes, labels = frame.categories["resource_id"]
+    days = frame.start.astype("datetime64[D]")
+    first = days.min()
+    offsets = (days - first).astype(np.int64)
+    n_days = int(offsets.max()) + 1
+    flat = np.bincount(codes.astype(np.int64) * n_days + offsets, weights=frame.amount,
+                       minlength=len(labels) * n_days)
+    return flat.reshape(len(labels), n_days), first, labels
+
+
+def _window_median(windows: np.ndarray) -> np.ndarray:
+    # Sorting the short last axis is much faster than np.median's partition for small windows
+    ordered = np.sort(windows, axis=-1)
+    size = ordered.shape[-1]
+    if size % 2:
+        return ordered[..., size // 2]
+    return (ordered[..., size // 2 - 1] + ordered[..., size // 2]) / 2
+
+
+def median_baseline(matrix: np.ndarray, window: int = DEFAULT_WINDOW):
+    """Rolling median and scaled MAD of the previous `window` days (NaN where history is short)"""
+    resources, n_days = matrix.shape
+    center = np.full(matrix.shape, np.nan)
+    spread = np.full(matrix.shape, np.nan)
+    if n_days <= window:
+        return center, spread
+    for begin in range(0, resources, CHUNK_ROWS):
+        block = matrix[begin:begin + CHUNK_ROWS]
+        # Window j covers days j..j+window-1 and is the baseline for day j+window
+        windows = sliding_window_view(block, window, axis=1)[:, :n_days - window]
+        median = _window_median(windows)
+        mad = _window_median(np.abs(windows - median[..., None]))
+        center[begin:begin + CHUNK_ROWS, window:] = median
+        spread[begin:begin + CHUNK_ROWS, window:] = mad * MAD_SCALE
+    return center, spread
+
+
+def ewma_baseline(matrix: np.ndarray, window: int = DEFAULT_WINDOW):
+    """Exponentially weighted mean and deviation of the previous days (span = window)"""
+    alpha = 2.0 / (window + 1)
+    center = np.full(matrix.shape, np.nan)
+    spread = np.full(matrix.shape, np.nan)
+    mean = matrix[:, 0].copy()
+    variance = np.zeros(matrix.shape[0])
+    # One step per day, each step covers every resource
+    for day in range(1, matrix.shape[1]):
+        if day >= window:
+            center[:, day] = mean
+            spread[:, day] = np.sqrt(variance)
+        delta = matrix[:, day] - mean
+        mean += alpha * delta
+        variance = (1 - alpha) * (variance + alpha * delta * delta)
+    return center, spread
+
+
+def active_share(matrix: np.ndarray, window: int = DEFAULT_WINDOW) -> np.ndarray:
+    """Fraction of the previous `window` days with cost (0 where history is short)"""
+    counts = np.cumsum(matrix > 0, axis=1, dtype=np.int32)
+    share = np.zeros(matrix.shape)
+    if matrix.shape[1] > window:
+        share[:, window:] = (counts[:, window - 1:-1] - np.c_[np.zeros((matrix.shape[0], 1), dtype=np.int32),
+                                                                counts[:, :-window - 1]]) / window
+    return share
+
+
+def flag(matrix: np.ndarray, center: np.ndarray, spread: np.ndarray, window: int = DEFAULT_WINDOW,
+         threshold: float = DEFAULT_THRESHOLD, minimum: float = DEFAULT_MINIMUM, ratio: float = DEFAULT_RATIO,
+         baseline: float = DEFAULT_BASELINE):
+    """(score, flagged) matrices - see the rules in the header"""
+    excess = matrix - center
+    with np.errstate(invalid="ignore", divide="ignore"):
+        score = excess / np.maximum(spread, SPREAD_FLOOR * center)
+        flagged = (center >= baseline) & (active_share(matrix, window) >= ACTIVE_DAYS) & \
+            (score > threshold) & (excess >= np.maximum(minimum, ratio * center))
+    return score, flagged
+
+
+def detect(frame: UsageFrame, method: str = "median", window: int = DEFAULT_WINDOW,
+           threshold: float = DEFAULT_THRESHOLD, minimum: float = DEFAULT_MINIMUM, ratio: float = DEFAULT_RATIO,
+           baseline: float = DEFAULT_BASELINE) -> list:
+    """Return flagged (resource, day) spikes with service/SKU attribution, largest first"""
+    matrix, first, labels = daily_matrix(frame)
+    if method == "ewma":
+        center, spread = ewma_baseline(matrix, window)
+    else:
+        center, spread = median_baseline(matrix, window)
+
+    score, flagged = flag(matrix, center, spread, window, threshold, minimum, ratio, baseline)
+    resource_idx, day_idx = np.nonzero(flagged)
+    logger.info(f"Flagged {len(resource_idx)} spikes over {matrix.shape[0]} resources x {matrix.shape[1]} days")
+    if not len(resource_idx):
+        return []
+
+    # Attribution - top service/SKU for each flagged cell, from the original rows
+    n_days = matrix.shape[1]
+    row_cell = frame.categories["resource_id"][0].astype(np.int64) * n_days + \
+        (frame.start.astype("datetime64[D]") - first).astype(np.int64)
+    flagged_cells = resource_idx.astype(np.int64) * n_days + day_idx
+    in_flagged = np.isin(row_cell, flagged_cells)
+    sku_codes, sku_labels = frame.categories["sku_name"]
+    service_codes, service_labels = frame.categories["service"]
+    cell_rows = np.nonzero(in_flagged)[0]
+    # Sort rows by cell then amount so the last row for each cell is its top SKU
+    order = np.lexsort((frame.amount[cell_rows], row_cell[cell_rows]))
+    cell_rows = cell_rows[order]
+    cells = row_cell[cell_rows]
+    last_of_cell = np.r_[cells[1:] != cells[:-1], True]
+    top_rows = dict(zip(cells[last_of_cell].tolist(), cell_rows[last_of_cell].tolist()))
+
+    anomalies = []
+    for r, d, cell in zip(resource_idx.tolist(), day_idx.tolist(), flagged_cells.tolist()):
+        top = top_rows.get(cell)
+        anomalies.append({
+            "identifier": labels[r],
+            "day": str(first + d),
+            "amount": float(matrix[r, d]),
+            "baseline": float(center[r, d]),
+            "score": float(score[r, d]),
+            "service": service_labels[service_codes[top]] if top is not None else None,
+            "sku_name": sku_labels[sku_codes[top]] if top is not None else None,
+            "sku_amount": float(frame.amount[top]) if top is not None else None
+        })
+    anomalies.sort(key=lambda a: a["amount"] - a["baseline"], reverse=True)
+    return anomalies
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-i", "--input", help="Streamed DAILY tag cost report (ndjson/csv/parquet, may be compressed)")
+    parser.add_argument("-m", "--method", help="Baseline: median (MAD) or ewma", choices=["median", "ewma"], default="median")
+    parser.add_argument("-w", "--window", help=f"Baseline days (def={DEFAULT_WINDOW})", type=int, default=DEFAULT_WINDOW)
+    parser.add_argument("-t", "--threshold", help=f"Deviations above baseline to flag (def={DEFAULT_THRESHOLD})", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("-min", "--minimum", help=f"Minimum cost increase per day to flag (def={DEFAULT_MINIMUM})", type=float, default=DEFAULT_MINIMUM)
+    parser.add_argument("-r", "--ratio", help=f"Minimum increase as a fraction of the baseline (def={DEFAULT_RATIO})", type=float, default=DEFAULT_RATIO)
+    parser.add_argument("-b", "--baseline", help=f"Minimum baseline cost per day to flag (def={DEFAULT_BASELINE})", type=float, default=DEFAULT_BASELINE)
+    parser.add_argument("-f", "--format", help="Write anomalies to ndjson/csv instead of printing", choices=["ndjson", "csv"])
+    parser.add_argument("--benchmark", help="Time detection on synthetic 100k resources x 90 days", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    if args.benchmark:
+        # Steady resources from cents to hundreds a day with 5% noise, a fifth of them only used
+        # on some days, and 500 injected 10x spikes
+        rng = np.random.default_rng(7)
+        resources, days = 100000, 90
+        matrix = rng.lognormal(1.5, 1.5, (resources, 1)) * rng.normal(1.0, 0.05, (resources, days)).clip(0)
+        sparse = rng.random(resources) < 0.2
+        matrix[sparse] *= rng.random((int(sparse.sum()), days)) < 0.3
+        spikes = (rng.choice(resources, 500, replace=False), rng.integers(30, days, 500))
+        matrix[spikes] = (matrix[spikes] + 5.0) * 10
+        for method, function in (("median", median_baseline), ("ewma", ewma_baseline)):
+            start = time.perf_counter()
+            center, spread = function(matrix, args.window)
+            _, flagged = flag(matrix, center, spread, args.window, args.threshold, args.minimum, args.ratio, args.baseline)
+            logger.info(f"{method}: {time.perf_counter() - start:.2f}s for {matrix.shape}, {int(flagged.sum())} flagged, "
+                        f"{int(flagged[spikes].sum())} of 500 injected spikes")
+        exit(0)
+
+    if not args.input:
+        parser.error("-i/--input is required (or use --benchmark)")
+
+    frame = UsageFrame.from_rows(row for row in read_rows(args.input) if row.get("type", "cost") == "cost")
+    logger.info(f"Loaded {len(frame)} cost rows from {args.input}")
+    anomalies = detect(frame, method=args.method, window=args.window, threshold=args.threshold, minimum=args.minimum,
+                       ratio=args.ratio, baseline=args.baseline)
+
+    if args.format:
+        filename = report_filename(f"cost-anomalies-{time.strftime('%Y-%m-%d-%H-%M')}", args.format)
+        with ReportWriter(filename, format=args.format) as writer:
+            writer.write_rows(anomalies)
+        logger.info(f"Wrote {len(anomalies)} anomalies to {filename}")
+    else:
+        for a in anomalies:
+            print(f'{a["day"]} {a["identifier"]} ${a["amount"]:.2f} (baseline ${a["baseline"]:.2f}, score {a["score"]:.1f}) '
+                  f'top: {a["service"]}/{a["sku_name"]} ${a["sku_amount"]:.2f}')
@@ -0,0 +1,198 @@
+# OCI Cost Tag Rollup
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Cost per tag (namespace, key, value) for ALL tags at once.
+#
+# Instead of one filtered Usage API run per tag value (oci-cost-resource-tags.py,
+# oci-cost-report-by-tag-per-resource2.py), this does:
+# 1) One unfiltered Usage API query grouped by resourceId
+# 2) One Resource Search sweep of all resources in every subscribed region -> map of resource to
+#    tags (search snapshots with a TTL, shared with the fleet scripts - oci_search_cache.py).  The
+#    Usage API cost covers all regions, so a home region sweep alone would report the rest as deleted
+# 3) A vectorized join - every resource cost is added to each of its tags
+#
+# Special values:
+#   (not set)  - cost of resources that exist but do not carry this namespace/key (the cost of
+#                existing resources minus the key's values - deleted / no resource are not in it)
+#   (untagged) - resources with no tags at all
+#   (deleted)  - cost for resources that search no longer returns
+#   (no resource) - cost not tied to a resource OCID
+
+# Usage: python3 oci_cost_tag_rollup.py -sd 2024-03-01 -ed 2024-04-01 [-tn Namespace] [-f csv]
+
+from oci import config
+from oci import pagination
+from oci.retry import DEFAULT_RETRY_STRATEGY
+from oci.usage_api import UsageapiClient
+from oci.usage_api.models import RequestSummarizedUsagesDetails
+from oci.resource_search import ResourceSearchClient
+from oci.exceptions import ConfigFileNotFound
+from oci.auth.signers import InstancePrincipalsSecurityTokenSigner
+
+import argparse
+import datetime
+import logging
+
+import numpy as np
+
+# Local
+from oci_cost_analytics import UsageFrame
+from oci_region_fanout import RegionClients
+from oci_report_writer import ReportWriter, report_filename
+from oci_search_cache import SearchCache, cache_filename
+
+logger = logging.getLogger('oci-cost-tag-rollup')
+
+# Constants
+FREEFORM_NAMESPACE = "(freeform)"
+NOT_SET = "(not set)"
+UNTAGGED = "(untagged)"
+DELETED = "(deleted)"
+NO_RESOURCE = "(no resource)"
+DEFAULT_CACHE_TTL = 3600
+
+
+def load_resource_tags(clients: RegionClients, regions: list, use_cache: bool = True,
+                       ttl: int = DEFAULT_CACHE_TTL) -> dict:
+    """Map of resource OCID -> list of [namespace, key, value], from one search sweep per region (cached)"""
+    cache = SearchCache(cache_filename(clients.tenancy_id), ttl=ttl, refresh=not use_cache)
+    resources = []
+    for region in regions:
+        found = cache.search(clients.client(ResourceSearchClient, region), "query all resources")
+        logger.debug(f"{region}: {len(found)} resources")
+        resources.extend(found)
+
+    resource_tags = {}
+    for resource in resources:
+        tags = []
+        for namespace, keys in (resource.defined_tags or {}).items():
+            for key, value in keys.items():
+                tags.append([namespace, key, str(value)])
+        for key, value in (resource.freeform_tags or {}).items():
+            tags.append([FREEFORM_NAMESPACE, key, str(value)])
+        resource_tags[resource.identifier] = tags
+    logger.info(f"Search returned {len(resource_tags)} resources in {len(regions)} regions")
+    return resource_tags
+
+
+def fetch_costs(usage_client: UsageapiClient, tenancy_ocid: str, start_date: str, end_date: str) -> UsageFrame:
+    """One unfiltered cost query for the period, grouped by resource and service"""
+    cost_query = RequestSummarizedUsagesDetails(
+        tenant_id=tenancy_ocid,
+        query_type=RequestSummarizedUsagesDetails.QUERY_TYPE_COST,
+        compartment_depth=6.0,
+        time_usage_started=start_date,
+        time_usage_ended=end_date,
+        is_aggregate_by_time=True,
+        granularity=RequestSummarizedUsagesDetails.GRANULARITY_MONTHLY,
+        group_by=["resourceId", "service"]
+    )
+    items = pagination.list_call_get_all_results(
+        usage_client.request_summarized_usages,
+        request_summarized_usages_details=cost_query
+    ).data
+    logger.info(f"Usage API returned {len(items)} cost rows")
+    return UsageFrame.from_usage_items(items)
+
+
+def rollup(frame: UsageFrame, resource_tags: dict, namespace: str = None) -> list:
+    """Cost per (namespace, key, value) for every tag - returns rows sorted by namespace/key, cost desc"""
+    resource_codes, resource_labels = frame.categories["resource_id"]
+    resource_cost = np.bincount(resource_codes, weights=frame.amount, minlength=len(resource_labels))
+    total = float(resource_cost.sum())
+
+    # Incidence list: (resource code, tag code) for each tag a costed resource carries
+    tag_index = {}
+    pair_resource = []
+    pair_tag = []
+    untagged = 0.0
+    deleted = 0.0
+    no_resource = 0.0
+    for code, resource_id in enumerate(resource_labels):
+        if not resource_id:
+            no_resource += float(resource_cost[code])
+            continue
+        tags = resource_tags.get(resource_id)
+        if tags is None:
+            deleted += float(resource_cost[code])
+            continue
+        if not tags:
+            untagged += float(resource_cost[code])
+        for ns, key, value in tags:
+            if namespace and ns != namespace:
+                continue
+            tag = (ns, key, value)
+            pair_resource.append(code)
+            pair_tag.append(tag_index.setdefault(tag, len(tag_index)))
+
+    pair_resource = np.asarray(pair_resource, dtype=np.int64)
+    pair_tag = np.asarray(pair_tag, dtype=np.int64)
+    tag_cost = np.bincount(pair_tag, weights=resource_cost[pair_resource], minlength=len(tag_index))
+    tags = list(tag_index)
+
+    # Cost covered by each namespace/key, to derive "(not set)"
+    key_index = {}
+    tag_key = np.asarray([key_index.setdefault((ns, key), len(key_index)) for ns, key, _ in tags], dtype=np.int64)
+    key_cost = np.bincount(tag_key, weights=tag_cost, minlength=len(key_index))
+
+    rows = [{"namespace": ns, "key": key, "value": value, "cost": float(cost)}
+            for (ns, key, value), cost in zip(tags, tag_cost.tolist())]
+    # Only resources that still exist can be missing a key
+    existing = total - deleted - no_resource
+    for (ns, key), covered in zip(key_index, key_cost.tolist()):
+        rows.append({"namespace": ns, "key": key, "value": NOT_SET, "cost": existing - covered})
+    rows.append({"namespace": "", "key": "", "value": UNTAGGED, "cost": untagged})
+    rows.append({"namespace": "", "key": "", "value": DELETED, "cost": deleted})
+    rows.append({"namespace": "", "key": "", "value": NO_RESOURCE, "cost": no_resource})
+    rows.sort(key=lambda r: (r["namespace"], r["key"], -r["cost"]))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-pr", "--profile", help="Config Profile, named", default="DEFAULT")
+    parser.add_argument("-ip", "--instanceprincipal", help="Use Instance Principal Auth - negates --profile", action="store_true")
+    parser.add_argument("-sd", "--startdate", help="Start Date YYYY-MM-DD", required=True)
+    parser.add_argument("-ed", "--enddate", help="End Date YYYY-MM-DD (give next day to include previous day)", required=True)
+    parser.add_argument("-tn", "--tagns", help="Only roll up this tag namespace")
+    parser.add_argument("-c", "--nocache", help="Ignore cached resource tags", action="store_true")
+    parser.add_argument("-f", "--format", help="Write rollup to ndjson/csv/parquet instead of printing", choices=["ndjson", "csv", "parquet"])
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    if args.instanceprincipal:
+        logger.info("Using Instance Principal Authentication")
+        signer = InstancePrincipalsSecurityTokenSigner()
+        usage_client = UsageapiClient(config={}, signer=signer, retry_strategy=DEFAULT_RETRY_STRATEGY)
+        clients = RegionClients({}, signer)
+    else:
+        try:
+            logger.info(f"Using Profile Authentication: {args.profile}")
+            config = config.from_file(profile_name=args.profile)
+            usage_client = UsageapiClient(config, retry_strategy=DEFAULT_RETRY_STRATEGY)
+            clients = RegionClients(config)
+        except ConfigFileNotFound as exc:
+            logger.fatal(f"Unable to use Profile Authentication: {exc}")
+            exit(1)
+    tenancy_ocid = clients.tenancy_id
+
+    frame = fetch_costs(usage_client, tenancy_ocid, f"{args.startdate}T00:00:00Z", f"{args.enddate}T00:00:00Z")
+    resource_tags = load_resource_tags(clients, clients.subscribed_regions(), use_cache=not args.nocache)
+    rows = rollup(frame, resource_tags, namespace=args.tagns)
+    logger.info(f"Total cost: {frame.total():.2f} across {len(rows)} tag values")
+
+    if args.format:
+        datestring = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")
+        filename = report_filename(f"cost-tag-rollup-{args.startdate}-{args.enddate}-{datestring}", args.format)
+        with ReportWriter(filename, format=args.format, fields=["namespace", "key", "value", "cost"]) as writer:
+            writer.write_rows(rows)
+        logger.info(f"Script complete - wrote {args.format} to {filename}.")
+    else:
+        for row in rows:
+            print(f'{row["namespace"]}.{row["key"]} = {row["value"]}: ${row["cost"]:.2f}')
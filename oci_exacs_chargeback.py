@@ -0,0 +1,225 @@
+# OCI ExaCS Chargeback
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Apportions the cost of an ExaCS VM cluster (and its part of the infrastructure) to the databases on it.
+#
+# 1) List the databases on the VM cluster
+# 2) Pull StorageUsed and CpuUtilization for ALL databases with batched metric queries (no
+#    per-database calls, no sleeps - see oci_metric_batch.py)
+# 3) Pull the cluster + infrastructure cost for the same period from the Usage API.  The
+#    infrastructure is shared by its VM clusters, so only this cluster's share of it (allocated
+#    cores, or storage if cores are not known) is charged - -ni leaves it out altogether
+# 4) Each database gets a blended share:  cpu_weight * CPU share + (1 - cpu_weight) * storage share,
+#    where CPU is utilization % x the database's cpu_count (DB Management, else the cluster's cores)
+#    and cost is also rolled up by a database tag (namespace/key) if given
+
+# Usage: python3 oci_exacs_chargeback.py -c <compartment> -vmc <vm cluster ocid> [-d 30] [-tn ns -tk key] [-f csv]
+
+from oci import config
+from oci import pagination
+from oci.retry import DEFAULT_RETRY_STRATEGY
+from oci.database import DatabaseClient
+from oci.database_management import DbManagementClient
+from oci.monitoring import MonitoringClient
+from oci.usage_api import UsageapiClient
+from oci.usage_api.models import RequestSummarizedUsagesDetails, Filter, Dimension
+from oci.exceptions import ServiceError, ConfigFileNotFound
+
+import argparse
+import datetime
+import logging
+
+import numpy as np
+
+# Local
+from oci_metric_batch import MetricBatcher
+from oci_metric_stats import mean_by_resource
+from oci_report_writer import ReportWriter, report_filename
+
+logger = logging.getLogger('oci-exacs-chargeback')
+
+# Constants
+DATABASE_NAMESPACE = "oci_database"
+DEFAULT_CPU_WEIGHT = 0.5
+UNTAGGED = "(untagged)"
+CPU_PARAMETER = "cpu_count"
+
+
+def fetch_metric_by_database(metric_batcher: MetricBatcher, compartment_id: str, metric: str, database_ids: list,
+                             start_time: datetime.datetime, end_time: datetime.datetime,
+                             namespace: str = DATABASE_NAMESPACE) -> dict:
+    """Batched query for the cluster databases - returns {database OCID: mean value}"""
+    series = metric_batcher.fetch(compartment_id, namespace, metric, "1d", "mean", start_time, end_time,
+                                  dimension="resourceId_database", resource_ids=database_ids)
+    return mean_by_resource(series, first_only=False)
+
+
+def fetch_cpu_counts(dbm_client: DbManagementClient, database_ids: list, default: float = None) -> dict:
+    """cpu_count per database OCID (lower case) from DB Management - default where it is not available"""
+    cpu_counts = {}
+    for database_id in database_ids:
+        cpu_counts[database_id.lower()] = default
+        try:
+            parameters = dbm_client.list_database_parameters(managed_database_id=database_id, name=CPU_PARAMETER).data
+            if parameters and parameters.items:
+                cpu_counts[database_id.lower()] = float(parameters.items[0].value)
+        except ServiceError as exc:
+            logger.debug(f"No {CPU_PARAMETER} for {database_id}: {exc.status}, {exc.message}")
+    return cpu_counts
+
+
+def fetch_resource_costs(usage_client: UsageapiClient, tenancy_ocid: str, resource_ids: list,
+                         start_time: datetime.datetime, end_time: datetime.datetime) -> dict:
+    """Cost per resource OCID (lower case) over the period"""
+    items = pagination.list_call_get_all_results(
+        usage_client.request_summarized_usages,
+        request_summarized_usages_details=RequestSummarizedUsagesDetails(
+            tenant_id=tenancy_ocid,
+            query_type=RequestSummarizedUsagesDetails.QUERY_TYPE_COST,
+            # Usage API wants whole days
+            time_usage_started=start_time.strftime("%Y-%m-%dT00:00:00Z"),
+            time_usage_ended=end_time.strftime("%Y-%m-%dT00:00:00Z"),
+            granularity=RequestSummarizedUsagesDetails.GRANULARITY_DAILY,
+            is_aggregate_by_time=True,
+            group_by=["resourceId"],
+            filter=Filter(
+                dimensions=[Dimension(key="resourceId", value=r) for r in resource_ids],
+                operator=Filter.OPERATOR_OR
+            )
+        )
+    ).data
+    costs = {r.lower(): 0.0 for r in resource_ids}
+    for item in items:
+        if item.resource_id:
+            costs[item.resource_id.lower()] = costs.get(item.resource_id.lower(), 0.0) + (item.computed_amount or 0.0)
+    return costs
+
+
+def infrastructure_share(vm_cluster, infrastructure) -> float:
+    """This cluster's part of the shared Exadata infrastructure - by allocated cores (storage if cores are not known)"""
+    if infrastructure.cpu_count and vm_cluster.cpu_core_count:
+        return min(1.0, vm_cluster.cpu_core_count / infrastructure.cpu_count)
+    if infrastructure.data_storage_size_in_tbs and vm_cluster.storage_size_in_gbs:
+        return min(1.0, vm_cluster.storage_size_in_gbs / (infrastructure.data_storage_size_in_tbs * 1024))
+    logger.warning(f"No core or storage sizes for {infrastructure.display_name} - its cost is left out")
+    return 0.0
+
+
+def allocate(databases: list, storage: dict, cpu: dict, total_cost: float, cpu_weight: float = DEFAULT_CPU_WEIGHT,
+             tag_ns: str = None, tag_key: str = None, cpu_counts: dict = None) -> tuple:
+    """Apportion total_cost across databases - returns (per-database rows, per-tag rows)
+
+    cpu is utilization in %, weighted by cpu_counts (same count for all if not given)."""
+    ids = [db.id.lower() for db in databases]
+    storage_used = np.array([storage.get(i, 0.0) for i in ids])
+    cpu_percent = np.array([cpu.get(i, 0.0) for i in ids])
+    cpu_count = np.array([(cpu_counts or {}).get(i) or 1.0 for i in ids], dtype=np.float64)
+    # CPUs actually used - 50% of 24 CPUs is 6x 50% of 2
+    cpu_used = cpu_percent / 100.0 * cpu_count
+
+    # Shares - if a metric is missing for everything, fall back to the other (or even split)
+    storage_share = storage_used / storage_used.sum() if storage_used.sum() > 0 else None
+    cpu_share = cpu_used / cpu_used.sum() if cpu_used.sum() > 0 else None
+    if storage_share is None and cpu_share is None:
+        share = np.full(len(ids), 1.0 / len(ids)) if ids else np.zeros(0)
+    elif storage_share is None:
+        share = cpu_share
+    elif cpu_share is None:
+        share = storage_share
+    else:
+        share = cpu_weight * cpu_share + (1 - cpu_weight) * storage_share
+    cost = share * total_cost
+
+    rows = []
+    tag_totals = {}
+    for db, s, c, n, sh, amount in zip(databases, storage_used.tolist(), cpu_percent.tolist(), cpu_count.tolist(),
+                                       share.tolist(), cost.tolist()):
+        tag_value = (db.defined_tags or {}).get(tag_ns, {}).get(tag_key, UNTAGGED) if tag_ns else None
+        rows.append({"database_id": db.id, "db_unique_name": db.db_unique_name, "lifecycle_state": db.lifecycle_state,
+                     "tag": tag_value, "storage_used_gb": s, "cpu_utilization": c, "cpu_count": n, "share": sh,
+                     "cost": amount})
+        if tag_ns:
+            tag_totals[tag_value] = tag_totals.get(tag_value, 0.0) + amount
+    tag_rows = [{"tag": t, "cost": c} for t, c in sorted(tag_totals.items(), key=lambda i: -i[1])]
+    return rows, tag_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-pr", "--profile", help="Config Profile, named", default="DEFAULT")
+    parser.add_argument("-c", "--compartmentocid", help="Database Compartment OCID", required=True)
+    parser.add_argument("-vmc", "--vmclusterocid", help="Cloud VM Cluster OCID", required=True)
+    parser.add_argument("-d", "--days", help="Days of metrics and cost to allocate (def=30)", type=int, default=30)
+    parser.add_argument("-w", "--cpuweight", help=f"Weight of CPU vs storage share (def={DEFAULT_CPU_WEIGHT})", type=float, default=DEFAULT_CPU_WEIGHT)
+    parser.add_argument("-ni", "--noinfra", help="Leave the Exadata infrastructure cost out (cluster cost only)", action="store_true")
+    parser.add_argument("-tn", "--tagns", help="Database tag namespace to roll up by")
+    parser.add_argument("-tk", "--tagkey", help="Database tag key to roll up by")
+    parser.add_argument("-f", "--format", help="Write chargeback to ndjson/csv/parquet instead of printing", choices=["ndjson", "csv", "parquet"])
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    try:
+        logger.info(f"Using Profile Authentication: {args.profile}")
+        config = config.from_file(profile_name=args.profile)
+    except ConfigFileNotFound as exc:
+        logger.fatal(f"Unable to use Profile Authentication: {exc}")
+        exit(1)
+
+    database_client = DatabaseClient(config, retry_strategy=DEFAULT_RETRY_STRATEGY)
+    monitoring_client = MonitoringClient(config, retry_strategy=DEFAULT_RETRY_STRATEGY)
+    usage_client = UsageapiClient(config, retry_strategy=DEFAULT_RETRY_STRATEGY)
+    dbm_client = DbManagementClient(config, retry_strategy=DEFAULT_RETRY_STRATEGY)
+
+    end_time = datetime.datetime.now(datetime.timezone.utc)
+    start_time = end_time - datetime.timedelta(days=args.days)
+
+    try:
+        vm_cluster = database_client.get_cloud_vm_cluster(cloud_vm_cluster_id=args.vmclusterocid).data
+        databases = pagination.list_call_get_all_results(
+            database_client.list_databases,
+            compartment_id=args.compartmentocid,
+            system_id=vm_cluster.id
+        ).data
+        logger.info(f"VM Cluster: {vm_cluster.display_name} Databases: {len(databases)}")
+
+        # One batched query per metric for the databases on the cluster
+        metric_batcher = MetricBatcher(monitoring_client)
+        database_ids = [db.id for db in databases]
+        storage = fetch_metric_by_database(metric_batcher, args.compartmentocid, "StorageUsed", database_ids, start_time, end_time)
+        cpu = fetch_metric_by_database(metric_batcher, args.compartmentocid, "CpuUtilization", database_ids, start_time, end_time)
+        cpu_counts = fetch_cpu_counts(dbm_client, database_ids, default=vm_cluster.cpu_core_count)
+        infrastructure_id = vm_cluster.cloud_exadata_infrastructure_id
+        costs = fetch_resource_costs(usage_client, config["tenancy"], [vm_cluster.id, infrastructure_id], start_time, end_time)
+        total_cost = costs[vm_cluster.id.lower()]
+        if not args.noinfra:
+            # Shared by every VM cluster on it - charge this cluster's share only
+            infrastructure = database_client.get_cloud_exadata_infrastructure(cloud_exadata_infrastructure_id=infrastructure_id).data
+            share = infrastructure_share(vm_cluster, infrastructure)
+            total_cost += costs[infrastructure_id.lower()] * share
+            logger.info(f"Infrastructure {infrastructure.display_name}: {costs[infrastructure_id.lower()]:.2f}, {share:.1%} to this cluster")
+        logger.info(f"Cluster cost for {args.days} days: {total_cost:.2f}")
+    except ServiceError as exc:
+        logger.error(f"Failed to get details for {args.vmclusterocid}: {exc}")
+        exit(1)
+
+    rows, tag_rows = allocate(databases, storage, cpu, total_cost, cpu_weight=args.cpuweight,
+                              tag_ns=args.tagns, tag_key=args.tagkey, cpu_counts=cpu_counts)
+
+    if args.format:
+        datestring = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")
+        filename = report_filename(f"exacs-chargeback-{vm_cluster.display_name}-{datestring}", args.format)
+        with ReportWriter(filename, format=args.format) as writer:
+            writer.write_rows(rows)
+        logger.info(f"Script complete - wrote {args.format} to {filename}.")
+    else:
+        for row in rows:
+            print(f'{row["db_unique_name"]}: storage {row["storage_used_gb"]:.2f} GB cpu {row["cpu_utilization"]:.1f}% of {row["cpu_count"]:g} '
+                  f'share {row["share"] * 100:.1f}% cost ${row["cost"]:.2f}')
+    for row in tag_rows:
+        print(f'Tag {args.tagns}.{args.tagkey}={row["tag"]}: ${row["cost"]:.2f}')
@@ -0,0 +1,126 @@
+# OCI ExaCS PDB Inventory
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Builds the PDB -> CDB -> VM cluster inventory used by oci-exacs-pdb-report-csv.py.
+#
+# Dozens of PDBs share one CDB and one VM cluster, so fetching both for every PDB repeats the
+# same GETs over and over.  This module:
+# 1) Lists ALL pluggable databases in the compartment (paginated - no limit=100 cut off)
+# 2) Fetches each distinct CDB (get_database), VM cluster (get_cloud_vm_cluster) and CDB
+#    cpu_min_count ONCE, through memoized fetchers that run concurrently in a lookup pool
+# 3) Runs the per-PDB DB Management parameter call in a bounded worker pool
+# 4) Yields one row per PDB as soon as it is complete
+
+# Usage:
+#   inventory = PdbInventory(database_client, dbm_client, threads=8)
+#   for row in inventory.rows(comp_ocid):
+#       row["VMC_NAME"], row["CDB_NAME"], row["PDB_NAME"], row["MIN_CPU_PDB"]
+
+import logging
+import threading
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from oci import pagination
+from oci.database import DatabaseClient
+from oci.database_management import DbManagementClient
+from oci.exceptions import ServiceError
+
+logger = logging.getLogger('oci-exacs-inventory')
+
+# Constants
+DEFAULT_THREADS = 8
+LOOKUP_THREADS = 4
+CPU_PARAMETER = "cpu_min_count"
+
+
+class Memoizer:
+    """Run fetch(key) at most once per key on an executor - every caller gets the same Future"""
+
+    def __init__(self, executor: ThreadPoolExecutor, fetch):
+        self.executor = executor
+        self.fetch = fetch
+        self.calls = 0
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Future:
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                self.calls += 1
+                future = self.executor.submit(self.fetch, key)
+                self._futures[key] = future
+            return future
+
+
+class PdbInventory:
+    """PDB rows with their CDB, VM cluster, storage and cpu_min_count"""
+
+    def __init__(self, database_client: DatabaseClient, dbm_client: DbManagementClient, threads: int = DEFAULT_THREADS):
+        self.database_client = database_client
+        self.dbm_client = dbm_client
+        self.threads = threads
+        # PDBs the last rows() call could not build a row for
+        self.failed = []
+
+    def list_pdbs(self, compartment_id: str) -> list:
+        return pagination.list_call_get_all_results(
+            self.database_client.list_pluggable_databases,
+            compartment_id=compartment_id
+        ).data
+
+    def cpu_min_count(self, managed_database_id: str) -> float:
+        """cpu_min_count from DB Management (None if not managed or not set)"""
+        try:
+            parameters = self.dbm_client.list_database_parameters(
+                managed_database_id=managed_database_id,
+                name=CPU_PARAMETER
+            ).data
+            if parameters and parameters.items:
+                return float(parameters.items[0].value)
+        except ServiceError as exc:
+            logger.warning(f"Failed to get {CPU_PARAMETER} for {managed_database_id}: {exc.status}, {exc.message}")
+        return None
+
+    def _row(self, pdb, cdbs: Memoizer, clusters: Memoizer, cdb_cpu: Memoizer, storage_used_by_id: dict) -> dict:
+        cdb = cdbs.get(pdb.container_database_id).result()
+        vm_cluster = clusters.get(cdb.vm_cluster_id).result()
+        pdb_cpu_count = self.cpu_min_count(pdb.id)
+        cdb_cpu_count = cdb_cpu.get(cdb.id).result()
+        return {"VMC_OCID": vm_cluster.id, "VMC_NAME": vm_cluster.display_name,
+                "CDB_OCID": cdb.id, "CDB_NAME": cdb.db_unique_name, "CDB_LIFECYCLE": cdb.lifecycle_state,
+                "STORAGE_CDB": storage_used_by_id.get(cdb.id.lower(), -1), "MIN_CPU_CDB": cdb_cpu_count,
+                "PDB_OCID": pdb.id, "PDB_NAME": pdb.pdb_name, "PDB_STORAGE": storage_used_by_id.get(pdb.id.lower(), -1),
+                "MIN_CPU_PDB": pdb_cpu_count, "PDB_OPEN_MODE": pdb.open_mode}
+
+    def rows(self, compartment_id: str, storage_used_by_id: dict = None, pdbs: list = None):
+        """Generator of PDB rows in completion order
+
+        Failed PDBs are logged, skipped and listed in self.failed - callers must not treat the run as complete."""
+        pdbs = self.list_pdbs(compartment_id) if pdbs is None else pdbs
+        self.failed = []
+        storage_used_by_id = storage_used_by_id or {}
+        logger.info(f"PDBs: {len(pdbs)}")
+
+        # Lookups never wait on anything, so workers can safely block on their futures
+        with ThreadPoolExecutor(max_workers=LOOKUP_THREADS, thread_name_prefix="lookup") as lookup_pool, \
+                ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="pdb") as pdb_pool:
+            cdbs = Memoizer(lookup_pool, lambda i: self.database_client.get_database(database_id=i).data)
+            clusters = Memoizer(lookup_pool, lambda i: self.database_client.get_cloud_vm_cluster(cloud_vm_cluster_id=i).data)
+            cdb_cpu = Memoizer(lookup_pool, self.cpu_min_count)
+
+            pending = {pdb_pool.submit(self._row, pdb, cdbs, clusters, cdb_cpu, storage_used_by_id): pdb for pdb in pdbs}
+            for future in futures.as_completed(pending):
+                try:
+                    yield future.result()
+                except ServiceError as exc:
+                    logger.error(f"PDB {pending[future].pdb_name}: {exc.status}, {exc.message}")
+                    self.failed.append(pending[future])
+                except Exception as exc:
+                    # Timeouts and connection errors from the SDK are not ServiceErrors
+                    logger.error(f"PDB {pending[future].pdb_name}: {exc!r}")
+                    self.failed.append(pending[future])
+            logger.info(f"Fetched {cdbs.calls} CDB(s), {clusters.calls} VM cluster(s) for {len(pdbs)} PDB(s), "
+                        f"{len(self.failed)} failed")
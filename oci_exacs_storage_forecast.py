@@ -0,0 +1,216 @@
+# OCI ExaCS Storage Forecast
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Projects when ExaCS VM clusters (ASM DATA disk group) and their databases will run out of storage.
+#
+# oci-analyze-exacs-costs-by-database.py reads one ASMDiskgroupUtilization point and sums StorageUsed.
+# This script looks at the trend instead, for every rack in the compartment in one run:
+# 1) List the VM clusters (every rack) and their databases in the compartment
+# 2) Pull up to 90 days (all Monitoring keeps) of daily ASMDiskgroupUtilization (per cluster) and StorageUsed (per CDB) with
+#    batched metric queries (oci_metric_batch.py)
+# 3) Put every series on one daily grid and fit all of them at once (oci_metric_stats.linear_fit):
+#    linear trend, optionally with a weekly (day-of-week) pattern removed first
+# 4) Cluster days-to-full = (100% - current %) / growth per day
+#    Database days-to-full = cluster free GB / database growth per day (if it alone kept growing)
+
+# Usage: python3 oci_exacs_storage_forecast.py -c <compartment> [-d 90] [-ns] [-f csv]
+
+from oci import config
+from oci import pagination
+from oci.retry import DEFAULT_RETRY_STRATEGY
+from oci.database import DatabaseClient
+from oci.monitoring import MonitoringClient
+from oci.exceptions import ServiceError, ConfigFileNotFound
+
+import argparse
+import datetime
+import logging
+
+import numpy as np
+
+# Local
+from oci_metric_batch import MetricBatcher
+from oci_metric_stats import align, linear_fit
+from oci_monitoring_query import MonitoringQuery
+from oci_report_writer import ReportWriter, report_filename
+
+logger = logging.getLogger('oci-exacs-storage-forecast')
+
+# Constants
+DAY_SECONDS = 86400
+DEFAULT_DAYS = 90
+MAX_DAYS = 90                      # Monitoring retains 90 days of metric data
+DEFAULT_DISKGROUP = "ora.datac1.dg"
+MIN_SEASONAL_DAYS = 21             # need 3 weeks before a day-of-week pattern means anything
+
+
+def fit_trend(values: np.ndarray, grid: np.ndarray, seasonal: bool = True) -> tuple:
+    """(growth per day, current level) for every row of a (series x day) matrix
+
+    With seasonal, the linear fit is done, the mean residual per day-of-week is removed from the
+    series, and the line is fitted again - so weekly batch/purge cycles do not skew the slope."""
+    days = grid / DAY_SECONDS
+    slope, intercept = linear_fit(values, days)
+    if seasonal and len(grid):
+        weekday = (grid // DAY_SECONDS + 3) % 7          # 1970-01-01 was a Thursday -> Monday = 0
+        residual = values - (intercept[:, None] + slope[:, None] * days[None, :])
+        observed = ~np.isnan(residual)
+        weekday_sum = np.zeros((len(values), 7))
+        weekday_count = np.zeros((len(values), 7))
+        np.add.at(weekday_sum.T, weekday, np.where(observed, residual, 0).T)
+        np.add.at(weekday_count.T, weekday, observed.T)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pattern = np.nan_to_num(weekday_sum / weekday_count)
+        enough = observed.sum(axis=1) >= MIN_SEASONAL_DAYS
+        adjusted = np.where(enough[:, None], values - pattern[:, weekday], values)
+        slope, intercept = linear_fit(adjusted, days)
+    level = intercept + slope * days[-1] if len(grid) else np.full(len(values), np.nan)
+    return slope, level
+
+
+def days_to_full(remaining: np.ndarray, growth_per_day: np.ndarray) -> np.ndarray:
+    """Days until remaining is used up at growth_per_day (inf when flat or shrinking, NaN without data)"""
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result = np.where(growth_per_day > 0, np.maximum(remaining, 0) / growth_per_day, np.inf)
+    return np.where(np.isnan(growth_per_day) | np.isnan(remaining), np.nan, result)
+
+
+def series_matrix(series_by_resource: dict, resource_ids: list) -> tuple:
+    """(daily grid, resources x days) - several streams for one resource (e.g. per node) are combined with max"""
+    series_list = []
+    owners = []
+    for row, resource_id in enumerate(resource_ids):
+        for series in MonitoringQuery.stitch([series_by_resource.get(resource_id.lower(), [])]):
+            series_list.append(series)
+            owners.append(row)
+    grid, values = align(series_list, DAY_SECONDS)
+    matrix = np.full((len(resource_ids), len(grid)), np.nan)
+    if series_list:
+        # Rows are grouped by owner, so one reduceat per resource
+        owners = np.array(owners)
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        matrix[owners[starts]] = np.fmax.reduceat(values, starts, axis=0)
+    return grid, matrix
+
+
+def forecast(clusters: list, databases_by_cluster: dict, asm_series: dict, storage_series: dict,
+             seasonal: bool = True) -> tuple:
+    """Cluster and database forecast rows"""
+    today = datetime.date.today()
+
+    def full_date(days):
+        return (today + datetime.timedelta(days=int(days))).isoformat() if np.isfinite(days) else None
+
+    # Clusters - ASM % of the usable DATA disk group
+    grid, asm = series_matrix(asm_series, [c.id for c in clusters])
+    asm_growth, asm_level = fit_trend(asm, grid, seasonal)
+    cluster_days = days_to_full(100.0 - asm_level, asm_growth)
+    usable_gb = np.array([(c.storage_size_in_gbs or 0) * (c.data_storage_percentage or 0) * .01 for c in clusters])
+    free_gb = usable_gb * (100.0 - asm_level) / 100.0        # NaN (unknown) without ASM data
+
+    cluster_rows = []
+    for i, cluster in enumerate(clusters):
+        cluster_rows.append({"cluster_id": cluster.id, "cluster_name": cluster.display_name,
+                             "infrastructure_id": cluster.cloud_exadata_infrastructure_id,
+                             "usable_gb": float(usable_gb[i]), "asm_used_pct": float(asm_level[i]),
+                             "growth_pct_per_day": float(asm_growth[i]),
+                             "growth_gb_per_day": float(asm_growth[i] * usable_gb[i] / 100.0),
+                             "free_gb": float(free_gb[i]), "days_to_full": float(cluster_days[i]),
+                             "full_date": full_date(cluster_days[i])})
+
+    # Databases - all clusters' databases fitted together
+    database_list = [(i, db) for i, c in enumerate(clusters) for db in databases_by_cluster.get(c.id, [])]
+    grid, storage = series_matrix(storage_series, [db.id for _, db in database_list])
+    db_growth, db_level = fit_trend(storage, grid, seasonal)
+    owner = np.array([i for i, _ in database_list], dtype=np.int64)
+    db_days = days_to_full(free_gb[owner], db_growth) if len(owner) else np.zeros(0)
+
+    database_rows = []
+    for j, (i, db) in enumerate(database_list):
+        cluster_growth_gb = cluster_rows[i]["growth_gb_per_day"]
+        database_rows.append({"cluster_name": clusters[i].display_name, "database_id": db.id,
+                              "db_unique_name": db.db_unique_name, "lifecycle_state": db.lifecycle_state,
+                              "storage_used_gb": float(db_level[j]), "growth_gb_per_day": float(db_growth[j]),
+                              "share_of_cluster_growth": float(db_growth[j] / cluster_growth_gb) if cluster_growth_gb > 0 else None,
+                              "days_to_full": float(db_days[j]), "full_date": full_date(db_days[j]),
+                              "cluster_days_to_full": cluster_rows[i]["days_to_full"]})
+    return cluster_rows, database_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-pr", "--profile", help="Config Profile, named", default="DEFAULT")
+    parser.add_argument("-c", "--compartmentocid", help="ExaCS / Database Compartment OCID", required=True)
+    parser.add_argument("-d", "--days", help=f"Days of history to fit (def={DEFAULT_DAYS})", type=int, default=DEFAULT_DAYS)
+    parser.add_argument("-dg", "--diskgroup", help=f"ASM disk group (def={DEFAULT_DISKGROUP})", default=DEFAULT_DISKGROUP)
+    parser.add_argument("-ns", "--noseasonal", help="Plain linear trend (no day-of-week adjustment)", action="store_true")
+    parser.add_argument("-f", "--format", help="Write forecasts to ndjson/csv/parquet instead of printing", choices=["ndjson", "csv", "parquet"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+    if args.days > MAX_DAYS:
+        logger.warning(f"Monitoring keeps {MAX_DAYS} days of data - fitting {MAX_DAYS} days, not {args.days}")
+        args.days = MAX_DAYS
+
+    try:
+        logger.info(f"Using Profile Authentication: {args.profile}")
+        config = config.from_file(profile_name=args.profile)
+    except ConfigFileNotFound as exc:
+        logger.fatal(f"Unable to use Profile Authentication: {exc}")
+        exit(1)
+
+    database_client = DatabaseClient(config, retry_strategy=DEFAULT_RETRY_STRATEGY)
+    monitoring_client = MonitoringClient(config, retry_strategy=DEFAULT_RETRY_STRATEGY)
+    metric_batcher = MetricBatcher(monitoring_client)
+
+    end_time = datetime.datetime.now(datetime.timezone.utc)
+    start_time = end_time - datetime.timedelta(days=args.days)
+
+    try:
+        clusters = [c for c in pagination.list_call_get_all_results(
+            database_client.list_cloud_vm_clusters,
+            compartment_id=args.compartmentocid
+        ).data if c.lifecycle_state == "AVAILABLE"]
+        databases_by_cluster = {}
+        for cluster in clusters:
+            databases_by_cluster[cluster.id] = pagination.list_call_get_all_results(
+                database_client.list_databases,
+                compartment_id=args.compartmentocid,
+                system_id=cluster.id
+            ).data
+        database_ids = [db.id for dbs in databases_by_cluster.values() for db in dbs]
+        logger.info(f"VM Clusters: {len(clusters)} Databases: {len(database_ids)}")
+
+        # Batched - one call per 50 clusters / databases
+        asm_series = metric_batcher.fetch(args.compartmentocid, "oci_database_cluster", "ASMDiskgroupUtilization", "1d", "mean",
+                                          start_time, end_time, dimension="resourceId", resource_ids=[c.id for c in clusters],
+                                          extra_filter=f'diskgroupName = "{args.diskgroup}"')
+        storage_series = metric_batcher.fetch(args.compartmentocid, "oci_database", "StorageUsed", "1d", "mean",
+                                              start_time, end_time, dimension="resourceId_database", resource_ids=database_ids)
+        logger.info(f"Metrics: {metric_batcher.calls} calls")
+    except ServiceError as exc:
+        logger.error(f"Failed to get details for {args.compartmentocid}: {exc}")
+        exit(1)
+
+    cluster_rows, database_rows = forecast(clusters, databases_by_cluster, asm_series, storage_series,
+                                           seasonal=not args.noseasonal)
+
+    if args.format:
+        datestring = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M")
+        for name, rows in (("clusters", cluster_rows), ("databases", database_rows)):
+            filename = report_filename(f"exacs-storage-forecast-{name}-{datestring}", args.format)
+            with ReportWriter(filename, format=args.format) as writer:
+                writer.write_rows(rows)
+            logger.info(f"Wrote {len(rows)} {name} to {filename}")
+    else:
+        # Series without data (NaN) last - NaN compares false, so a plain sort would scatter them
+        for row in sorted(cluster_rows, key=lambda r: (np.isnan(r["days_to_full"]), r["days_to_full"])):
+            print(f'Cluster {row["cluster_name"]}: ASM {row["asm_used_pct"]:.1f}% of {row["usable_gb"]:.0f} GB, '
+                  f'+{row["growth_gb_per_day"]:.1f} GB/day, full in {row["days_to_full"]:.0f} days ({row["full_date"]})')
+        for row in sorted(database_rows, key=lambda r: (np.isnan(r["days_to_full"]), r["days_to_full"])):
+            print(f'  DB {row["cluster_name"]}/{row["db_unique_name"]}: {row["storage_used_gb"]:.1f} GB, '
+                  f'+{row["growth_gb_per_day"]:.2f} GB/day, fills cluster alone in {row["days_to_full"]:.0f} days')
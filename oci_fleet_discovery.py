@@ -0,0 +1,307 @@
+# OCI Fleet Discovery
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Finds every resource matching a Resource Search query, and hands them out while it is still searching.
+#
+# search_resources(..., limit=1000) without opc-next-page stops at the first page, so fleets
+# bigger than that were silently cut short.  FleetDiscovery.stream():
+# 1) Runs the query and follows opc-next-page
+# 2) If the first page is not the only one, shards the query by compartment
+#    (where (<query>) && compartmentId = '...') over the subtree and pages all shards concurrently
+# 3) Yields each resource once, as soon as its page arrives - callers submit work from the
+#    generator, so processing starts before discovery finishes
+# 4) With a SearchCache (oci_search_cache.py), serves a fresh snapshot of the same query instead,
+#    or stores the sweep for the next script once every page is in
+# 5) With a tracer (oci_fleet_trace.py), the sweep and each shard are "discover" spans
+#
+# python3 oci_fleet_discovery.py --benchmark runs against a fake search service (10k results in
+# 1000-item pages) to compare a single call, sequential paging and sharded paging.
+
+# Usage:
+#   discovery = FleetDiscovery(search_client, identity_client, threads=4)
+#   for resource in discovery.stream('query autonomousdatabase resources', tenancy_id):
+#       executor.submit(work, resource.identifier)
+#
+#   python3 oci_fleet_discovery.py -q 'query autonomousdatabase resources' [-ns] [-w]
+
+import argparse
+import logging
+import queue
+import re
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+
+from oci import config
+from oci import pagination
+from oci.exceptions import ConfigFileNotFound
+from oci.identity import IdentityClient
+from oci.resource_search import ResourceSearchClient
+from oci.resource_search.models import StructuredSearchDetails
+
+# Local
+from oci_fleet_trace import NO_TRACE
+from oci_search_cache import SearchCache, client_endpoint, full_query
+
+logger = logging.getLogger('oci-fleet-discovery')
+
+# Constants
+PAGE_LIMIT = 1000                  # Resource Search maximum
+DEFAULT_THREADS = 4
+_DONE = object()
+
+QUERY_PATTERN = re.compile(r'^\s*(query\s+.+?\s+resources(?:\s+return\s+allAdditionalFields)?)(?:\s+where\s+(.+?))?\s*$',
+                           re.IGNORECASE | re.DOTALL)
+
+
+def shard_query(query: str, compartment_id: str) -> str:
+    """Same structured query limited to one compartment"""
+    match = QUERY_PATTERN.match(query)
+    if not match:
+        raise ValueError(f"Not a structured search query: {query}")
+    head, condition = match.groups()
+    if condition:
+        return f"{head} where ({condition}) && compartmentId = '{compartment_id}'"
+    return f"{head} where compartmentId = '{compartment_id}'"
+
+
+def search_pages(search_client: ResourceSearchClient, query: str, limit: int = PAGE_LIMIT, page: str = None):
+    """Generator of (result page items, next page token), following opc-next-page"""
+    while True:
+        response = search_client.search_resources(
+            search_details=StructuredSearchDetails(type="Structured", query=query),
+            limit=limit,
+            page=page
+        )
+        page = response.next_page
+        yield response.data.items, page
+        if not page:
+            return
+
+
+def _child_compartments(identity_client: IdentityClient, compartment_id: str, in_subtree: bool = False) -> list:
+    return [c.id for c in pagination.list_call_get_all_results(
+        identity_client.list_compartments,
+        compartment_id,
+        access_level="ACCESSIBLE",
+        compartment_id_in_subtree=in_subtree,
+        lifecycle_state="ACTIVE"
+    ).data]
+
+
+def subtree_compartments(identity_client: IdentityClient, root_compartment_id: str) -> list:
+    """Root plus every ACTIVE compartment below it"""
+    if root_compartment_id.startswith("ocid1.tenancy."):
+        # compartmentIdInSubtree is only accepted on the tenancy
+        return [root_compartment_id] + _child_compartments(identity_client, root_compartment_id, in_subtree=True)
+    # Any other root - one level at a time
+    compartment_ids = [root_compartment_id]
+    level = [root_compartment_id]
+    while level:
+        level = [child for parent in level for child in _child_compartments(identity_client, parent)]
+        compartment_ids.extend(level)
+    return compartment_ids
+
+
+class FleetDiscovery:
+    """Paginated, compartment-sharded Resource Search that streams results"""
+
+    def __init__(self, search_client: ResourceSearchClient, identity_client: IdentityClient = None,
+                 threads: int = DEFAULT_THREADS, page_limit: int = PAGE_LIMIT, cache: SearchCache = None, tracer=None):
+        self.search_client = search_client
+        self.identity_client = identity_client
+        self.threads = threads
+        self.page_limit = page_limit
+        self.cache = cache
+        self.tracer = tracer or NO_TRACE
+        self.pages = 0
+        self.shards = 0
+        self.found = 0
+        self._lock = threading.Lock()
+
+    def _pages(self, query: str, page: str = None):
+        for items, next_page in search_pages(self.search_client, query, self.page_limit, page):
+            with self._lock:
+                self.pages += 1
+            yield items, next_page
+
+    def _shard(self, query: str, compartment_id: str, emit):
+        with self.tracer.span(compartment_id, "discover"):
+            for items, _ in self._pages(shard_query(query, compartment_id)):
+                emit(items)
+
+    def _discover(self, query: str, root_compartment_id: str, results: queue.Queue):
+        swept = []
+
+        def emit(items):
+            if self.cache:
+                swept.extend(items)
+            results.put(items)
+
+        try:
+            with self.tracer.span("discovery", "discover", "discovery"):
+                self._sweep(full_query(query) if self.cache else query, root_compartment_id, emit)
+            if self.cache:
+                # Complete sweep only - with duplicates from overlapping shards removed
+                self.cache.put(client_endpoint(self.search_client), query,
+                               list({item.identifier: item for item in swept}.values()))
+        except Exception as exc:
+            results.put(exc)
+        finally:
+            results.put(_DONE)
+
+    def _sweep(self, query: str, root_compartment_id: str, emit):
+        items, next_page = next(self._pages(query))
+        emit(items)
+        if not next_page:
+            return
+        # More than one page - shard by compartment if we can, otherwise keep paging
+        shardable = self.identity_client is not None and root_compartment_id
+        compartment_ids = subtree_compartments(self.identity_client, root_compartment_id) if shardable else []
+        if len(compartment_ids) < 2:
+            for items, _ in self._pages(query, next_page):
+                emit(items)
+            return
+        self.shards = len(compartment_ids)
+        logger.info(f"More than {self.page_limit} results - sharding over {self.shards} compartments")
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="discover") as executor:
+            for future in futures.as_completed([executor.submit(self._shard, query, c, emit) for c in compartment_ids]):
+                future.result()
+
+    def stream(self, query: str, root_compartment_id: str = None):
+        """Generator of ResourceSummary - each identifier once, as pages arrive (or from the cache)"""
+        cached = self.cache.get(client_endpoint(self.search_client), query) if self.cache else None
+        if cached is not None:
+            self.found = len(cached)
+            yield from cached
+            return
+        results = queue.Queue()
+        producer = threading.Thread(target=self._discover, args=(query, root_compartment_id, results),
+                                    name="discovery", daemon=True)
+        started = time.perf_counter()
+        producer.start()
+        seen = set()
+        while True:
+            items = results.get()
+            if items is _DONE:
+                break
+            if isinstance(items, Exception):
+                raise items
+            for item in items:
+                if item.identifier not in seen:
+                    seen.add(item.identifier)
+                    self.found += 1
+                    yield item
+        logger.info(f"Discovered {self.found} resources in {time.perf_counter() - started:.1f}s "
+                    f"({self.pages} pages{f', {self.shards} shards' if self.shards else ''})")
+
+
+########################################
+# Benchmark - fake search service with 10k results
+
+class _FakeResource:
+    __slots__ = ["identifier", "compartment_id", "display_name", "lifecycle_state"]
+
+    def __init__(self, number: int, compartment_id: str):
+        self.identifier = f"ocid1.autonomousdatabase.oc1..{number:06d}"
+        self.compartment_id = compartment_id
+        self.display_name = f"adb{number}"
+        self.lifecycle_state = "AVAILABLE"
+
+
+class _FakeResponse:
+    def __init__(self, items: list, next_page: str):
+        self.data = type("ResourceSummaryCollection", (), {"items": items})()
+        self.next_page = next_page
+        self.has_next_page = next_page is not None
+
+
+class _FakeSearch:
+    """search_resources with pages of `limit` and compartmentId filtering
+
+    Latency is a fixed part plus a part per returned item - a full page of 1000 takes 0.2s"""
+
+    def __init__(self, total: int = 10000, compartments: int = 40, latency: float = 0.05, item_latency: float = 0.00015):
+        self.compartment_ids = [f"ocid1.compartment.oc1..{c:03d}" for c in range(compartments)]
+        self.resources = [_FakeResource(n, self.compartment_ids[n % compartments]) for n in range(total)]
+        self.latency = latency
+        self.item_latency = item_latency
+        self.calls = 0
+
+    def search_resources(self, search_details, limit=PAGE_LIMIT, page=None):
+        self.calls += 1
+        match = re.search(r"compartmentId = '([^']+)'", search_details.query)
+        matching = [r for r in self.resources if not match or r.compartment_id == match.group(1)]
+        offset = int(page or 0)
+        next_offset = offset + limit
+        items = matching[offset:next_offset]
+        time.sleep(self.latency + self.item_latency * len(items))
+        return _FakeResponse(items, str(next_offset) if next_offset < len(matching) else None)
+
+
+class _FakeIdentity:
+    def __init__(self, compartment_ids: list):
+        self.compartment_ids = compartment_ids
+
+    def list_compartments(self, compartment_id, **kwargs):
+        # Root is compartment 0, the rest are below it
+        return type("Response", (), {"data": [type("Compartment", (), {"id": c})() for c in self.compartment_ids[1:]]})()
+
+
+def _benchmark(total: int, threads: int):
+    fake = _FakeSearch(total)
+    query = 'query autonomousdatabase resources return allAdditionalFields where (workloadType="ATP")'
+    start = time.perf_counter()
+    single = fake.search_resources(StructuredSearchDetails(type="Structured", query=query), limit=PAGE_LIMIT).data.items
+    logger.info(f"Single call (limit=1000):     {len(single):6d} of {total} in {time.perf_counter() - start:.2f}s")
+
+    for name, identity_client in (("Sequential pages", None), ("Compartment shards", _FakeIdentity(fake.compartment_ids))):
+        fake.calls = 0
+        discovery = FleetDiscovery(fake, identity_client, threads=threads)
+        start = time.perf_counter()
+        first = None
+        found = 0
+        for _ in discovery.stream(query, fake.compartment_ids[0]):
+            found += 1
+            first = first or time.perf_counter() - start
+        logger.info(f"{name + ':':29} {found:6d} of {total} in {time.perf_counter() - start:.2f}s "
+                    f"(first after {first:.2f}s, {fake.calls} calls)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-pr", "--profile", help="Config Profile, named", default="DEFAULT")
+    parser.add_argument("-q", "--query", help="Structured search query", default="query autonomousdatabase resources")
+    parser.add_argument("-c", "--compartmentocid", help="Root compartment to shard under (def=tenancy)")
+    parser.add_argument("-ns", "--noshard", help="Only follow pages, never shard", action="store_true")
+    parser.add_argument("-th", "--threads", help=f"Concurrent shard queries (def={DEFAULT_THREADS})", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("-w", "--write", help="Print every OCID", action="store_true")
+    parser.add_argument("--benchmark", help="Fake search service with this many results (e.g. 10000)", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    if args.benchmark:
+        _benchmark(args.benchmark, args.threads)
+        exit(0)
+
+    try:
+        logger.info(f"Using Profile Authentication: {args.profile}")
+        config = config.from_file(profile_name=args.profile)
+    except ConfigFileNotFound as exc:
+        logger.fatal(f"Unable to use Profile Authentication: {exc}")
+        exit(1)
+
+    discovery = FleetDiscovery(ResourceSearchClient(config), None if args.noshard else IdentityClient(config), threads=args.threads)
+    by_compartment = {}
+    for resource in discovery.stream(args.query, args.compartmentocid or config["tenancy"]):
+        by_compartment[resource.compartment_id] = by_compartment.get(resource.compartment_id, 0) + 1
+        if args.write:
+            print(resource.identifier)
+    for compartment_id, count in sorted(by_compartment.items(), key=lambda kv: -kv[1]):
+        logger.info(f"{compartment_id}: {count}")
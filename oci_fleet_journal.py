@@ -0,0 +1,151 @@
+# OCI Fleet Journal
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Append-only local journal for fleet scripts, so a crashed or Ctrl-C'd run can pick up where it stopped.
+#
+# Every state change of a resource is one row in SQLite (WAL mode - cheap commits, readable while
+# the script runs):
+#   PLANNED    found and queued
+#   IN_FLIGHT  being worked on - detail has the step and anything needed to resume
+#              (e.g. the lifecycle state to return the DB to)
+#   DONE       finished - detail is the result
+#   FAILED     gave up - detail is the result (retried on the next run)
+#
+# A run that did not call finish() is resumed by the next invocation of the same job: DONE
+# resources are skipped and IN_FLIGHT ones continue from their journaled detail.  results()
+# reads the results back with a cursor, so reports are written from the journal, not from memory.
+
+# Usage:
+#   journal = FleetJournal(".fleet-journal-atp-scale-down.db", "atp-scale-down")
+#   if ocid not in journal.completed:
+#       journal.in_flight(ocid, {"step": "update", "initial_state": "STOPPED"})
+#       journal.done(ocid, result)
+#   journal.finish()
+#   for result in journal.results(): ...
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger('oci-fleet-journal')
+
+# Constants
+PLANNED = "PLANNED"
+IN_FLIGHT = "IN_FLIGHT"
+DONE = "DONE"
+FAILED = "FAILED"
+
+
+def journal_filename(job: str) -> str:
+    return f".fleet-journal-{job}.db"
+
+
+class FleetJournal:
+    """Resource states for one job, with resume of an unfinished run"""
+
+    def __init__(self, filename: str, job: str, restart: bool = False):
+        self.filename = filename
+        self.job = job
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job TEXT NOT NULL,
+                started REAL NOT NULL,
+                finished REAL);
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id INTEGER NOT NULL,
+                ocid TEXT NOT NULL,
+                state TEXT NOT NULL,
+                detail TEXT,
+                at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS journal_run_ocid ON journal (run_id, ocid, seq);
+        """)
+
+        last = self._connection.execute(
+            "SELECT run_id, finished FROM runs WHERE job = ? ORDER BY run_id DESC LIMIT 1", (job,)).fetchone()
+        self.resumed = bool(last and last[1] is None and not restart)
+        if self.resumed:
+            self.run_id = last[0]
+        else:
+            with self._connection:
+                self.run_id = self._connection.execute(
+                    "INSERT INTO runs (job, started) VALUES (?, ?)", (job, time.time())).lastrowid
+
+        # Latest state per resource, and the last IN_FLIGHT detail (what a resume needs)
+        self.states = {}
+        self._resume_details = {}
+        for ocid, state, detail in self._connection.execute(
+                "SELECT ocid, state, detail FROM journal WHERE run_id = ? ORDER BY seq", (self.run_id,)):
+            self.states[ocid] = state
+            if state == IN_FLIGHT:
+                self._resume_details[ocid] = json.loads(detail) if detail else {}
+        if self.resumed:
+            logger.info(f"Resuming run {self.run_id} of {job}: {self.counts()}")
+
+    def record(self, ocid: str, state: str, detail: dict = None):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO journal (run_id, ocid, state, detail, at) VALUES (?, ?, ?, ?, ?)",
+                (self.run_id, ocid, state, json.dumps(detail) if detail is not None else None, time.time()))
+            self.states[ocid] = state
+            if state == IN_FLIGHT:
+                self._resume_details[ocid] = detail or {}
+
+    def planned(self, ocid: str, detail: dict = None):
+        self.record(ocid, PLANNED, detail)
+
+    def in_flight(self, ocid: str, detail: dict = None):
+        self.record(ocid, IN_FLIGHT, detail)
+
+    def done(self, ocid: str, result: dict = None):
+        self.record(ocid, DONE, result)
+
+    def failed(self, ocid: str, result: dict = None):
+        self.record(ocid, FAILED, result)
+
+    def state(self, ocid: str) -> str:
+        return self.states.get(ocid)
+
+    def resume_detail(self, ocid: str) -> dict:
+        """Detail of the last IN_FLIGHT record if the resource is not DONE (None otherwise)"""
+        return self._resume_details.get(ocid) if self.states.get(ocid) != DONE else None
+
+    @property
+    def completed(self) -> set:
+        return {ocid for ocid, state in self.states.items() if state == DONE}
+
+    def counts(self) -> dict:
+        counts = {}
+        for state in self.states.values():
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def results(self):
+        """Generator of DONE / FAILED results of this run, in completion order (read with its own connection)"""
+        reader = sqlite3.connect(self.filename)
+        try:
+            for (detail,) in reader.execute("""
+                    SELECT j.detail FROM journal j
+                    JOIN (SELECT ocid, MAX(seq) AS seq FROM journal WHERE run_id = ? GROUP BY ocid) latest
+                      ON j.seq = latest.seq
+                    WHERE j.state IN (?, ?) ORDER BY j.seq""", (self.run_id, DONE, FAILED)):
+                yield json.loads(detail) if detail else None
+        finally:
+            reader.close()
+
+    def finish(self):
+        """Mark the run complete - the next invocation starts a new run"""
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), self.run_id))
+        logger.info(f"Run {self.run_id} of {self.job} finished: {self.counts()}")
+
+    def close(self):
+        self._connection.close()
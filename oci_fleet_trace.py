@@ -0,0 +1,220 @@
+# OCI Fleet Trace
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Timing spans per resource and step for the fleet scripts, so a slow run shows where the time
+# went - waiting on lifecycle states, API calls, or throttling.
+#
+# 1) Code wraps each step in tracer.span(resource, step) - the steps of an ADB run are
+#    discover, get, start, update, wait and restore-state
+# 2) RateLimiter(tracer=...) (oci_rate_limiter.py) counts every API call, retry after a 429,
+#    429 and the time spent waiting for the call rate into the span open on the calling thread.
+#    Calls outside a span (e.g. the batched waiter searches) are counted as "(no span)"
+# 3) write() exports a Chrome trace (chrome://tracing, https://ui.perfetto.dev): one process per
+#    region, one row per resource, with the counts in the span args.  The summary is in otherData
+# 4) summary() is a table per step: count, p50 / p95 / max / total seconds, seconds waited for
+#    the call rate, API calls, retries, 429s and errors
+#
+# Retries the SDK makes itself (5xx, timeouts) happen inside one call and are not counted.
+
+# Usage:
+#   tracer = FleetTracer()
+#   clients = RegionClients(config, signer, RateLimiter(tracer=tracer))
+#   with tracer.group(region).span(db.id, "update", db.display_name):
+#       database_client.update_autonomous_database(...)
+#   tracer.write("trace.json")
+#   tracer.log_summary()
+#
+#   python3 oci_fleet_trace.py -i trace.json      # summary of a written trace
+
+import argparse
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+logger = logging.getLogger('oci-fleet-trace')
+
+# Constants
+NO_SPAN = "(no span)"
+SUMMARY_FIELDS = ["STEP", "COUNT", "P50_S", "P95_S", "MAX_S", "TOTAL_S", "RATE_WAIT_S", "API_CALLS", "RETRIES",
+                  "THROTTLED", "ERRORS"]
+
+
+class Span:
+    """One step of one resource - times in seconds since the tracer started"""
+    __slots__ = ["resource", "step", "name", "group", "start", "end", "api_calls", "retries", "throttled", "waited", "error"]
+
+    def __init__(self, resource: str, step: str, name: str = None, group: str = None, start: float = 0.0):
+        self.resource = resource
+        self.step = step
+        self.name = name
+        self.group = group
+        self.start = start
+        self.end = None
+        self.api_calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self.error = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end or self.start) - self.start
+
+
+class FleetTracer:
+    """Collects spans from every thread, with API call counts from the rate limiter"""
+
+    def __init__(self):
+        self.spans = []
+        self.unattributed = Span("", NO_SPAN)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, resource: str, step: str, name: str = None, group: str = None, calls: bool = True):
+        """Time the block as one step of resource
+
+        calls=False for a block that can resume on another thread (a yield to the waiter) - no
+        API calls are counted into it."""
+        span = Span(resource, step, name, group, time.perf_counter() - self._origin)
+        if calls:
+            self._stack().append(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.error = type(exc).__name__
+            raise
+        finally:
+            span.end = time.perf_counter() - self._origin
+            if calls:
+                self._stack().remove(span)
+            with self._lock:
+                self.spans.append(span)
+
+    def group(self, group: str):
+        """Same tracer, with every span in this group (region)"""
+        return _GroupTracer(self, group)
+
+    def api_call(self, retry: bool = False, throttled: bool = False, waited: float = 0.0):
+        """One API call attempt - counted into the innermost span open on this thread"""
+        stack = self._stack()
+        span = stack[-1] if stack else self.unattributed
+        with self._lock:
+            span.api_calls += 1
+            span.retries += retry
+            span.throttled += throttled
+            span.waited += waited
+
+    def summary(self) -> list:
+        """One row per step (SUMMARY_FIELDS), in order of first use"""
+        with self._lock:
+            spans = list(self.spans)
+        by_step = {}
+        for span in spans:
+            by_step.setdefault(span.step, []).append(span)
+        rows = []
+        for step, step_spans in by_step.items():
+            durations = np.fromiter((s.duration for s in step_spans), dtype=np.float64, count=len(step_spans))
+            p50, p95 = np.percentile(durations, [50, 95])
+            rows.append({"STEP": step, "COUNT": len(step_spans), "P50_S": round(float(p50), 3),
+                         "P95_S": round(float(p95), 3), "MAX_S": round(float(durations.max()), 3),
+                         "TOTAL_S": round(float(durations.sum()), 3),
+                         "RATE_WAIT_S": round(sum(s.waited for s in step_spans), 3), "API_CALLS": sum(s.api_calls for s in step_spans), "RETRIES": sum(s.retries for s in step_spans),
+                         "THROTTLED": sum(s.throttled for s in step_spans), "ERRORS": sum(1 for s in step_spans if s.error)})
+        if self.unattributed.api_calls:
+            rows.append({"STEP": NO_SPAN, "COUNT": 0, "P50_S": None, "P95_S": None, "MAX_S": None, "TOTAL_S": None,
+                         "RATE_WAIT_S": round(self.unattributed.waited, 3), "API_CALLS": self.unattributed.api_calls,
+                         "RETRIES": self.unattributed.retries, "THROTTLED": self.unattributed.throttled, "ERRORS": 0})
+        return rows
+
+    def log_summary(self):
+        logger.info(f"Trace summary ({len(self.spans)} spans):\n{format_summary(self.summary())}")
+
+    def trace_events(self) -> list:
+        """Chrome trace events - complete ("X") events in microseconds, plus process / thread names"""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        pids = {}
+        tids = {}
+        events = []
+        for span in spans:
+            group = span.group or "fleet"
+            if group not in pids:
+                pids[group] = len(pids) + 1
+                events.append({"ph": "M", "name": "process_name", "pid": pids[group], "args": {"name": group}})
+            if (group, span.resource) not in tids:
+                tids[(group, span.resource)] = len(tids) + 1
+                events.append({"ph": "M", "name": "thread_name", "pid": pids[group], "tid": tids[(group, span.resource)],
+                               "args": {"name": span.name or span.resource}})
+            args = {"resource": span.resource, "api_calls": span.api_calls, "retries": span.retries,
+                    "throttled": span.throttled, "rate_wait_s": round(span.waited, 3)}
+            if span.error:
+                args["error"] = span.error
+            events.append({"ph": "X", "name": span.step, "cat": "fleet", "pid": pids[group],
+                           "tid": tids[(group, span.resource)], "ts": round(span.start * 1e6),
+                           "dur": round(span.duration * 1e6), "args": args})
+        return events
+
+    def write(self, filename: str):
+        with open(filename, "w") as outfile:
+            json.dump({"traceEvents": self.trace_events(), "displayTimeUnit": "ms",
+                       "otherData": {"summary": self.summary()}}, outfile)
+        logger.info(f"Wrote {len(self.spans)} spans to {filename}")
+
+
+class _GroupTracer:
+    """FleetTracer view that puts every span in one group"""
+
+    def __init__(self, tracer: FleetTracer, group: str):
+        self.tracer = tracer
+        self.group_name = group
+
+    def span(self, resource: str, step: str, name: str = None, calls: bool = True):
+        return self.tracer.span(resource, step, name, self.group_name, calls)
+
+
+class _NoTracer:
+    """Stand-in when tracing is off - spans cost nothing"""
+
+    def span(self, resource: str, step: str, name: str = None, calls: bool = True):
+        return nullcontext()
+
+    def group(self, group: str):
+        return self
+
+
+NO_TRACE = _NoTracer()
+
+
+def format_summary(rows: list) -> str:
+    """Summary rows as a fixed-width table"""
+    widths = {field: max([len(field)] + [len("" if row[field] is None else str(row[field])) for row in rows])
+              for field in SUMMARY_FIELDS}
+    lines = ["  ".join(field.ljust(widths[field]) for field in SUMMARY_FIELDS).rstrip()]
+    for row in rows:
+        lines.append("  ".join(("" if row[field] is None else str(row[field])).ljust(widths[field])
+                               for field in SUMMARY_FIELDS).rstrip())
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input", help="Trace file written by a fleet script with -tr", required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+
+    with open(args.input) as infile:
+        trace = json.load(infile)
+    print(format_summary(trace["otherData"]["summary"]))
@@ -0,0 +1,240 @@
+# OCI Lifecycle Waiter
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# One poller for every pending "wait until resource X is in state Y" of a fleet script.
+#
+# oci.wait_until in a worker thread holds that thread (and a GET every few seconds) for the whole
+# scale / convert operation, so --threads caps the number of DBs in flight.  Instead:
+# 1) Workers register (OCID, target states) and get a Future back - nothing blocks
+# 2) One poller thread checks all due waits with batched Resource Search queries
+#    (identifier = ... || identifier = ..., lifecycleState comes back with each result)
+# 3) Each wait backs off on its own (5s, x1.5 up to 60s) - long operations cost few polls.  Failed
+#    polls (search errors, and throttling / 5xx / timeouts / connection errors on a GET) back off
+#    the same way - a wait only fails on a FAILED state, a permanent GET error or its deadline
+# 4) Search is eventually consistent, so a target state seen in search is confirmed with ONE
+#    GET before the Future resolves (with the fresh resource model)
+# 5) With a tracer (oci_fleet_trace.py), each confirming GET is a "get" span of the resource
+#
+# drive() runs generator style work items on an executor: the work yields a Future (e.g. from
+# waiter.wait) and is resumed on a pool thread when it is done.  Hundreds of DBs can then be
+# mid-operation with a handful of threads.
+
+# Usage:
+#   waiter = LifecycleWaiter(search_client, lambda i: database_client.get_autonomous_database(i).data)
+#   def work(db_id):
+#       database_client.update_autonomous_database(...)
+#       db = yield waiter.wait(db_id, "AVAILABLE")
+#       return {"Name": db.display_name}
+#   with ThreadPoolExecutor(max_workers=5) as executor:
+#       results = [f.result() for f in [drive(executor, work(i)) for i in db_ocids]]
+#   waiter.close()
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, Executor
+
+from oci.exceptions import ServiceError, MaximumWaitTimeExceeded
+from oci.resource_search import ResourceSearchClient
+from oci.resource_search.models import StructuredSearchDetails
+
+# Local
+from oci_fleet_trace import NO_TRACE
+
+logger = logging.getLogger('oci-lifecycle-waiter')
+
+# Constants
+MIN_INTERVAL = 5.0
+MAX_INTERVAL = 60.0
+BACKOFF = 1.5
+SEARCH_BATCH = 50                  # identifiers per search query
+DEFAULT_MAX_WAIT = 3600
+FAILED_STATES = ("FAILED", "TERMINATED")
+
+
+def _transient(exc: Exception) -> bool:
+    """Worth polling again - throttled, a 5xx, or no answer at all (requests errors are OSErrors)"""
+    if isinstance(exc, ServiceError):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(exc, OSError)
+
+
+class _Wait:
+    def __init__(self, ocid: str, targets: tuple, max_wait: float):
+        self.ocid = ocid
+        self.targets = targets
+        self.future = Future()
+        self.started = time.monotonic()
+        self.deadline = self.started + max_wait
+        self.interval = MIN_INTERVAL
+        self.due = self.started + MIN_INTERVAL
+        self.polls = 0
+
+    def backoff(self, now: float):
+        self.interval = min(self.interval * BACKOFF, MAX_INTERVAL)
+        self.due = now + self.interval
+
+
+class LifecycleWaiter:
+    """Multiplexes lifecycle waits for one resource type into a single poller thread"""
+
+    def __init__(self, search_client: ResourceSearchClient, get_resource, resource_type: str = "autonomousdatabase",
+                 max_wait: float = DEFAULT_MAX_WAIT, tracer=None):
+        self.search_client = search_client
+        self.get_resource = get_resource
+        self.tracer = tracer or NO_TRACE
+        self.resource_type = resource_type
+        self.max_wait = max_wait
+        self.searches = 0
+        self.gets = 0
+        self._waits = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._poll_loop, name="waiter", daemon=True)
+        self._thread.start()
+
+    def wait(self, ocid: str, targets="AVAILABLE", max_wait: float = None) -> Future:
+        """Future resolving to the resource once it is in one of the target states"""
+        targets = (targets,) if isinstance(targets, str) else tuple(targets)
+        pending = _Wait(ocid, targets, max_wait or self.max_wait)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("LifecycleWaiter is closed")
+            self._waits.append(pending)
+            self._condition.notify()
+        logger.debug(f"Waiting for {ocid} to be {'/'.join(targets)}")
+        return pending.future
+
+    @property
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._waits)
+
+    def close(self):
+        """Stop the poller - waits still pending are cancelled"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        logger.debug(f"Waiter closed after {self.searches} searches and {self.gets} GETs")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _search_states(self, ocids: list) -> dict:
+        """OCID -> lifecycleState for one batch, from Resource Search"""
+        clauses = " || ".join(f"identifier = '{ocid}'" for ocid in ocids)
+        self.searches += 1
+        items = self.search_client.search_resources(
+            search_details=StructuredSearchDetails(
+                type="Structured",
+                query=f"query {self.resource_type} resources where ({clauses})"
+            ),
+            limit=len(ocids)
+        ).data.items
+        return {item.identifier: item.lifecycle_state for item in items}
+
+    def _confirm(self, pending: _Wait, now: float):
+        """Search says done (or does not know the resource yet) - a GET decides"""
+        self.gets += 1
+        with self.tracer.span(pending.ocid, "get"):
+            resource = self.get_resource(pending.ocid)
+        if resource.lifecycle_state in pending.targets:
+            logger.debug(f"{pending.ocid} is {resource.lifecycle_state} after {now - pending.started:.0f}s, {pending.polls} polls")
+            pending.future.set_result(resource)
+        elif resource.lifecycle_state in FAILED_STATES:
+            pending.future.set_exception(RuntimeError(f"{pending.ocid} is {resource.lifecycle_state}, not {'/'.join(pending.targets)}"))
+        else:
+            pending.backoff(now)
+
+    def _poll(self, due: list):
+        now = time.monotonic()
+        for begin in range(0, len(due), SEARCH_BATCH):
+            batch = due[begin:begin + SEARCH_BATCH]
+            try:
+                states = self._search_states([w.ocid for w in batch])
+            except (ServiceError, OSError) as exc:
+                # Search hiccup (or timeout / connection error) - try again later, the deadline still applies
+                logger.warning(f"Search for {len(batch)} waits failed: {exc}")
+                for pending in batch:
+                    pending.backoff(now)
+                continue
+            for pending in batch:
+                pending.polls += 1
+                state = states.get(pending.ocid)
+                try:
+                    if state is None or state in pending.targets or state in FAILED_STATES:
+                        self._confirm(pending, now)
+                    else:
+                        pending.backoff(now)
+                except (ServiceError, OSError) as exc:
+                    if not _transient(exc):
+                        pending.future.set_exception(exc)
+                        continue
+                    logger.warning(f"GET of {pending.ocid} failed, polling again: {exc}")
+                    pending.backoff(now)
+
+    def _poll_loop(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    now = time.monotonic()
+                    for pending in [w for w in self._waits if now >= w.deadline]:
+                        pending.future.set_exception(MaximumWaitTimeExceeded(
+                            f"{pending.ocid} not {'/'.join(pending.targets)} after {now - pending.started:.0f}s"))
+                    self._waits = [w for w in self._waits if not w.future.done()]
+                    due = [w for w in self._waits if w.due <= now]
+                    if due:
+                        break
+                    next_due = min((min(w.due, w.deadline) for w in self._waits), default=now + MAX_INTERVAL)
+                    self._condition.wait(timeout=max(next_due - now, 0.01))
+                if self._closed:
+                    for pending in self._waits:
+                        pending.future.cancel()
+                    self._waits = []
+                    return
+            logger.debug(f"Polling {len(due)} of {len(self._waits)} waits")
+            try:
+                self._poll(due)
+            except Exception:
+                # Never let the poller die with waits outstanding (nothing would enforce the deadlines) -
+                # poll this batch again later, the deadline decides when a wait gives up
+                logger.exception(f"Poll of {len(due)} waits failed")
+                now = time.monotonic()
+                for pending in due:
+                    if not pending.future.done():
+                        pending.backoff(now)
+
+
+def drive(executor: Executor, steps) -> Future:
+    """Run a generator on the executor - each Future it yields is awaited without holding a thread
+
+    The value (or exception) of the yielded Future is sent back into the generator, and its return
+    value becomes the result of the returned Future."""
+    result = Future()
+
+    def advance(value=None, error: BaseException = None):
+        try:
+            awaited = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as stop:
+            result.set_result(stop.value)
+        except BaseException as exc:
+            result.set_exception(exc)
+        else:
+            awaited.add_done_callback(lambda done: executor.submit(resume, done))
+
+    def resume(done: Future):
+        if done.cancelled():
+            advance(error=MaximumWaitTimeExceeded("Wait cancelled"))
+        elif done.exception() is not None:
+            advance(error=done.exception())
+        else:
+            advance(done.result())
+
+    executor.submit(advance)
+    return result
@@ -0,0 +1,221 @@
+# OCI Metric Cache
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Local time-series cache in front of MonitoringQuery (oci_monitoring_query.py).
+#
+# Re-running a metrics script over the same 30 day window with a different threshold or
+# dimension list should not refetch 30 days of data.  This module:
+# 1) Keys each query by (Monitoring endpoint / region, namespace, query, resolution, resource group,
+#    compartment, subtree) - the file is per tenancy, and the same query in another region is
+#    other data
+# 2) Tracks which time intervals have already been fetched for that key (coverage)
+# 3) Fetches only the missing intervals through MonitoringQuery and merges them into the cache
+# 4) Serves the requested window from SQLite - one row per series, timestamps/values stored as arrays
+#
+# The most recent interval is never marked as covered, since its aggregation may still change.
+
+# Usage:
+#   cached = MetricCache(MonitoringQuery(monitoring_client), f".metric-cache-{tenancy}.db")
+#   series = cached.run(comp_ocid, namespace, query, start_time, end_time)   # same as MonitoringQuery.run
+#   for series_list in cached.stream(...):                                   # same as MonitoringQuery.stream
+
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from oci_monitoring_query import MonitoringQuery, MetricSeries, interval_seconds
+
+logger = logging.getLogger('oci-metric-cache')
+
+# Constants
+SCHEMA_VERSION = 2                     # 2 = region in the key, older entries are dropped
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS coverage (key TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS coverage_key ON coverage (key);
+CREATE TABLE IF NOT EXISTS series (
+    key TEXT NOT NULL,
+    series_key TEXT NOT NULL,
+    name TEXT,
+    namespace TEXT,
+    resource_group TEXT,
+    dimensions TEXT,
+    timestamps BLOB,
+    vals BLOB,
+    PRIMARY KEY (key, series_key)
+);
+"""
+
+
+def cache_filename(tenancy_ocid: str) -> str:
+    return f'.metric-cache-{tenancy_ocid}.db'
+
+
+def client_endpoint(monitoring_client) -> str:
+    # RateLimitedClient passes base_client through
+    return getattr(getattr(monitoring_client, "base_client", None), "endpoint", None) or "default"
+
+
+def _epoch(value: datetime) -> int:
+    # Naive datetimes mean UTC, as in MonitoringQuery
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def _datetime(epoch: int) -> datetime:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc)
+
+
+def merge_intervals(intervals: list) -> list:
+    """Union of [start, end) intervals, sorted"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(i) for i in merged]
+
+
+def missing_intervals(covered: list, start: int, end: int) -> list:
+    """Parts of [start, end) not inside the (merged, sorted) covered intervals"""
+    gaps = []
+    cursor = start
+    for cover_start, cover_end in covered:
+        if cover_end <= cursor:
+            continue
+        if cover_start >= end:
+            break
+        if cover_start > cursor:
+            gaps.append((cursor, cover_start))
+        cursor = max(cursor, cover_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+class MetricCache:
+    """MonitoringQuery with a local SQLite cache and per-interval coverage tracking"""
+
+    def __init__(self, monitoring_query: MonitoringQuery, filename: str):
+        self.monitoring_query = monitoring_query
+        self.filename = filename
+        self.endpoint = client_endpoint(monitoring_query.monitoring_client)
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(SCHEMA)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            # Entries from before the region was part of the key could belong to any region
+            self.connection.executescript("DELETE FROM coverage; DELETE FROM series;")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def calls(self) -> int:
+        return self.monitoring_query.calls
+
+    @staticmethod
+    def cache_key(endpoint: str, compartment_id: str, namespace: str, query: str, resolution: str = None,
+                  resource_group: str = None, compartment_id_in_subtree: bool = False) -> str:
+        identity = json.dumps([endpoint, compartment_id, namespace, query.strip(), resolution, resource_group,
+                               compartment_id_in_subtree])
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def coverage(self, key: str) -> list:
+        rows = self.connection.execute("SELECT start, end FROM coverage WHERE key = ?", (key,)).fetchall()
+        return merge_intervals(rows)
+
+    def _add_coverage(self, key: str, intervals: list):
+        merged = merge_intervals(self.coverage(key) + intervals)
+        self.connection.execute("DELETE FROM coverage WHERE key = ?", (key,))
+        self.connection.executemany("INSERT INTO coverage (key, start, end) VALUES (?, ?, ?)",
+                                    [(key, s, e) for s, e in merged])
+
+    def _store(self, key: str, series_list: list):
+        """Merge fetched series into their cached arrays (new datapoints win on equal timestamps)"""
+        for series in series_list:
+            series_key = json.dumps([series.name, sorted(series.dimensions.items())])
+            row = self.connection.execute("SELECT timestamps, vals FROM series WHERE key = ? AND series_key = ?",
+                                          (key, series_key)).fetchone()
+            timestamps = series.timestamps.astype("datetime64[s]").astype(np.int64)
+            values = series.values.astype(np.float64)
+            if row:
+                timestamps = np.r_[np.frombuffer(row[0], dtype=np.int64), timestamps]
+                values = np.r_[np.frombuffer(row[1], dtype=np.float64), values]
+                order = np.argsort(timestamps, kind="stable")
+                timestamps = timestamps[order]
+                values = values[order]
+                keep = np.r_[timestamps[1:] != timestamps[:-1], True]
+                timestamps = timestamps[keep]
+                values = values[keep]
+            self.connection.execute(
+                "INSERT OR REPLACE INTO series (key, series_key, name, namespace, resource_group, dimensions, timestamps, vals) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, series_key, series.name, series.namespace, series.resource_group, json.dumps(series.dimensions),
+                 timestamps.tobytes(), values.tobytes()))
+
+    def _load(self, key: str, start: int, end: int):
+        """Cached series in the window, one at a time"""
+        for name, namespace, resource_group, dimensions, timestamps, values in self.connection.execute(
+                "SELECT name, namespace, resource_group, dimensions, timestamps, vals FROM series WHERE key = ?", (key,)):
+            timestamps = np.frombuffer(timestamps, dtype=np.int64)
+            values = np.frombuffer(values, dtype=np.float64)
+            window = (timestamps >= start) & (timestamps <= end)
+            if not window.any():
+                continue
+            yield MetricSeries(name, namespace, json.loads(dimensions), timestamps[window].astype("datetime64[s]"),
+                               values[window].copy(), resource_group=resource_group)
+
+    def stream(self, compartment_id: str, namespace: str, query: str, start_time: datetime, end_time: datetime,
+               resolution: str = None, resource_group: str = None, compartment_id_in_subtree: bool = False):
+        """Same contract as MonitoringQuery.stream - missing intervals are fetched and stored chunk by chunk,
+        then the window is served from the cache one series at a time"""
+        key = self.cache_key(self.endpoint, compartment_id, namespace, query, resolution, resource_group,
+                             compartment_id_in_subtree)
+        step = interval_seconds(query, resolution)
+        start = _epoch(start_time) // step * step
+        end = _epoch(end_time)
+
+        gaps = missing_intervals(self.coverage(key), start, end)
+        if not gaps:
+            self.hits += 1
+            logger.info(f"Cache hit {namespace} {query}")
+        else:
+            self.misses += 1
+            logger.info(f"Cache fetch {namespace} {query}: {len(gaps)} missing interval(s)")
+
+        # Anything after the last complete interval is fetched but not marked as covered
+        settled = (int(time.time()) // step - 1) * step
+        fetched = []
+        for gap_start, gap_end in gaps:
+            for series_list in self.monitoring_query.stream(compartment_id, namespace, query, _datetime(gap_start),
+                                                            _datetime(gap_end), resolution=resolution,
+                                                            resource_group=resource_group,
+                                                            compartment_id_in_subtree=compartment_id_in_subtree):
+                self._store(key, series_list)
+            if min(gap_end, settled) > gap_start:
+                fetched.append((gap_start, min(gap_end, settled)))
+        if fetched:
+            self._add_coverage(key, fetched)
+        self.connection.commit()
+
+        for series in self._load(key, start, end):
+            yield [series]
+
+    def run(self, compartment_id: str, namespace: str, query: str, start_time: datetime, end_time: datetime,
+            resolution: str = None, resource_group: str = None, compartment_id_in_subtree: bool = False) -> list:
+        """Same contract as MonitoringQuery.run - only the uncovered parts of the window are fetched"""
+        return [series for series_list in self.stream(compartment_id, namespace, query, start_time, end_time,
+                                                      resolution=resolution, resource_group=resource_group,
+                                                      compartment_id_in_subtree=compartment_id_in_subtree)
+                for series in series_list]
+
+    def close(self):
+        self.connection.close()
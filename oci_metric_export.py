@@ -0,0 +1,247 @@
+# OCI Metric Export
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Streaming exporters for MetricSeries (oci_monitoring_query.py) into TSDB-friendly formats.
+#
+# OpenMetricsWriter - OpenMetrics text exposition (oci_<namespace>_<metric> gauges, dimensions as
+#   labels, sample timestamps).  OpenMetrics requires each metric family, and each series in it, to
+#   be contiguous, so samples are spooled to one temporary file per family as series (or chunks of
+#   a series - MonitoringQuery.stream) arrive, and joined series by series on close.
+#   The result can be scraped from a file server, or POSTed to a text import endpoint
+#   (e.g. VictoriaMetrics /api/v1/import/prometheus) with push_openmetrics().
+#
+# ParquetPartitionWriter - Parquet in a namespace=<ns>/date=<YYYY-MM-DD>/ layout (Hive style), one
+#   part-<run id>.parquet per partition and run, so later runs add files next to earlier ones
+#   instead of replacing them.  Rows are buffered per partition and flushed every flush_rows.
+#   Requires pyarrow (optional).
+#
+# Neither writer holds more than one series plus the per-partition buffers in memory.
+
+# Usage:
+#   with OpenMetricsWriter("metrics.om") as om, ParquetPartitionWriter("metrics-parquet") as pq:
+#       for series_list in monitoring_query.stream(...):
+#           for series in series_list:
+#               om.write_series(series)
+#               pq.write_series(series)
+
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import urllib.request
+import uuid
+
+import numpy as np
+
+# Optional - only needed for Parquet output
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger('oci-metric-export')
+
+# Constants
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+DEFAULT_FLUSH_ROWS = 100_000
+
+
+def metric_name(namespace: str, name: str) -> str:
+    """oci_<namespace>_<metric> in snake case with only [a-zA-Z0-9_:]"""
+    snake = re.sub(r'(?<=[a-z0-9])(?=[A-Z])', '_', name).lower()
+    return re.sub(r'[^a-zA-Z0-9_:]', '_', f"oci_{namespace}_{snake}".replace("oci_oci_", "oci_"))
+
+
+def _sample_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _label_name(key: str) -> str:
+    label = re.sub(r'[^a-zA-Z0-9_]', '_', key)
+    return f"_{label}" if label[:1].isdigit() else label
+
+
+def _label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class OpenMetricsWriter:
+    """Incremental OpenMetrics text writer - one gauge family per OCI metric"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.samples_written = 0
+        self._spool_dir = tempfile.mkdtemp(prefix=".openmetrics-", dir=os.path.dirname(os.path.abspath(filename)))
+        self._families = {}     # family name -> open spool file (insertion order kept)
+        self._segments = {}     # family name -> {series label prefix -> [(offset, length)]}
+
+    def write_series(self, series):
+        family = metric_name(series.namespace or "", series.name)
+        spool = self._families.get(family)
+        if spool is None:
+            spool = open(os.path.join(self._spool_dir, f"{len(self._families)}.txt"), "w+b")
+            self._families[family] = spool
+            self._segments[family] = {}
+        dimensions = dict(series.dimensions)
+        if series.resource_group:
+            dimensions["resourceGroup"] = series.resource_group
+        labels = ",".join(f'{_label_name(k)}="{_label_value(v)}"' for k, v in sorted(dimensions.items()))
+        prefix = f"{family}{{{labels}}} " if labels else f"{family} "
+        seconds = series.timestamps.astype("datetime64[s]").astype(np.int64)
+        samples = "".join(f"{prefix}{_sample_value(value)} {ts}\n" for ts, value in zip(seconds.tolist(), series.values.tolist())).encode()
+        self._segments[family].setdefault(prefix, []).append((spool.tell(), len(samples)))
+        spool.write(samples)
+        self.samples_written += len(series)
+
+    def close(self):
+        """Join the family spools into the final file, series by series (written to a temp name, then renamed)"""
+        if self._spool_dir is None:
+            return
+        partial = f"{self.filename}.partial"
+        with open(partial, "wb") as outfile:
+            for family, spool in self._families.items():
+                outfile.write(f"# TYPE {family} gauge\n".encode())
+                # Chunks arrive oldest first, so each series' segments are already in time order
+                for segments in self._segments[family].values():
+                    for offset, length in segments:
+                        spool.seek(offset)
+                        outfile.write(spool.read(length))
+                spool.close()
+            outfile.write(b"# EOF\n")
+        os.replace(partial, self.filename)
+        shutil.rmtree(self._spool_dir, ignore_errors=True)
+        self._spool_dir = None
+        logger.info(f"Wrote {self.samples_written} samples in {len(self._families)} families to {self.filename}")
+
+    def discard(self):
+        """Drop the spools (and any half-joined .partial) - the target file is left as it was"""
+        if self._spool_dir is None:
+            return
+        for spool in self._families.values():
+            spool.close()
+        shutil.rmtree(self._spool_dir, ignore_errors=True)
+        self._spool_dir = None
+        partial = f"{self.filename}.partial"
+        if os.path.isfile(partial):
+            os.remove(partial)
+        logger.warning(f"Discarded {self.samples_written} samples - {self.filename} not written")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # A failed export must not replace the target with a truncated file
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+
+def push_openmetrics(filename: str, url: str, timeout: int = 60) -> int:
+    """POST an OpenMetrics file to a text import endpoint - returns the HTTP status"""
+    with open(filename, "rb") as body:
+        request = urllib.request.Request(url, data=body, method="POST",
+                                         headers={"Content-Type": OPENMETRICS_CONTENT_TYPE,
+                                                  "Content-Length": str(os.path.getsize(filename))})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+
+
+class ParquetPartitionWriter:
+    """Series -> namespace=<ns>/date=<day>/part-<run id>.parquet, flushed per partition"""
+
+    def __init__(self, root_dir: str, flush_rows: int = DEFAULT_FLUSH_ROWS, compression: str = "snappy"):
+        if pyarrow is None:
+            raise ImportError("Parquet output requires pyarrow (pip3 install pyarrow)")
+        self.root_dir = root_dir
+        self.flush_rows = flush_rows
+        self.compression = compression
+        self.rows_written = 0
+        self.run_id = uuid.uuid4().hex
+        self.schema = pyarrow.schema([
+            pyarrow.field("namespace", pyarrow.string()),
+            pyarrow.field("metric", pyarrow.string()),
+            pyarrow.field("resource_group", pyarrow.string()),
+            pyarrow.field("dimensions", pyarrow.string()),
+            pyarrow.field("timestamp", pyarrow.timestamp("s", tz="UTC")),
+            pyarrow.field("value", pyarrow.float64()),
+        ])
+        self._buffers = {}      # (namespace, day) -> list of column chunks
+        self._buffered = {}     # (namespace, day) -> buffered row count
+        self._writers = {}      # (namespace, day) -> ParquetWriter
+
+    def write_series(self, series):
+        if not len(series):
+            return
+        timestamps = series.timestamps.astype("datetime64[s]")
+        days = timestamps.astype("datetime64[D]")
+        # Series are sorted by time, so each day is one contiguous slice
+        boundaries = np.flatnonzero(np.r_[True, days[1:] != days[:-1], True])
+        dimensions = json.dumps(series.dimensions, sort_keys=True)
+        for begin, end in zip(boundaries[:-1].tolist(), boundaries[1:].tolist()):
+            partition = (series.namespace or "", str(days[begin]))
+            self._buffers.setdefault(partition, []).append(
+                (series.name, series.resource_group, dimensions, timestamps[begin:end], series.values[begin:end]))
+            self._buffered[partition] = self._buffered.get(partition, 0) + end - begin
+            if self._buffered[partition] >= self.flush_rows:
+                self._flush(partition)
+
+    def _flush(self, partition: tuple):
+        chunks = self._buffers.pop(partition, [])
+        rows = self._buffered.pop(partition, 0)
+        if not rows:
+            return
+        namespace, day = partition
+        lengths = [len(c[3]) for c in chunks]
+
+        def repeat(column: int):
+            # Per-series strings repeated to per-row values
+            return np.repeat(np.array([c[column] for c in chunks], dtype=object), lengths)
+
+        table = pyarrow.table({
+            "namespace": pyarrow.array(np.full(rows, namespace, dtype=object), pyarrow.string()),
+            "metric": pyarrow.array(repeat(0), pyarrow.string()),
+            "resource_group": pyarrow.array(repeat(1), pyarrow.string()),
+            "dimensions": pyarrow.array(repeat(2), pyarrow.string()),
+            "timestamp": pyarrow.array(np.concatenate([c[3] for c in chunks]), pyarrow.timestamp("s", tz="UTC")),
+            "value": pyarrow.array(np.concatenate([c[4] for c in chunks]), pyarrow.float64()),
+        }, schema=self.schema)
+        writer = self._writers.get(partition)
+        if writer is None:
+            directory = os.path.join(self.root_dir, f"namespace={namespace}", f"date={day}")
+            os.makedirs(directory, exist_ok=True)
+            writer = pyarrow.parquet.ParquetWriter(os.path.join(directory, f"part-{self.run_id}.parquet"), self.schema,
+                                                   compression=self.compression)
+            self._writers[partition] = writer
+        writer.write_table(table)
+        self.rows_written += rows
+        logger.debug(f"Flushed {rows} rows to {namespace}/{day} (total {self.rows_written})")
+
+    def close(self):
+        for partition in list(self._buffers):
+            self._flush(partition)
+        for writer in self._writers.values():
+            writer.close()
+        logger.info(f"Wrote {self.rows_written} rows in {len(self._writers)} partitions under {self.root_dir}")
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Parts are still closed (so they stay readable), but they hold only what arrived before the failure
+        partitions = len(self._writers) + len(set(self._buffers) - set(self._writers))
+        self.close()
+        if exc_type is not None:
+            logger.warning(f"Export failed - part-{self.run_id}.parquet in {partitions} partition(s) under "
+                           f"{self.root_dir} is incomplete")
+        return False
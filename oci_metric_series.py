@@ -0,0 +1,54 @@
+# OCI Metric Series
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# MetricSeries and the query interval helper, without any OCI SDK import.
+#
+# oci_monitoring_query.py returns MetricSeries and re-exports both names.  Offline tools such as
+# the alarm backtest benchmark import them from here, so they run without the SDK installed.
+
+# Usage:
+#   step = interval_seconds("CpuUtilization[5m].mean()")      # 300
+#   MetricSeries("CpuUtilization", "oci_computeagent", {"resourceId": ocid}, timestamps, values)
+
+import re
+
+import numpy as np
+
+# Constants
+INTERVAL_REGEX = r'\[(\d+)([mhd])\]'
+RESOLUTION_REGEX = r'(\d+)([mhd])'
+INTERVAL_UNITS = {"m": 60, "h": 3600, "d": 86400}
+
+
+def interval_seconds(query: str, resolution: str = None) -> int:
+    """Seconds per datapoint - from the resolution if set, else the [interval] in the query (def 1m)"""
+    match = re.fullmatch(RESOLUTION_REGEX, resolution) if resolution else None
+    if not match:
+        match = re.search(INTERVAL_REGEX, query)
+    if match:
+        return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+    return 60
+
+
+class MetricSeries:
+    """One metric stream - name, dimensions and NumPy timestamp/value arrays"""
+
+    def __init__(self, name: str, namespace: str, dimensions: dict, timestamps: np.ndarray, values: np.ndarray,
+                 resource_group: str = None):
+        self.name = name
+        self.namespace = namespace
+        self.dimensions = dimensions
+        self.resource_group = resource_group
+        self.timestamps = timestamps
+        self.values = values
+
+    @property
+    def key(self) -> tuple:
+        return (self.name, tuple(sorted(self.dimensions.items())))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return f"MetricSeries({self.name}, {self.dimensions}, points={len(self)})"
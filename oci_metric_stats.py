@@ -0,0 +1,284 @@
+# OCI Metric Statistics
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Vectorized statistics over many metric series at once.
+#
+# Series (MetricSeries from oci_monitoring_query, or raw MetricData from summarize_metrics_data)
+# are converted once into a NaN-padded matrix (one row per series).  Every statistic is then a
+# single array operation across all rows - no "sum = sum + dp.value" loops per series.
+#
+# Statistics: count, mean, min, max, percentile, threshold breach count/fraction, trend slope (per day)
+
+# Usage:
+#   stats = SeriesStats.from_series(monitoring_query.run(...))
+#   stats.mean(), stats.percentile(95), stats.breaches(90.0), stats.slope()
+#
+#   running = RunningStats(threshold=90.0)       # count / mean / max / breaches without holding the series
+#   for series_list in monitoring_query.stream(...):
+#       running.add(series_list)
+#
+# Benchmark (10k series x 2k points, loop vs vectorized):
+#   python3 oci_metric_stats.py
+
+import argparse
+import logging
+import time
+
+import numpy as np
+
+# Local
+from oci_metric_series import MetricSeries
+
+logger = logging.getLogger('oci-metric-stats')
+
+SECONDS_PER_DAY = 86400.0
+OPERATORS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}
+
+
+class SeriesStats:
+    """NaN-padded (series x points) matrix with vectorized per-series statistics"""
+
+    def __init__(self, values: np.ndarray, times: np.ndarray, counts: np.ndarray, series: list = None):
+        self.values = values      # float64, NaN padded
+        self.times = times        # float64 epoch seconds, NaN padded
+        self.counts = counts      # points per series
+        self.series = series      # original series objects (row order)
+
+    @classmethod
+    def from_arrays(cls, value_arrays: list, time_arrays: list = None, series: list = None):
+        """Build from per-series 1-d arrays (one concatenate + one scatter, no per-point work)"""
+        counts = np.fromiter((len(v) for v in value_arrays), dtype=np.int64, count=len(value_arrays))
+        width = int(counts.max()) if len(counts) else 0
+        values = np.full((len(counts), width), np.nan)
+        times = np.full((len(counts), width), np.nan)
+        if counts.sum():
+            rows = np.repeat(np.arange(len(counts)), counts)
+            offsets = np.repeat(np.cumsum(counts) - counts, counts)
+            cols = np.arange(counts.sum()) - offsets
+            values[rows, cols] = np.concatenate(value_arrays)
+            if time_arrays is not None:
+                times[rows, cols] = np.concatenate(time_arrays)
+        return cls(values, times, counts, series)
+
+    @classmethod
+    def from_series(cls, series_list: list):
+        """From MetricSeries (oci_monitoring_query)"""
+        return cls.from_arrays([s.values for s in series_list],
+                               [s.timestamps.astype("datetime64[s]").astype(np.float64) for s in series_list],
+                               series_list)
+
+    @classmethod
+    def from_metric_data(cls, metric_data_list: list):
+        """From raw MetricData (summarize_metrics_data(...).data) - datapoints converted once"""
+        value_arrays = []
+        time_arrays = []
+        for metric in metric_data_list:
+            points = metric.aggregated_datapoints
+            value_arrays.append(np.fromiter((dp.value for dp in points), dtype=np.float64, count=len(points)))
+            time_arrays.append(np.fromiter((dp.timestamp.timestamp() for dp in points), dtype=np.float64, count=len(points)))
+        return cls.from_arrays(value_arrays, time_arrays, metric_data_list)
+
+    def __len__(self):
+        return len(self.counts)
+
+    # Statistics - each returns one value per series (NaN for empty series)
+
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.nansum(self.values, axis=1) / self.counts
+
+    def max(self) -> np.ndarray:
+        return np.where(self.counts > 0, np.fmax.reduce(self.values, axis=1, initial=-np.inf), np.nan)
+
+    def min(self) -> np.ndarray:
+        return np.where(self.counts > 0, np.fmin.reduce(self.values, axis=1, initial=np.inf), np.nan)
+
+    def percentile(self, q: float) -> np.ndarray:
+        """Linear-interpolated percentile; sorting puts NaN padding at the end of each row"""
+        ordered = np.sort(self.values, axis=1)
+        position = (self.counts - 1).clip(min=0) * (q / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, (self.counts - 1).clip(min=0))
+        rows = np.arange(len(self))
+        if not ordered.shape[1]:
+            return np.full(len(self), np.nan)
+        low_values = ordered[rows, lower]
+        high_values = ordered[rows, upper]
+        result = low_values + (high_values - low_values) * (position - lower)
+        return np.where(self.counts > 0, result, np.nan)
+
+    def breaches(self, threshold: float, op: str = ">") -> np.ndarray:
+        """Number of points per series that breach the threshold (NaN padding never breaches)"""
+        with np.errstate(invalid="ignore"):
+            return OPERATORS[op](self.values, threshold).sum(axis=1)
+
+    def breach_fraction(self, threshold: float, op: str = ">") -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.breaches(threshold, op) / self.counts
+
+    def slope(self) -> np.ndarray:
+        """Least-squares trend per series, in value units per day"""
+        return linear_fit(self.values, self.times / SECONDS_PER_DAY)[0]
+
+    def summary(self, threshold: float = None, op: str = ">") -> list:
+        """Per-series dict of the common statistics (for printing/writing)"""
+        columns = {"count": self.counts, "mean": self.mean(), "min": self.min(), "max": self.max(),
+                   "p95": self.percentile(95), "slope_per_day": self.slope()}
+        if threshold is not None:
+            columns["breaches"] = self.breaches(threshold, op)
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*(columns[n].tolist() for n in names))]
+
+
+class RunningStats:
+    """Count, mean, max and threshold breaches per series, accumulated chunk by chunk (MonitoringQuery.stream)
+
+    Only the running totals are kept - series holds each series' name / dimensions without datapoints."""
+
+    def __init__(self, threshold: float = None, op: str = ">"):
+        self.threshold = threshold
+        self.op = op
+        self.series = []                     # first chunk of each series with the datapoints dropped (row order)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.totals = np.zeros(0)
+        self.maximums = np.zeros(0)
+        self.breach_counts = np.zeros(0, dtype=np.int64)
+        self._rows = {}                      # series key -> row
+
+    def _row(self, series) -> int:
+        row = self._rows.get(series.key)
+        if row is None:
+            row = self._rows[series.key] = len(self.series)
+            self.series.append(MetricSeries(series.name, series.namespace, series.dimensions, np.zeros(0, dtype="datetime64[s]"),
+                                            np.zeros(0), resource_group=series.resource_group))
+        return row
+
+    def add(self, series_list: list):
+        """Fold one chunk of series into the totals"""
+        if not series_list:
+            return
+        rows = np.fromiter((self._row(s) for s in series_list), dtype=np.int64, count=len(series_list))
+        grow = len(self.series) - len(self.counts)
+        if grow:
+            self.counts = np.r_[self.counts, np.zeros(grow, dtype=np.int64)]
+            self.totals = np.r_[self.totals, np.zeros(grow)]
+            self.maximums = np.r_[self.maximums, np.full(grow, -np.inf)]
+            self.breach_counts = np.r_[self.breach_counts, np.zeros(grow, dtype=np.int64)]
+        stats = SeriesStats.from_series(series_list)
+        np.add.at(self.counts, rows, stats.counts)
+        np.add.at(self.totals, rows, np.nansum(stats.values, axis=1))
+        np.fmax.at(self.maximums, rows, np.fmax.reduce(stats.values, axis=1, initial=-np.inf))
+        if self.threshold is not None:
+            np.add.at(self.breach_counts, rows, stats.breaches(self.threshold, self.op))
+
+    def __len__(self):
+        return len(self.series)
+
+    def mean(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.totals / self.counts
+
+    def max(self) -> np.ndarray:
+        return np.where(self.counts > 0, self.maximums, np.nan)
+
+    def breaches(self) -> np.ndarray:
+        return self.breach_counts
+
+
+def linear_fit(values: np.ndarray, x: np.ndarray) -> tuple:
+    """Least-squares line per row of a NaN padded matrix - returns (slope, intercept) arrays
+
+    x is either one row shared by every series or a matrix the same shape as values."""
+    x = np.broadcast_to(x, values.shape)
+    valid = ~np.isnan(values) & ~np.isnan(x)
+    n = valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = np.where(valid, x, 0).sum(axis=1) / n
+        y_mean = np.where(valid, values, 0).sum(axis=1) / n
+        dx = np.where(valid, x - x_mean[:, None], 0)
+        dy = np.where(valid, values - y_mean[:, None], 0)
+        slope = (dx * dy).sum(axis=1) / (dx * dx).sum(axis=1)
+    return slope, y_mean - slope * x_mean
+
+
+def align(series_list: list, step: int) -> tuple:
+    """Put MetricSeries on one time grid - (grid epoch seconds, series x grid values, NaN where missing)"""
+    stamps = [s.timestamps.astype("datetime64[s]").astype(np.int64) for s in series_list]
+    counts = np.fromiter((len(t) for t in stamps), dtype=np.int64, count=len(stamps))
+    if not counts.sum():
+        return np.zeros(0, dtype=np.int64), np.zeros((len(series_list), 0))
+    first = min(int(t[0]) for t in stamps if len(t)) // step * step
+    last = max(int(t[-1]) for t in stamps if len(t))
+    grid = np.arange(first, last + 1, step, dtype=np.int64)
+    values = np.full((len(series_list), len(grid)), np.nan)
+    rows = np.repeat(np.arange(len(series_list)), counts)
+    cols = (np.concatenate(stamps) - first) // step
+    values[rows, cols] = np.concatenate([s.values for s in series_list])
+    return grid, values
+
+
+def mean_by_resource(series_by_resource: dict, first_only: bool = True) -> dict:
+    """Mean per resource for MetricBatcher.fetch() output - {resource: mean} (resources without data omitted)
+
+    first_only matches the original scripts, which averaged the first returned series only."""
+    keys = []
+    metric_data = []
+    for key, series_list in series_by_resource.items():
+        for metric in (series_list[:1] if first_only else series_list):
+            keys.append(key)
+            metric_data.append(metric)
+    stats = SeriesStats.from_metric_data(metric_data)
+    if not len(stats):
+        return {}
+    # Combine multiple series per resource by total / count
+    key_index = {}
+    codes = np.fromiter((key_index.setdefault(k, len(key_index)) for k in keys), dtype=np.int64, count=len(keys))
+    totals = np.bincount(codes, weights=np.nansum(stats.values, axis=1), minlength=len(key_index))
+    counts = np.bincount(codes, weights=stats.counts, minlength=len(key_index))
+    return {key: float(totals[i] / counts[i]) for key, i in key_index.items() if counts[i] > 0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--series", help="Synthetic series (def=10000)", type=int, default=10000)
+    parser.add_argument("-p", "--points", help="Points per series (def=2000)", type=int, default=2000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+
+    rng = np.random.default_rng(3)
+    value_arrays = [rng.normal(50, 15, args.points) for _ in range(args.series)]
+    time_arrays = [np.arange(args.points, dtype=np.float64) * 300 for _ in range(args.series)]
+    logger.info(f"Benchmark: {args.series} series x {args.points} points")
+
+    # What the scripts do today - Python accumulation per series
+    start = time.perf_counter()
+    loop_means = []
+    loop_breaches = []
+    for values in value_arrays:
+        total = 0
+        over = 0
+        for value in values.tolist():
+            total = total + value
+            if value > 90:
+                over += 1
+        loop_means.append(total / len(values))
+        loop_breaches.append(over)
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stats = SeriesStats.from_arrays(value_arrays, time_arrays)
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    means = stats.mean()
+    stats.max()
+    stats.percentile(95)
+    breaches = stats.breaches(90)
+    stats.slope()
+    vector_time = time.perf_counter() - start
+
+    assert np.allclose(means, loop_means) and (breaches == np.array(loop_breaches)).all()
+    logger.info(f"Python loop (mean + breaches):              {loop_time:.3f}s")
+    logger.info(f"Matrix build (once):                        {build_time:.3f}s")
+    logger.info(f"Vectorized (mean, max, p95, breaches, slope): {vector_time:.3f}s")
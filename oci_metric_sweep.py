@@ -0,0 +1,226 @@
+# OCI Metric Sweep
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Fleet-wide metric sweep - one metric query across a compartment subtree and all subscribed regions.
+#
+# Looping oci-metrics-query.py in shell per compartment / region pays client and auth setup
+# every time.  This module:
+# 1) Lists subscribed regions (or uses -rg) and the ACTIVE compartments under the root (subtree)
+# 2) Creates ONE MonitoringClient per region and reuses it for every compartment in that region
+# 3) Runs the (region, compartment) queries concurrently, through the shared adaptive rate limiter
+#    (oci_rate_limiter.py) - one bucket per region
+# 4) Tags each series with region and compartment dimensions and merges them into one list - a
+#    query that fails (service error, timeout, connection error) is recorded in failures and the
+#    sweep carries on
+# 5) Logs progress and throughput as it runs
+
+# Usage:
+#   sweep = MetricSweep(config, threads=8, limiter=RateLimiter(10, max_rate=10))
+#   series = sweep.run(root_compartment, namespace, query, start_time, end_time)
+#   for series_list in sweep.stream(...):        # one (region, compartment) query at a time, as they complete
+#
+#   python3 oci_metric_sweep.py -c <root compartment> -n oci_computeagent -q 'CpuUtilization[1h].mean()' -d 7 [-f csv]
+
+import argparse
+import json
+import logging
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from oci import config
+from oci import pagination
+from oci.auth.signers import InstancePrincipalsSecurityTokenSigner
+from oci.exceptions import ServiceError, ConfigFileNotFound
+from oci.identity import IdentityClient
+from oci.monitoring import MonitoringClient
+
+# Local
+from oci_monitoring_query import MonitoringQuery
+from oci_metric_stats import SeriesStats
+from oci_rate_limiter import RateLimiter
+from oci_region_fanout import RegionClients
+from oci_report_writer import ReportWriter, report_filename
+
+logger = logging.getLogger('oci-metric-sweep')
+
+# Constants
+DEFAULT_THREADS = 8
+DEFAULT_CALLS_PER_SECOND = 10.0        # max per region - Monitoring read APIs throttle around here
+PROGRESS_SECONDS = 10
+REGION_DIMENSION = "region"
+COMPARTMENT_DIMENSION = "compartmentId"
+
+
+class MetricSweep:
+    """Same metric query over every (region, compartment) pair, concurrently"""
+
+    def __init__(self, config: dict, signer=None, threads: int = DEFAULT_THREADS, limiter: RateLimiter = None):
+        self.clients = RegionClients(config, signer, limiter or RateLimiter(DEFAULT_CALLS_PER_SECOND, max_rate=DEFAULT_CALLS_PER_SECOND))
+        self.threads = threads
+        self.identity_client = self.clients.client(IdentityClient)
+        self.tenancy_id = self.clients.tenancy_id
+        self.failures = []
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def query_engine(self, region: str) -> MonitoringQuery:
+        """One rate limited MonitoringClient per region, created on first use"""
+        with self._lock:
+            if region not in self._queries:
+                # Chunks run serially - the sweep itself is the parallelism
+                self._queries[region] = MonitoringQuery(self.clients.client(MonitoringClient, region), threads=1)
+            return self._queries[region]
+
+    @property
+    def calls(self) -> int:
+        return sum(q.calls for q in self._queries.values())
+
+    def regions(self) -> list:
+        return [r.region_name for r in self.identity_client.list_region_subscriptions(tenancy_id=self.tenancy_id).data
+                if r.status == "READY"]
+
+    def _children(self, compartment_id: str, in_subtree: bool = False) -> list:
+        return [c.id for c in pagination.list_call_get_all_results(
+            self.identity_client.list_compartments,
+            compartment_id,
+            access_level="ACCESSIBLE",
+            compartment_id_in_subtree=in_subtree,
+            lifecycle_state="ACTIVE"
+        ).data]
+
+    def compartments(self, root_compartment_id: str, subtree: bool = True) -> list:
+        """Root plus ACTIVE compartments below it"""
+        compartment_ids = [root_compartment_id]
+        if not subtree:
+            return compartment_ids
+        if root_compartment_id == self.tenancy_id:
+            # compartmentIdInSubtree is only accepted on the tenancy
+            return compartment_ids + self._children(root_compartment_id, in_subtree=True)
+        # Any other root - one level at a time
+        level = [root_compartment_id]
+        while level:
+            level = [child for parent in level for child in self._children(parent)]
+            compartment_ids.extend(level)
+        return compartment_ids
+
+    def _run_one(self, region: str, compartment_id: str, namespace: str, query: str, start_time: datetime,
+                 end_time: datetime, resolution: str, resource_group: str) -> list:
+        series_list = self.query_engine(region).run(compartment_id, namespace, query, start_time, end_time,
+                                                   resolution=resolution, resource_group=resource_group)
+        for series in series_list:
+            series.dimensions.setdefault(REGION_DIMENSION, region)
+            series.dimensions.setdefault(COMPARTMENT_DIMENSION, compartment_id)
+        return series_list
+
+    def stream(self, root_compartment_id: str, namespace: str, query: str, start_time: datetime, end_time: datetime,
+               resolution: str = None, resource_group: str = None, regions: list = None, subtree: bool = True):
+        """Sweep every region x compartment - yields each query's region/compartment tagged MetricSeries as it completes"""
+        regions = regions or self.regions()
+        compartment_ids = self.compartments(root_compartment_id, subtree)
+        tasks = [(r, c) for r in regions for c in compartment_ids]
+        logger.info(f"Sweep {namespace} {query}: {len(regions)} region(s) x {len(compartment_ids)} compartment(s) = {len(tasks)} queries")
+
+        series_count = 0
+        failed = 0
+        started = time.monotonic()
+        last_report = started
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="sweep") as executor:
+            pending = {executor.submit(self._run_one, r, c, namespace, query, start_time, end_time, resolution, resource_group): (r, c)
+                       for r, c in tasks}
+            for done, future in enumerate(futures.as_completed(pending), start=1):
+                region, compartment_id = pending.pop(future)
+                series_list = []
+                try:
+                    series_list = future.result()
+                except ServiceError as exc:
+                    failed += 1
+                    self.failures.append((region, compartment_id, f"{exc.status} {exc.code} {exc.message}"))
+                    logger.error(f"{region} {compartment_id}: {exc.status} {exc.code} {exc.message}")
+                except Exception as exc:
+                    # Timeouts and connection errors (after the SDK retries) only lose this query
+                    failed += 1
+                    self.failures.append((region, compartment_id, f"{type(exc).__name__}: {exc}"))
+                    logger.error(f"{region} {compartment_id}: {type(exc).__name__}: {exc}")
+                series_count += len(series_list)
+                now = time.monotonic()
+                if now - last_report >= PROGRESS_SECONDS or done == len(tasks):
+                    elapsed = now - started
+                    logger.info(f"Progress {done}/{len(tasks)} queries, {series_count} series, {self.calls} calls "
+                                f"({self.calls / elapsed:.1f} calls/s, {done / elapsed:.1f} queries/s), {failed} failed")
+                    last_report = now
+                if series_list:
+                    yield series_list
+
+    def run(self, root_compartment_id: str, namespace: str, query: str, start_time: datetime, end_time: datetime,
+            resolution: str = None, resource_group: str = None, regions: list = None, subtree: bool = True) -> list:
+        """Sweep every region x compartment - returns one merged list of region/compartment tagged MetricSeries"""
+        return [series for series_list in self.stream(root_compartment_id, namespace, query, start_time, end_time,
+                                                      resolution=resolution, resource_group=resource_group,
+                                                      regions=regions, subtree=subtree)
+                for series in series_list]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-pr", "--profile", help="Config Profile, named", default="DEFAULT")
+    parser.add_argument("-ip", "--instanceprincipal", help="Use Instance Principal Auth - negates --profile", action="store_true")
+    parser.add_argument("-c", "--compartmentocid", help="Root Compartment OCID (def=tenancy)")
+    parser.add_argument("-ns", "--nosubtree", help="Only the root compartment, not its subtree", action="store_true")
+    parser.add_argument("-rg", "--regions", help="Regions to sweep (def=all subscribed)", nargs='+')
+    parser.add_argument("-n", "--namespace", help="Metrics Namespace", required=True)
+    parser.add_argument("-q", "--query", help="Full metric query", required=True)
+    parser.add_argument("-r", "--resourcegroup", help="Resource Group")
+    parser.add_argument("-d", "--days", help="Days of data (def=1)", type=int, default=1)
+    parser.add_argument("-th", "--threads", help=f"Concurrent queries (def={DEFAULT_THREADS})", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("-rps", "--ratelimit", help=f"Max calls per second per region - the limiter backs off below this on 429s (def={DEFAULT_CALLS_PER_SECOND})", type=float, default=DEFAULT_CALLS_PER_SECOND)
+    parser.add_argument("-f", "--format", help="Write datapoints to ndjson/csv/parquet instead of printing a summary", choices=["ndjson", "csv", "parquet"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    if args.instanceprincipal:
+        logger.info("Using Instance Principal Authentication")
+        signer = InstancePrincipalsSecurityTokenSigner()
+        config = {"region": signer.region}
+    else:
+        try:
+            logger.info(f"Using Profile Authentication: {args.profile}")
+            config = config.from_file(profile_name=args.profile)
+            signer = None
+        except ConfigFileNotFound as exc:
+            logger.fatal(f"Unable to use Profile Authentication: {exc}")
+            exit(1)
+
+    sweep = MetricSweep(config, signer=signer, threads=args.threads, limiter=RateLimiter(args.ratelimit, max_rate=args.ratelimit))
+    end_time = datetime.utcnow()
+    start_time = end_time - timedelta(days=args.days)
+    try:
+        metric_series = sweep.run(args.compartmentocid or sweep.tenancy_id, args.namespace, args.query, start_time, end_time,
+                                  resource_group=args.resourcegroup, regions=args.regions, subtree=not args.nosubtree)
+    except ServiceError as exc:
+        logger.error(f"Failed to list regions / compartments: {exc}")
+        exit(1)
+    sweep.clients.limiter.log_summary()
+
+    if args.format:
+        filename = report_filename(f"metric-sweep-{args.namespace}-{datetime.now().strftime('%Y-%m-%d-%H-%M')}", args.format)
+        # Fixed columns - dimension keys differ between series, so they go out as one JSON string
+        with ReportWriter(filename, format=args.format) as writer:
+            for series in metric_series:
+                dimensions = json.dumps(series.dimensions, sort_keys=True)
+                writer.write_rows({"region": series.dimensions[REGION_DIMENSION], "compartment_id": series.dimensions[COMPARTMENT_DIMENSION],
+                                   "metric": series.name, "dimensions": dimensions, "timestamp": str(ts), "value": value}
+                                  for ts, value in zip(series.timestamps, series.values.tolist()))
+        logger.info(f"Script complete - wrote {args.format} to {filename}.")
+    else:
+        stats = SeriesStats.from_series(metric_series)
+        for series, mean, maximum in zip(metric_series, stats.mean().tolist(), stats.max().tolist()):
+            print(f'{series.dimensions[REGION_DIMENSION]} {series.name} {series.dimensions.get("resourceDisplayName", series.dimensions.get("resourceId", ""))}: '
+                  f'points {len(series)} mean {mean:.2f} max {maximum:.2f}')
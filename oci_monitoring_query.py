@@ -0,0 +1,251 @@
+# OCI Monitoring Query
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Shared metric query engine for the metrics scripts.
+#
+# A single SummarizeMetricsDataDetails over a long --days window at a fine interval runs into the
+# Monitoring service limit on datapoints per response - counted over ALL the streams the query
+# matches, so a query over many resources hits it much sooner than one series would.  This module:
+# 1) Queries the most recent PROBE_POINTS intervals first, to learn how many streams match
+# 2) Splits the rest of the window into chunks of at most MAX_POINTS / streams intervals (and
+#    POINTS_PER_CHUNK), aligned to interval boundaries
+# 3) Runs the chunks concurrently, through the shared adaptive rate limiter (oci_rate_limiter.py) -
+#    a chunk that comes back at the limit, or is refused for it (more streams than in the probe),
+#    is split in half and queried again
+# 4) Stitches the chunks back together per series (metric name + dimensions), dropping duplicate
+#    timestamps at chunk edges
+# 5) Returns each series as NumPy arrays (timestamps as datetime64[s], values as float64) - run()
+#    returns whole series, stream() yields them chunk by chunk as the chunks arrive
+
+# Usage:
+#   engine = MonitoringQuery(monitoring_client, threads=4, limiter=limiter)
+#   for series in engine.run(comp_ocid, "oci_computeagent", "CpuUtilization[1m].mean()", start, end):
+#       series.dimensions["resourceDisplayName"], series.values.mean()
+#
+#   for series_list in engine.stream(...):     # one chunk at a time, oldest first - for exporters
+#       writer.write_series(...)
+
+import logging
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from oci.exceptions import ServiceError
+from oci.monitoring import MonitoringClient
+from oci.monitoring.models import SummarizeMetricsDataDetails
+
+# Local - MetricSeries and interval_seconds are re-exported from here
+from oci_metric_series import MetricSeries, interval_seconds
+from oci_rate_limiter import RateLimiter, RateLimitedClient
+
+logger = logging.getLogger('oci-monitoring-query')
+
+# Constants
+DEFAULT_THREADS = 4
+POINTS_PER_CHUNK = 8640                # per stream - 6 days at 1m, 30 days at 5m
+MAX_POINTS = 100000                    # per response, all streams (service limit)
+POINTS_HEADROOM = 0.8                  # of MAX_POINTS - streams can come and go over the window
+PROBE_POINTS = 60                      # intervals in the first (most recent) chunk
+LIMIT_REGEX = r'data ?points|too many|exceed'
+MAX_CHUNK = timedelta(days=90)         # Never ask for more than this in one call
+
+
+def _utc(value: datetime) -> datetime:
+    # Scripts pass naive datetimes meaning UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def chunk_window(start_time: datetime, end_time: datetime, step_seconds: int, points: int = POINTS_PER_CHUNK) -> list:
+    """Split [start, end) into chunks of at most `points` steps, on step boundaries"""
+    start_time = _utc(start_time)
+    end_time = _utc(end_time)
+    chunk = min(timedelta(seconds=step_seconds * max(1, points)), MAX_CHUNK)
+    # Align boundaries to the interval so chunks do not split an aggregation window
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    chunk_seconds = max(int(chunk.total_seconds()) // step_seconds, 1) * step_seconds
+    first = int((start_time - epoch).total_seconds()) // step_seconds * step_seconds
+    chunks = []
+    begin = epoch + timedelta(seconds=first)
+    while begin < end_time:
+        finish = min(begin + timedelta(seconds=chunk_seconds), end_time)
+        chunks.append((max(begin, start_time), finish))
+        begin = finish
+    return chunks
+
+
+def points_per_stream(streams: int) -> int:
+    """Intervals per chunk so that `streams` series stay under the per-response limit"""
+    return max(1, min(POINTS_PER_CHUNK, int(MAX_POINTS * POINTS_HEADROOM) // max(1, streams)))
+
+
+def _at_limit(exc: ServiceError) -> bool:
+    return exc.status == 400 and re.search(LIMIT_REGEX, exc.message or "", re.IGNORECASE) is not None
+
+
+class MonitoringQuery:
+    """Chunked, concurrent summarize_metrics_data with per-series stitching"""
+
+    def __init__(self, monitoring_client: MonitoringClient, threads: int = DEFAULT_THREADS, limiter: RateLimiter = None):
+        # Concurrent chunks back off on 429s - a client that is already rate limited is used as is
+        if not isinstance(monitoring_client, RateLimitedClient):
+            monitoring_client = RateLimitedClient(monitoring_client, limiter or RateLimiter())
+        self.monitoring_client = monitoring_client
+        self.threads = threads
+        self.calls = 0
+        self.splits = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _details(namespace: str, query: str, begin: datetime, finish: datetime, resolution: str = None,
+                 resource_group: str = None) -> SummarizeMetricsDataDetails:
+        details = SummarizeMetricsDataDetails(
+            namespace=namespace,
+            query=query,
+            start_time=begin.isoformat(),
+            end_time=finish.isoformat()
+        )
+        if resolution:
+            details.resolution = resolution
+        if resource_group:
+            details.resource_group = resource_group
+        return details
+
+    def _query_chunk(self, compartment_id: str, details: SummarizeMetricsDataDetails, compartment_id_in_subtree: bool):
+        with self._lock:
+            self.calls += 1
+        logger.debug(f"Chunk {details.start_time} - {details.end_time}: {details.query}")
+        return self.monitoring_client.summarize_metrics_data(
+            compartment_id=compartment_id,
+            summarize_metrics_data_details=details,
+            compartment_id_in_subtree=compartment_id_in_subtree
+        ).data
+
+    def _fetch(self, compartment_id: str, namespace: str, query: str, begin: datetime, finish: datetime, step: int,
+               resolution: str = None, resource_group: str = None, compartment_id_in_subtree: bool = False) -> list:
+        """MetricData of [begin, finish) - halved and queried again while the response is at the limit"""
+        details = self._details(namespace, query, begin, finish, resolution, resource_group)
+        steps = int((finish - begin).total_seconds()) // step
+        try:
+            data = self._query_chunk(compartment_id, details, compartment_id_in_subtree)
+        except ServiceError as exc:
+            if steps < 2 or not _at_limit(exc):
+                raise
+            data = None
+        if data is not None and (steps < 2 or sum(len(m.aggregated_datapoints) for m in data) < MAX_POINTS):
+            return data
+        with self._lock:
+            self.splits += 1
+        middle = begin + timedelta(seconds=steps // 2 * step)
+        logger.debug(f"Chunk {details.start_time} - {details.end_time} at the datapoint limit, splitting")
+        return self._fetch(compartment_id, namespace, query, begin, middle, step, resolution, resource_group,
+                           compartment_id_in_subtree) + \
+            self._fetch(compartment_id, namespace, query, middle, finish, step, resolution, resource_group,
+                        compartment_id_in_subtree)
+
+    def stream(self, compartment_id: str, namespace: str, query: str, start_time: datetime, end_time: datetime,
+               resolution: str = None, resource_group: str = None, compartment_id_in_subtree: bool = False,
+               expected_series: int = None):
+        """Fetch the window chunk by chunk - yields a list of MetricSeries per chunk, oldest chunk first
+
+        A series shows up once in every chunk it has data in, and its timestamps never repeat across
+        chunks.  At most 2 x threads chunks are fetched ahead of the consumer.
+        expected_series sizes the chunks without the probe query."""
+        step = interval_seconds(query, resolution)
+
+        def fetch(window: tuple) -> list:
+            return self._fetch(compartment_id, namespace, query, window[0], window[1], step, resolution,
+                               resource_group, compartment_id_in_subtree)
+
+        probe = []
+        probe_data = []
+        rest = end_time
+        if expected_series is None:
+            # Most recent intervals first - how many streams match decides the chunk size
+            probe = chunk_window(start_time, end_time, step)[-1:]
+            probe = [(max(probe[0][0], probe[0][1] - timedelta(seconds=step * PROBE_POINTS)), probe[0][1])] if probe else []
+            probe_data = [fetch(window) for window in probe]
+            expected_series = len(probe_data[0]) if probe_data else 1
+            rest = probe[0][0] if probe else end_time
+        chunks = chunk_window(start_time, rest, step, points_per_stream(expected_series)) if _utc(rest) > _utc(start_time) else []
+        logger.info(f"Query {namespace} {query}: {expected_series} stream(s), {len(chunks) + len(probe)} chunk(s)")
+
+        last = {}       # series key -> last timestamp yielded
+
+        def fragments(metric_data_list: list) -> list:
+            series_list = []
+            for series in self.stitch([metric_data_list], namespace):
+                previous = last.get(series.key)
+                if previous is not None:
+                    # Chunk edges can return the same interval twice
+                    newer = series.timestamps > previous
+                    series.timestamps = series.timestamps[newer]
+                    series.values = series.values[newer]
+                if len(series):
+                    last[series.key] = series.timestamps[-1]
+                    series_list.append(series)
+            return series_list
+
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="metrics") as executor:
+            ahead = deque()
+            for chunk in chunks:
+                ahead.append(executor.submit(fetch, chunk))
+                if len(ahead) >= 2 * self.threads:
+                    yield fragments(ahead.popleft().result())
+            while ahead:
+                yield fragments(ahead.popleft().result())
+        for metric_data_list in probe_data:
+            yield fragments(metric_data_list)
+
+    def run(self, compartment_id: str, namespace: str, query: str, start_time: datetime, end_time: datetime,
+            resolution: str = None, resource_group: str = None, compartment_id_in_subtree: bool = False,
+            expected_series: int = None) -> list:
+        """Fetch the whole window - returns a list of MetricSeries (each sorted by timestamp)
+
+        expected_series sizes the chunks without the probe query."""
+        return self.merge(self.stream(compartment_id, namespace, query, start_time, end_time, resolution=resolution,
+                                      resource_group=resource_group, compartment_id_in_subtree=compartment_id_in_subtree,
+                                      expected_series=expected_series))
+
+    @staticmethod
+    def merge(chunk_series: list) -> list:
+        """Join the per-chunk MetricSeries from stream() into one MetricSeries per stream"""
+        merged = {}
+        for series_list in chunk_series:
+            for series in series_list:
+                merged.setdefault(series.key, []).append(series)
+        return [MetricSeries(parts[0].name, parts[0].namespace, parts[0].dimensions,
+                             np.concatenate([p.timestamps for p in parts]), np.concatenate([p.values for p in parts]),
+                             resource_group=parts[0].resource_group)
+                for parts in merged.values()]
+
+    @staticmethod
+    def stitch(chunk_results: list, namespace: str = None) -> list:
+        """Merge MetricData lists from several chunks into one MetricSeries per stream"""
+        merged = {}
+        for metric_data_list in chunk_results:
+            for metric in metric_data_list:
+                key = (metric.name, tuple(sorted((metric.dimensions or {}).items())))
+                entry = merged.setdefault(key, {"metric": metric, "timestamps": [], "values": []})
+                for dp in metric.aggregated_datapoints:
+                    entry["timestamps"].append(dp.timestamp.timestamp())
+                    entry["values"].append(dp.value)
+
+        series_list = []
+        for key, entry in merged.items():
+            timestamps = np.asarray(entry["timestamps"], dtype=np.float64).astype(np.int64)
+            values = np.asarray(entry["values"], dtype=np.float64)
+            # Sort and drop duplicate timestamps from overlapping chunk edges (keep the later chunk)
+            order = np.argsort(timestamps, kind="stable")
+            timestamps = timestamps[order]
+            values = values[order]
+            keep = np.r_[timestamps[1:] != timestamps[:-1], True] if len(timestamps) else np.zeros(0, dtype=bool)
+            metric = entry["metric"]
+            series_list.append(MetricSeries(metric.name, metric.namespace or namespace, dict(metric.dimensions or {}),
+                                            timestamps[keep].astype("datetime64[s]"), values[keep],
+                                            resource_group=metric.resource_group))
+        return series_list
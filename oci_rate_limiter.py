@@ -0,0 +1,295 @@
+# OCI Adaptive Rate Limiter
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# One call rate per (service, region, operation), shared by every worker thread of a script.
+#
+# --threads picked by hand plus DEFAULT_RETRY_STRATEGY means every thread hammers the API until it
+# gets a 429, then sleeps on its own - and hard-coded time.sleep between calls is slow when the API
+# is idle and still too fast when it is busy.  Instead:
+# 1) Each (service, region, operation) gets a token bucket - callers take a token before the call
+# 2) The rate adapts AIMD style: doubles every second of calls that had to wait for a token until
+#    the first cut (slow start), then +2 calls/s per second - cut by 30% on a 429 and by 10% when latency climbs to 3x the fastest seen
+# 3) Only calls started a second or more after the last cut can cut again, so one burst of 429s
+#    (the service still counts the calls from before the cut) is one decrease
+# 4) RateLimitedClient wraps any OCI client: 429s are retried here (after the cut, through the
+#    bucket again), everything else still goes through the SDK retry (5xx, timeouts, IncorrectState)
+# 5) With a tracer (oci_fleet_trace.py), every attempt, retry and 429 is counted into the span
+#    open on the calling thread, with the time it waited for a token
+#
+# python3 oci_rate_limiter.py --benchmark runs against a stand-in service that throttles above
+# 20 calls/s (busy) and 60 calls/s (idle) to compare SDK retries alone, a fixed sleep between
+# calls and the adaptive limiter.
+
+# Usage:
+#   limiter = RateLimiter()
+#   database_client = RateLimitedClient(DatabaseClient(config), limiter)
+#   database_client.get_autonomous_database(autonomous_database_id=ocid)   # from any thread
+#   limiter.log_summary()
+#
+#   python3 oci_rate_limiter.py --benchmark 600 [-t 16]
+
+import argparse
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from oci.exceptions import ServiceError
+from oci.retry import RetryStrategyBuilder
+
+logger = logging.getLogger('oci-rate-limiter')
+
+# Constants
+DEFAULT_RATE = 10.0                # calls/s a new bucket starts at
+MIN_RATE = 0.5
+MAX_RATE = 100.0
+BURST_SECONDS = 1.0                # bucket holds this many seconds of calls
+INCREASE = 2.0                     # calls/s added per second of limited calls
+THROTTLE_DECREASE = 0.7            # rate multiplier on a 429
+SLOW_DECREASE = 0.9                # rate multiplier when latency climbs
+SLOW_FACTOR = 3.0                  # smoothed latency over the fastest seen that counts as slow
+LATENCY_SMOOTHING = 0.2
+DECREASE_COOLDOWN = 1.0            # seconds after a cut before calls can cut again
+MAX_THROTTLE_RETRIES = 8
+
+# SDK retries for everything but 429 - throttling is handled by the limiter
+RETRY_WITHOUT_THROTTLING = RetryStrategyBuilder(
+    service_error_retry_config={-1: [], 409: ["IncorrectState"]},
+    service_error_retry_on_any_5xx=True
+).get_retry_strategy()
+
+ENDPOINT_REGION = re.compile(r'^https?://[^./]+\.([a-z]+-[a-z]+-[0-9]+)\.')
+
+
+class AdaptiveBucket:
+    """Token bucket whose rate follows 429s and latency (additive increase, multiplicative decrease)"""
+
+    def __init__(self, name: str, rate: float = DEFAULT_RATE, min_rate: float = MIN_RATE, max_rate: float = MAX_RATE):
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.calls = 0
+        self.throttled = 0
+        self.slowdowns = 0
+        self.waited = 0.0
+        self.fastest = None
+        self.latency = None
+        self._tokens = rate * BURST_SECONDS
+        self._updated = time.monotonic()
+        self._decreased = -DECREASE_COOLDOWN
+        self._slow_start = True
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, max(self.rate * BURST_SECONDS, 1.0))
+        self._updated = now
+
+    def acquire(self) -> float:
+        """Take a token, sleeping until there is one - returns the seconds slept"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1.0
+            self.calls += 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def _decrease(self, started: float, factor: float) -> bool:
+        # Calls started just after the last cut still count against the old rate - they do not cut again
+        if started < self._decreased + DECREASE_COOLDOWN:
+            return False
+        now = time.monotonic()
+        self._refill(now)
+        self.rate = max(self.rate * factor, self.min_rate)
+        self._tokens = min(self._tokens, 0.0)
+        self._decreased = now
+        self._slow_start = False
+        return True
+
+    def success(self, started: float, latency: float, limited: bool):
+        with self._lock:
+            self.fastest = latency if self.fastest is None else min(self.fastest, latency)
+            self.latency = latency if self.latency is None else \
+                self.latency + LATENCY_SMOOTHING * (latency - self.latency)
+            if self.latency > SLOW_FACTOR * self.fastest and self.latency > 0.05:
+                if self._decrease(started, SLOW_DECREASE):
+                    self.slowdowns += 1
+                    logger.debug(f"{self.name}: latency {self.latency:.2f}s - rate down to {self.rate:.1f}/s")
+            elif limited:
+                # Only grow while callers are actually waiting on the bucket
+                self.rate = min(self.rate + (1.0 if self._slow_start else INCREASE / self.rate), self.max_rate)
+
+    def throttle(self, started: float):
+        with self._lock:
+            self.throttled += 1
+            if self._decrease(started, THROTTLE_DECREASE):
+                logger.debug(f"{self.name}: 429 - rate down to {self.rate:.1f}/s")
+
+
+class RateLimiter:
+    """Adaptive buckets per (service, region, operation), created on first use"""
+
+    def __init__(self, rate: float = DEFAULT_RATE, min_rate: float = MIN_RATE, max_rate: float = MAX_RATE, tracer=None):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tracer = tracer
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, service: str, region: str, operation: str) -> AdaptiveBucket:
+        key = (service, region, operation)
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = AdaptiveBucket("/".join(key), self.rate, self.min_rate, self.max_rate)
+            return self._buckets[key]
+
+    @property
+    def buckets(self) -> dict:
+        with self._lock:
+            return dict(self._buckets)
+
+    @property
+    def calls(self) -> int:
+        return sum(b.calls for b in self.buckets.values())
+
+    @property
+    def throttled(self) -> int:
+        return sum(b.throttled for b in self.buckets.values())
+
+    def call(self, bucket: AdaptiveBucket, operation, *args, **kwargs):
+        """Call through the bucket - 429s cut the rate and go around again"""
+        for attempt in range(MAX_THROTTLE_RETRIES + 1):
+            waited = bucket.acquire()
+            started = time.monotonic()
+            try:
+                response = operation(*args, **kwargs)
+            except ServiceError as exc:
+                if self.tracer:
+                    self.tracer.api_call(retry=attempt > 0, throttled=exc.status == 429, waited=waited)
+                if exc.status != 429 or attempt == MAX_THROTTLE_RETRIES:
+                    raise
+                bucket.throttle(started)
+                continue
+            if self.tracer:
+                self.tracer.api_call(retry=attempt > 0, waited=waited)
+            bucket.success(started, time.monotonic() - started, waited > 0)
+            return response
+
+    def log_summary(self):
+        for key, bucket in sorted(self.buckets.items()):
+            logger.info(f"{bucket.name}: {bucket.calls} calls, {bucket.throttled} throttled, "
+                        f"{bucket.waited:.1f}s waited, rate now {bucket.rate:.1f}/s")
+
+
+class RateLimitedClient:
+    """Any OCI client, with every operation going through the limiter"""
+
+    def __init__(self, client, limiter: RateLimiter, region: str = None):
+        self.client = client
+        self.limiter = limiter
+        base_client = getattr(client, "base_client", None)
+        self.service = getattr(base_client, "service", None) or type(client).__name__.replace("Client", "").lower()
+        if region is None:
+            match = ENDPOINT_REGION.match(getattr(base_client, "endpoint", None) or "")
+            region = match.group(1) if match else "default"
+        self.region = region
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.client, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+        bucket = self.limiter.bucket(self.service, self.region, name)
+
+        def limited(*args, **kwargs):
+            kwargs.setdefault("retry_strategy", RETRY_WITHOUT_THROTTLING)
+            return self.limiter.call(bucket, attribute, *args, **kwargs)
+        limited.__name__ = name
+        return limited
+
+
+########################################
+# Benchmark - stand-in service that throttles above a fixed rate
+
+class _ThrottlingService:
+    """get_thing that answers 429 once more than `capacity` calls arrive within a second
+
+    Latency grows as the service gets close to capacity, like a busy control plane"""
+
+    def __init__(self, capacity: float = 20.0, latency: float = 0.05):
+        self.capacity = capacity
+        self.base_latency = latency
+        self.calls = 0
+        self.throttled = 0
+        self._arrivals = []
+        self._lock = threading.Lock()
+
+    def get_thing(self, thing_id: str, retry_strategy=None):
+        with self._lock:
+            now = time.monotonic()
+            self.calls += 1
+            self._arrivals = [t for t in self._arrivals if t > now - 1.0]
+            load = len(self._arrivals) / self.capacity
+            if load >= 1.0:
+                self.throttled += 1
+                throttle = True
+            else:
+                self._arrivals.append(now)
+                throttle = False
+        time.sleep(self.base_latency * (1 + 2 * load * load))
+        if throttle:
+            raise ServiceError(429, "TooManyRequests", {}, "Too many requests for the tenancy")
+        return thing_id
+
+
+def _sdk_retry(service: _ThrottlingService, thing_id: str):
+    # What DEFAULT_RETRY_STRATEGY does on 429: exponential backoff with jitter, per thread
+    delay = 1.0
+    while True:
+        try:
+            return service.get_thing(thing_id)
+        except ServiceError:
+            time.sleep(delay * (0.5 + (hash(thing_id) % 100) / 100))
+            delay = min(delay * 2, 30.0)
+
+
+def _fixed_sleep(service: _ThrottlingService, thing_id: str):
+    time.sleep(0.5)
+    return _sdk_retry(service, thing_id)
+
+
+def _benchmark(total: int, threads: int):
+    for capacity, name in [(c, n) for c in (20.0, 60.0) for n in ("SDK retry only", "Fixed 0.5s sleep", "Adaptive limiter")]:
+        service = _ThrottlingService(capacity)
+        if name == "Adaptive limiter":
+            limiter = RateLimiter()
+            client = RateLimitedClient(service, limiter, region="bench")
+            work = client.get_thing
+        else:
+            work = (lambda i, s=service, f=(_sdk_retry if name == "SDK retry only" else _fixed_sleep): f(s, i))
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="bench") as executor:
+            done = sum(1 for _ in executor.map(work, (f"thing{n}" for n in range(total))))
+        elapsed = time.perf_counter() - start
+        logger.info(f"{capacity:.0f}/s service - {name + ':':19} {done} calls in {elapsed:6.2f}s = {done / elapsed:5.1f}/s "
+                    f"({service.throttled} x 429 of {service.calls} requests)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
+    parser.add_argument("-t", "--threads", help="Concurrent Threads (def=16)", type=int, default=16)
+    parser.add_argument("--benchmark", help="Calls to make against each throttling stand-in (def=600)", type=int, default=600)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(threadName)s] %(levelname)s %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    _benchmark(args.benchmark, args.threads)
@@ -0,0 +1,108 @@
+# OCI Region Fan-out
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Runs a fleet script's per-region work in every subscribed region at once, instead of one
+# invocation per region with -r.
+#
+# 1) RegionClients creates clients per (client class, region) on first use from ONE config /
+#    signer, and routes each through the shared rate limiter with its region (oci_rate_limiter.py)
+# 2) subscribed_regions() lists the READY region subscriptions once
+# 3) RegionFanout.run() calls work(region, executor) for every region concurrently.  executor is
+#    ONE pool shared by all regions - its size is the global budget for the API work, however
+#    many regions there are.  A region that fails is logged and reported, the others carry on
+# 4) The per-region results come back in one dict, for the caller to merge into one report
+
+# Usage:
+#   clients = RegionClients(config, signer, RateLimiter())
+#   fanout = RegionFanout(clients.subscribed_regions(), budget=8)
+#   by_region = fanout.run(lambda region, executor: work(clients.client(DatabaseClient, region), executor))
+#   for region, result in by_region.items(): ...
+
+import logging
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+
+from oci.identity import IdentityClient
+from oci.retry import DEFAULT_RETRY_STRATEGY
+
+# Local
+from oci_rate_limiter import RateLimiter, RateLimitedClient
+
+logger = logging.getLogger('oci-region-fanout')
+
+# Constants
+DEFAULT_BUDGET = 8
+
+
+class RegionClients:
+    """OCI clients per (client class, region) from one config / signer, all through one rate limiter"""
+
+    def __init__(self, config: dict, signer=None, limiter: RateLimiter = None):
+        self.config = config
+        self.signer = signer
+        self.limiter = limiter or RateLimiter()
+        self.region = config.get("region") or getattr(signer, "region", None)
+        self.tenancy_id = signer.tenancy_id if signer else config["tenancy"]
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, client_class, region: str = None, **kwargs):
+        """Rate limited client for the region (default: the config / signer region), created once"""
+        region = region or self.region
+        key = (client_class, region)
+        with self._lock:
+            if key not in self._clients:
+                region_config = dict(self.config, region=region) if region else dict(self.config)
+                kwargs.setdefault("retry_strategy", DEFAULT_RETRY_STRATEGY)
+                if self.signer:
+                    client = client_class(config=region_config, signer=self.signer, **kwargs)
+                else:
+                    client = client_class(region_config, **kwargs)
+                self._clients[key] = RateLimitedClient(client, self.limiter, region=region)
+            return self._clients[key]
+
+    def subscribed_regions(self) -> list:
+        """READY region subscriptions, home region first"""
+        subscriptions = self.client(IdentityClient).list_region_subscriptions(tenancy_id=self.tenancy_id).data
+        ready = sorted((s for s in subscriptions if s.status == "READY"), key=lambda s: not s.is_home_region)
+        regions = [s.region_name for s in ready]
+        logger.info(f"Subscribed regions: {', '.join(regions)}")
+        return regions
+
+
+class RegionFanout:
+    """work(region, executor) for every region concurrently, sharing one budget-sized executor"""
+
+    def __init__(self, regions: list, budget: int = DEFAULT_BUDGET):
+        self.regions = regions
+        self.budget = budget
+        self.errors = {}
+        self.elapsed = {}
+
+    def _run_region(self, work, region: str, executor):
+        started = time.monotonic()
+        try:
+            return work(region, executor)
+        finally:
+            self.elapsed[region] = time.monotonic() - started
+
+    def run(self, work) -> dict:
+        """{region: work result} for the regions that finished - failures are in self.errors"""
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.budget, thread_name_prefix="work") as executor, \
+                ThreadPoolExecutor(max_workers=max(len(self.regions), 1), thread_name_prefix="region") as region_pool:
+            pending = {region_pool.submit(self._run_region, work, region, executor): region for region in self.regions}
+            logger.info(f"Started {len(pending)} region(s) sharing {self.budget} worker threads")
+            for future in futures.as_completed(pending):
+                region = pending[future]
+                try:
+                    results[region] = future.result()
+                    logger.info(f"{region}: finished in {self.elapsed[region]:.0f}s")
+                except Exception as exc:
+                    self.errors[region] = exc
+                    logger.error(f"{region}: failed after {self.elapsed.get(region, 0):.0f}s: {exc!r}")
+        # Region order as given (home region first), not completion order
+        return {region: results[region] for region in self.regions if region in results}
@@ -0,0 +1,246 @@
+# OCI Report Writer
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Streaming row writer shared by the report scripts.  Rows (dicts) are written as they are
+# produced to NDJSON, CSV or Parquet, so large reports never need to be held in memory.
+# Numeric values are kept numeric (no f"{x:.2f}" strings), so downstream tools do not re-parse.
+#
+# NDJSON and CSV support gzip/bz2/xz compression.  Parquet requires pyarrow (optional) and
+# supports its own codecs (snappy, gzip, zstd, ...).
+#
+# atomic=True writes to <filename>.partial and renames it to filename only when the writer is
+# closed without an exception - a run that dies leaves the .partial behind.  With resume_key, an
+# existing (uncompressed NDJSON/CSV) .partial is picked up again: rows already in it are kept,
+# their resume_key values are in writer.resumed, and new rows are appended.
+
+# Usage:
+#   with ReportWriter("cost.ndjson.gz", format="ndjson", compression="gzip") as writer:
+#       for row in rows:
+#           writer.write(row)
+#
+#   with ReportWriter("report.csv", format="csv", atomic=True, resume_key="PDB_OCID", flush_rows=1) as writer:
+#       todo = [p for p in pdbs if p.id not in writer.resumed]
+
+import bz2
+import csv
+import datetime
+import gzip
+import json
+import logging
+import lzma
+import os
+
+# Optional - only needed for Parquet output
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger('oci-report-writer')
+
+# Constants
+FORMATS = ["ndjson", "csv", "parquet"]
+TEXT_COMPRESSION = {"gzip": (gzip.open, ".gz"), "bz2": (bz2.open, ".bz2"), "xz": (lzma.open, ".xz")}
+FILE_EXTENSIONS = {"ndjson": ".ndjson", "csv": ".csv", "parquet": ".parquet"}
+DEFAULT_FLUSH_ROWS = 1000
+PARTIAL_SUFFIX = ".partial"
+
+
+def report_filename(basename: str, format: str, compression: str = None) -> str:
+    """Build a filename with the right extension(s) for the format and compression"""
+    filename = f"{basename}{FILE_EXTENSIONS[format]}"
+    if compression and format != "parquet":
+        filename += TEXT_COMPRESSION[compression][1]
+    return filename
+
+
+def _json_default(value):
+    # datetimes (from OCI models) go out as ISO strings
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+class ReportWriter:
+    """Incremental writer for report rows (dicts) - NDJSON, CSV or Parquet"""
+
+    def __init__(self, filename: str, format: str = "ndjson", fields: list = None, compression: str = None,
+                 flush_rows: int = DEFAULT_FLUSH_ROWS, delimiter: str = ",", atomic: bool = False, resume_key: str = None):
+
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported report format: {format} (use one of {FORMATS})")
+        if format == "parquet" and pyarrow is None:
+            raise ImportError("Parquet output requires pyarrow (pip3 install pyarrow)")
+        if compression and format != "parquet" and compression not in TEXT_COMPRESSION:
+            raise ValueError(f"Unsupported compression: {compression} (use one of {list(TEXT_COMPRESSION)})")
+        if resume_key and (format == "parquet" or compression or not atomic):
+            raise ValueError("Resume needs atomic=True and uncompressed ndjson/csv")
+
+        self.filename = filename
+        self.format = format
+        self.fields = list(fields) if fields else None
+        self.compression = compression
+        self.flush_rows = flush_rows
+        self.delimiter = delimiter
+        self.atomic = atomic
+        self.rows_written = 0
+        self.resumed = set()
+        # Where rows are written until close()
+        self.path = f"{filename}{PARTIAL_SUFFIX}" if atomic else filename
+
+        # Buffered rows not yet flushed
+        self._pending = []
+        self._file = None
+        self._csv = None
+        self._parquet = None
+        self._schema = None
+        self._closed = False
+
+        if resume_key and os.path.isfile(self.path):
+            self._resume(resume_key)
+        elif format != "parquet":
+            if compression:
+                opener = TEXT_COMPRESSION[compression][0]
+                self._file = opener(self.path, "wt", newline="", encoding="utf-8")
+            else:
+                self._file = open(self.path, "w", newline="", encoding="utf-8")
+
+    def _resume(self, resume_key: str):
+        """Keep the complete rows of an existing .partial and append after them"""
+        with open(self.path, "r+", newline="", encoding="utf-8") as partial:
+            content = partial.read()
+            # A run that died mid-write can leave a torn last line - drop it
+            complete = content[:content.rfind("\n") + 1]
+            partial.seek(0)
+            partial.truncate(len(complete.encode("utf-8")))
+        lines = complete.splitlines()
+        self._file = open(self.path, "a", newline="", encoding="utf-8")
+        if self.format == "csv" and lines:
+            reader = csv.DictReader(lines, delimiter=self.delimiter)
+            rows = list(reader)
+            # Header is already in the file - keep its columns
+            self.fields = reader.fieldnames
+            self._csv = csv.DictWriter(self._file, fieldnames=self.fields, delimiter=self.delimiter, extrasaction="ignore")
+        else:
+            rows = [json.loads(line) for line in lines if line.strip()]
+        self.resumed = {row.get(resume_key) for row in rows}
+        logger.info(f"Resuming {self.path}: {len(self.resumed)} rows already written")
+
+    def write(self, row: dict):
+        """Queue a row, flushing once flush_rows are pending"""
+        self._pending.append(row)
+        if len(self._pending) >= self.flush_rows:
+            self.flush()
+
+    def write_rows(self, rows):
+        """Write every row from an iterable (generator friendly)"""
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        """Write pending rows to the file"""
+        if not self._pending:
+            return
+        if self.format == "ndjson":
+            for row in self._pending:
+                self._file.write(json.dumps(row, default=_json_default))
+                self._file.write("\n")
+            self._file.flush()
+        elif self.format == "csv":
+            if not self._csv:
+                if not self.fields:
+                    self.fields = list(self._pending[0].keys())
+                self._csv = csv.DictWriter(self._file, fieldnames=self.fields, delimiter=self.delimiter, extrasaction="ignore")
+                self._csv.writeheader()
+            for row in self._pending:
+                self._csv.writerow({k: _csv_value(row.get(k)) for k in self.fields})
+            self._file.flush()
+        else:
+            self._flush_parquet()
+        self.rows_written += len(self._pending)
+        logger.debug(f"Flushed {len(self._pending)} rows to {self.filename} (total {self.rows_written})")
+        self._pending = []
+
+    def _flush_parquet(self):
+        # Columns come from fields or the first row; schema is fixed by the first batch
+        if not self.fields:
+            self.fields = list(self._pending[0].keys())
+        columns = {k: [row.get(k) for row in self._pending] for k in self.fields}
+        if self._schema is None:
+            table = pyarrow.table(columns)
+            # All-None columns in the first batch would be typed null - fall back to string
+            self._schema = pyarrow.schema([pyarrow.field(f.name, pyarrow.string()) if pyarrow.types.is_null(f.type) else f
+                                           for f in table.schema])
+            table = table.cast(self._schema)
+            self._parquet = pyarrow.parquet.ParquetWriter(self.path, self._schema,
+                                                          compression=self.compression or "snappy")
+        else:
+            table = pyarrow.table(columns, schema=self._schema)
+        self._parquet.write_table(table)
+
+    def close(self, complete: bool = True):
+        """Flush remaining rows and close the file - atomic writers are renamed into place if complete"""
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        if self.format == "parquet" and self._parquet is None:
+            # No rows - still write a readable file with the known columns (typed string)
+            self._schema = pyarrow.schema([pyarrow.field(name, pyarrow.string()) for name in self.fields or []])
+            self._parquet = pyarrow.parquet.ParquetWriter(self.path, self._schema, compression=self.compression or "snappy")
+        if self._parquet:
+            self._parquet.close()
+            self._parquet = None
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self.atomic and os.path.isfile(self.path):
+            if complete:
+                os.replace(self.path, self.filename)
+            else:
+                logger.warning(f"Incomplete - rows so far kept in {self.path}")
+        logger.debug(f"Closed {self.filename} with {self.rows_written} rows")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(complete=exc_type is None)
+        return False
+
+
+def read_rows(filename: str):
+    """Generator over rows of a report written by ReportWriter (format/compression from extension)"""
+    compression = None
+    name = filename
+    for key, (opener, extension) in TEXT_COMPRESSION.items():
+        if name.endswith(extension):
+            compression = key
+            name = name[:-len(extension)]
+    if name.endswith(".parquet"):
+        if pyarrow is None:
+            raise ImportError("Parquet input requires pyarrow (pip3 install pyarrow)")
+        parquet_file = pyarrow.parquet.ParquetFile(filename)
+        for batch in parquet_file.iter_batches():
+            yield from batch.to_pylist()
+        return
+
+    opener = TEXT_COMPRESSION[compression][0] if compression else open
+    with opener(filename, "rt", newline="", encoding="utf-8") as infile:
+        if name.endswith(".csv"):
+            for row in csv.DictReader(infile):
+                yield row
+        else:
+            for line in infile:
+                if line.strip():
+                    yield json.loads(line)
@@ -0,0 +1,155 @@
+# OCI Search Snapshot Cache
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Local snapshots of Resource Search results, shared by every fleet script of a tenancy.
+#
+# The ATP / ADW / ADB, DB system, VCN and block volume scripts each sweep Resource Search when
+# they start, often seconds apart in the same cron window.  SearchCache instead:
+# 1) Keys a snapshot by search endpoint (region) and normalized query - whitespace and keyword
+#    case do not matter, and a query with or without "return allAdditionalFields" is the same
+# 2) Always sweeps with allAdditionalFields, so the snapshot serves both forms
+# 3) Stores every result page in one SQLite row (.search-cache-<tenancy>.db) as zlib-compressed
+#    JSON, without the unset fields
+# 4) Serves a snapshot younger than the TTL (def 10 minutes) instead of searching - --refresh
+#    in the scripts sweeps again (and updates the snapshot for the others)
+#
+# FleetDiscovery (oci_fleet_discovery.py) stores its sweep as soon as it has every page, not
+# when the caller is done with the results.  SearchCache.search() is the cached version of
+# one paginated search_resources for the scripts that do not need discovery.
+
+# Usage:
+#   cache = SearchCache(cache_filename(tenancy_id), refresh=args.refresh)
+#   discovery = FleetDiscovery(search_client, identity_client, threads, cache=cache)
+#   vcns = cache.search(search_client, 'query vcn resources')
+
+import datetime
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import time
+import zlib
+
+from oci import pagination
+from oci.resource_search import ResourceSearchClient
+from oci.resource_search.models import ResourceSummary, StructuredSearchDetails
+from oci.util import to_dict
+
+logger = logging.getLogger('oci-search-cache')
+
+# Constants
+DEFAULT_TTL = 600                  # seconds - one cron window
+LOCK_TIMEOUT = 60.0
+PAGE_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshot (
+    key TEXT PRIMARY KEY,
+    endpoint TEXT,
+    query TEXT,
+    created REAL NOT NULL,
+    count INTEGER NOT NULL,
+    items BLOB NOT NULL
+);
+"""
+
+# Quoted values keep their case and spacing, everything else is normalized
+QUOTED = re.compile(r"""('[^']*'|"[^"]*")""")
+ALL_FIELDS = re.compile(r'\s+return\s+allAdditionalFields\b', re.IGNORECASE)
+QUERY_HEAD = re.compile(r'^(query\s+.+?\s+resources)', re.IGNORECASE)
+
+
+def cache_filename(tenancy_ocid: str) -> str:
+    return f'.search-cache-{tenancy_ocid}.db'
+
+
+def normalize_query(query: str) -> str:
+    """Query without "return allAdditionalFields", lower case and single spaced outside quotes"""
+    parts = QUOTED.split(ALL_FIELDS.sub("", query))
+    return "".join(part if index % 2 else " ".join(part.split()).lower()
+                   for index, part in enumerate(parts)).strip()
+
+
+def full_query(query: str) -> str:
+    """The query as swept - always with allAdditionalFields"""
+    query = ALL_FIELDS.sub("", query).strip()
+    return QUERY_HEAD.sub(r"\1 return allAdditionalFields", query, count=1)
+
+
+def client_endpoint(search_client) -> str:
+    # RateLimitedClient passes base_client through
+    return getattr(getattr(search_client, "base_client", None), "endpoint", None) or "default"
+
+
+def _compact(item) -> dict:
+    # search_context is only set for free text queries
+    return {k: v for k, v in to_dict(item).items() if v is not None and k != "search_context"}
+
+
+def _resource(fields: dict) -> ResourceSummary:
+    if "time_created" in fields:
+        fields["time_created"] = datetime.datetime.fromisoformat(fields["time_created"])
+    return ResourceSummary(**fields)
+
+
+class SearchCache:
+    """Resource Search snapshots in SQLite, per endpoint and normalized query, with a TTL"""
+
+    def __init__(self, filename: str, ttl: int = DEFAULT_TTL, refresh: bool = False):
+        self.filename = filename
+        self.ttl = ttl
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per call - region threads and other scripts use the same file
+        return sqlite3.connect(self.filename, timeout=LOCK_TIMEOUT)
+
+    @staticmethod
+    def cache_key(endpoint: str, query: str) -> str:
+        return hashlib.sha1(json.dumps([endpoint, normalize_query(query)]).encode()).hexdigest()
+
+    def get(self, endpoint: str, query: str):
+        """Cached ResourceSummary list, or None if there is no snapshot younger than the TTL (or refresh)"""
+        if self.refresh:
+            return None
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT created, items FROM snapshot WHERE key = ?",
+                                     (self.cache_key(endpoint, query),)).fetchone()
+        finally:
+            connection.close()
+        if not row or time.time() - row[0] >= self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        items = [_resource(fields) for fields in json.loads(zlib.decompress(row[1]))]
+        logger.info(f"Search cache hit ({time.time() - row[0]:.0f}s old, {len(items)} resources): {normalize_query(query)}")
+        return items
+
+    def put(self, endpoint: str, query: str, items: list):
+        blob = zlib.compress(json.dumps([_compact(item) for item in items], separators=(",", ":")).encode())
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO snapshot (key, endpoint, query, created, count, items) VALUES (?, ?, ?, ?, ?, ?)",
+                               (self.cache_key(endpoint, query), endpoint, normalize_query(query), time.time(), len(items), blob))
+        connection.close()
+        logger.debug(f"Search cache stored {len(items)} resources ({len(blob)} bytes): {normalize_query(query)}")
+
+    def search(self, search_client: ResourceSearchClient, query: str) -> list:
+        """Every result of the query (all pages) - from a fresh snapshot when there is one"""
+        endpoint = client_endpoint(search_client)
+        items = self.get(endpoint, query)
+        if items is None:
+            items = pagination.list_call_get_all_results(
+                search_client.search_resources,
+                search_details=StructuredSearchDetails(type="Structured", query=full_query(query)),
+                limit=PAGE_LIMIT
+            ).data
+            self.put(endpoint, query, items)
+        return items
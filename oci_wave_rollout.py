@@ -0,0 +1,170 @@
+# OCI Wave Rollout
+# Copyright (c) 2024, Oracle and/or its affiliates.  All rights reserved.
+# This software is dual-licensed to you under the Universal Permissive License (UPL) 1.0 as shown at https://oss.oracle.com/licenses/upl or Apache License 2.0 as shown at http://www.apache.org/licenses/LICENSE-2.0. You may choose either license.
+
+# Canary first, then waves - so a bad setting breaks a few resources instead of the whole fleet.
+#
+# The fleet scripts used to start every DB at once.  WaveRollout.run() instead:
+# 1) Starts a canary batch (-cn, def 2) and waits for all of it - any unhealthy canary stops the rollout
+# 2) Then lets more work be in flight wave by wave: 2x the canary, and doubled every time that
+#    many finish healthy.  Work is backfilled as soon as anything finishes (no wave barrier), so
+#    once the waves are healthy the fleet runs at full speed
+# 3) Keeps at most N resources per compartment in flight (-cc), so one compartment cannot take
+#    all the slots (or all of its DBs be mid-update at once)
+# 4) Trips a circuit breaker when the error rate of the last 20 outcomes reaches -er (def 20%,
+#    after at least 5) - nothing new starts, work in flight finishes, the rest is held
+#
+# Held resources come back with a None Future, so callers can report them (and a journaled run
+# can be resumed once the cause is fixed).  A health check that returns None means "nothing was
+# changed" (skipped, already compliant) - such work says nothing about the change being safe, so it
+# does not count as a healthy canary or toward a wave, or in the error rate, and frees its slot.
+
+# Usage:
+#   rollout = WaveRollout(canary=2, compartment_cap=20, error_rate=0.2, healthy=lambda r: "Error" not in r)
+#   for item, future in rollout.run(databases, lambda db: executor.submit(work, db), key=lambda db: db.compartment_id):
+#       result = future.result() if future else "held"
+#   if rollout.tripped: ...
+
+import logging
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future
+
+logger = logging.getLogger('oci-wave-rollout')
+
+# Constants
+DEFAULT_CANARY = 2
+DEFAULT_GROWTH = 2
+DEFAULT_COMPARTMENT_CAP = 20
+DEFAULT_ERROR_RATE = 0.2
+WINDOW = 20                        # outcomes the error rate is taken over
+MIN_OUTCOMES = 5                   # before the error rate can trip the breaker
+
+
+class WaveRollout:
+    """Canary, then doubling waves with per-compartment caps and an error-rate circuit breaker"""
+
+    def __init__(self, canary: int = DEFAULT_CANARY, growth: int = DEFAULT_GROWTH,
+                 compartment_cap: int = DEFAULT_COMPARTMENT_CAP, max_in_flight: int = None,
+                 error_rate: float = DEFAULT_ERROR_RATE, healthy=None):
+        self.canary = canary
+        self.growth = growth
+        self.compartment_cap = compartment_cap
+        self.max_in_flight = max_in_flight
+        self.error_rate = error_rate
+        self.healthy = healthy or (lambda result: True)
+        self.wave = 0
+        self.limit = canary
+        self.started = 0
+        self.completed = 0
+        self.failures = 0
+        self.held = 0
+        self.unchanged = 0
+        self.tripped = None
+        self._outcomes = deque(maxlen=WINDOW)
+        self._wave_healthy = 0
+
+    @property
+    def in_canary(self) -> bool:
+        return self.wave == 0 and self.canary > 0
+
+    def _next_wave(self):
+        self.wave += 1
+        self.limit = max(self.canary, 1) * self.growth ** self.wave
+        if self.max_in_flight:
+            self.limit = min(self.limit, self.max_in_flight)
+        self._wave_healthy = 0
+        logger.info(f"Wave {self.wave}: up to {self.limit} in flight ({self.completed} done, {self.failures} failed)")
+
+    def _room(self, running: int) -> bool:
+        if self.tripped:
+            return False
+        if self.in_canary:
+            return self.started - self.unchanged < self.canary
+        return running < self.limit
+
+    def _trip(self, reason: str):
+        if not self.tripped:
+            self.tripped = reason
+            logger.error(f"Rollout stopped: {reason} - letting {self.started - self.completed} in flight finish, holding the rest")
+
+    def _outcome(self, future: Future):
+        try:
+            ok = not future.cancelled() and future.exception() is None and self.healthy(future.result())
+        except Exception as exc:
+            logger.warning(f"Health check failed: {exc!r}")
+            ok = False
+        self.completed += 1
+        if ok is None:
+            # Nothing was changed - no evidence either way
+            self.unchanged += 1
+            return
+        ok = bool(ok)
+        self._outcomes.append(ok)
+        if not ok:
+            self.failures += 1
+
+        if self.in_canary:
+            if not ok:
+                self._trip("canary failed")
+            elif self.completed - self.unchanged == self.canary:
+                logger.info(f"Canary of {self.canary} healthy")
+                self._next_wave()
+            return
+        failed = self._outcomes.count(False)
+        if len(self._outcomes) >= MIN_OUTCOMES and failed / len(self._outcomes) >= self.error_rate:
+            self._trip(f"{failed} of the last {len(self._outcomes)} failed")
+        elif ok:
+            self._wave_healthy += 1
+            if self._wave_healthy >= self.limit and self.limit != self.max_in_flight:
+                self._next_wave()
+
+    def run(self, items, start, key=lambda item: None) -> list:
+        """Start items through start(item) -> Future in canary / waves - [(item, Future or None if held)]
+
+        items can be a generator - it is only read as far as needed to fill free slots."""
+        source = iter(items)
+        pending = []                   # read, but their compartment is full
+        running = {}
+        per_key = {}
+        work = []
+
+        def next_item():
+            for index, item in enumerate(pending):
+                if not self.compartment_cap or per_key.get(key(item), 0) < self.compartment_cap:
+                    return pending.pop(index)
+            for item in source:
+                if not self.compartment_cap or per_key.get(key(item), 0) < self.compartment_cap:
+                    return item
+                pending.append(item)
+            return None
+
+        if self.canary:
+            logger.info(f"Canary: {self.canary}, then waves x{self.growth}"
+                        f"{f', {self.compartment_cap} per compartment' if self.compartment_cap else ''}")
+        else:
+            self._next_wave()
+        while True:
+            while self._room(len(running)):
+                item = next_item()
+                if item is None:
+                    break
+                future = start(item)
+                running[future] = item
+                per_key[key(item)] = per_key.get(key(item), 0) + 1
+                work.append((item, future))
+                self.started += 1
+            if not running:
+                break
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                per_key[key(running.pop(future))] -= 1
+                self._outcome(future)
+
+        # Stopped early - everything not started is held
+        for item in (pending + list(source) if self.tripped else pending):
+            work.append((item, None))
+            self.held += 1
+        logger.info(f"Rollout: {self.completed} done ({self.failures} unhealthy, {self.unchanged} unchanged) in {self.wave} wave(s)"
+                    f"{f', {self.held} held' if self.held else ''}")
+        return work